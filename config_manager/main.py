@@ -3,19 +3,16 @@ from datetime import datetime
 import multiprocessing as mp
 import logging.config
 import logging as log
+import threading
 import time
 import sys
 import os
 import socket
 import io
 import requests
-import tensorflow as tf
 
 from model_manager_lib.tfserving import TensorflowServingConfig
 
-tf.config.threading.set_inter_op_parallelism_threads(1)
-tf.config.threading.set_intra_op_parallelism_threads(1)
-
 from fcache.cache import FileCache
 import uvicorn
 import uvloop
@@ -25,7 +22,7 @@ import statsd
 
 import model_manager_lib
 
-from model_manager_lib import tfserving, local_filesystem, PriorityEndpoint, RecordKey
+from model_manager_lib import tfserving, local_filesystem, local_catalog, PriorityEndpoint, RecordKey
 
 logging.config.fileConfig("logging.cfg", disable_existing_loggers=False)
 
@@ -38,10 +35,23 @@ MASTER_URL = os.environ["MASTER_URL"]
 ENVIRONMENT = os.environ["ENVIRONMENT"]
 assert ENVIRONMENT in ["production", "integ", "staging", "test"]
 LOCAL_MODEL_DIRECTORY = os.environ["LOCAL_MODEL_DIRECTORY"]
+LOCAL_MODEL_INDEX_ENABLED = os.environ.get("LOCAL_MODEL_INDEX_ENABLED", "false").lower() == "true"
+LOCAL_CATALOG_ENABLED = os.environ.get("LOCAL_CATALOG_ENABLED", "false").lower() == "true"
+LOCAL_TRASH_ENABLED = os.environ.get("LOCAL_TRASH_ENABLED", "false").lower() == "true"
+LOCAL_TRASH_BYTES_PER_SECOND = int(os.environ.get("LOCAL_TRASH_BYTES_PER_SECOND", 256 * 1024 ** 2))
 TENSORFLOW_SERVING_CONFIG_FILE = os.environ["TENSORFLOW_SERVING_CONFIG_FILE"]
 TENSORFLOW_SERVING_GRPC_TARGET = os.environ["TENSORFLOW_SERVING_GRPC_TARGET"]
 CONFIG_UPDATE_FREQUENCY = int(os.environ["CONFIG_UPDATE_FREQUENCY"])
 MAX_CONFIG_UPDATE_WAIT_TIME = CONFIG_UPDATE_FREQUENCY * 4
+# "poll" leaves it to tensorflow serving to notice the saved config file, "push"
+# also sends each saved config through HandleReloadConfigRequest
+TENSORFLOW_SERVING_RELOAD_MODE = os.environ.get("TENSORFLOW_SERVING_RELOAD_MODE", "poll").lower()
+assert TENSORFLOW_SERVING_RELOAD_MODE in ["poll", "push"]
+# how long added versions are polled for to report their load time, 0 disables it
+MODEL_LOAD_TIMEOUT = int(os.environ.get("MODEL_LOAD_TIMEOUT", 900))
+MODEL_LOAD_POLL_INTERVAL = float(
+    os.environ.get("MODEL_LOAD_POLL_INTERVAL", tfserving.DEFAULT_LOAD_POLL_INTERVAL)
+)
 
 server_start_time = time.time()
 
@@ -49,6 +59,21 @@ app = fastapi.FastAPI()
 statsd_client = statsd.StatsClient(host="localhost", port=8125, prefix=f'modelmanager.config.{HOSTNAME}')
 
 
+if LOCAL_MODEL_INDEX_ENABLED:
+    local_filesystem.watch(LOCAL_MODEL_DIRECTORY)
+
+local_model_catalog = None
+if LOCAL_CATALOG_ENABLED:
+    local_model_catalog = local_catalog.LocalCatalog(LOCAL_MODEL_DIRECTORY)
+    local_filesystem.use_catalog(local_model_catalog)
+
+if LOCAL_TRASH_ENABLED:
+    local_filesystem.use_trash(
+        LOCAL_MODEL_DIRECTORY,
+        max_bytes_per_second=LOCAL_TRASH_BYTES_PER_SECOND,
+        statsd_client=statsd_client,
+    )
+
 config_update_data = FileCache("config_update_data")
 local_model_remove_data = FileCache("local_model_remove_data")
 
@@ -63,6 +88,9 @@ def root():
         "tensorflow_serving_config_file": TENSORFLOW_SERVING_CONFIG_FILE,
         "tensorflow_serving_grpc_target": TENSORFLOW_SERVING_GRPC_TARGET,
         "config_update_frequency": CONFIG_UPDATE_FREQUENCY,
+        "tensorflow_serving_reload_mode": TENSORFLOW_SERVING_RELOAD_MODE,
+        "local_trash_enabled": LOCAL_TRASH_ENABLED,
+        "local_catalog_enabled": LOCAL_CATALOG_ENABLED,
     }
 
 
@@ -89,6 +117,7 @@ def health_check():
         "registration": register(),
         "config_update": health_check_config_update(),
         "local_model_remove": health_check_local_model_remove(),
+        "local_catalog": local_model_catalog.summary() if local_model_catalog else None,
     }
 
 
@@ -236,6 +265,25 @@ def run_fn_with_logging_wrapped(fn: callable, log_level=logging.DEBUG, **kwargs)
         return log_stream.getvalue(), status_code
 
 
+def reload_tensorflow_serving_config(config: TensorflowServingConfig):
+    """Pushes an already saved config to tensorflow serving when in push mode. A
+    failed push is only logged, tensorflow serving still picks up the saved file
+    on its next poll.
+    """
+    if TENSORFLOW_SERVING_RELOAD_MODE != "push":
+        return
+
+    try:
+        with statsd_client.timer("config_reload_time"):
+            tfserving.reload_config(TENSORFLOW_SERVING_GRPC_TARGET, config)
+    except Exception as err:
+        statsd_client.incr("config_reload_failures")
+        log.exception(
+            "failed to push config to tensorflow serving! waiting on file poll",
+            exc_info=err,
+        )
+
+
 def pull_local_model_changes_into_config():
     start_time = time.time()
 
@@ -271,16 +319,20 @@ def pull_local_model_changes_into_config():
     log.info(f"found records to add: {records_to_add}")
     statsd_client.gauge("records_to_add", len(records_to_add))  # can be indication of tfserving container failing
 
+    batch = config.batch()
     for record_key, record in records_to_add.items():
         log.info(
             f"unknown model_name={record_key.name}. Adding to tensorflow serving config!"
         )
-        config = tfserving.add_model(
-            tensorflow_serving_config=config,
-            record=record,
-            local_path=record.local_model_path,
+        batch.add_model(record=record, local_path=record.local_model_path)
+    with statsd_client.timer("config_commit_time"):
+        config = batch.commit()
+    config_changed_time = time.time()
+    if records_to_add:
+        reload_tensorflow_serving_config(config)
+        report_model_load_times(
+            list(records_to_add.values()), known_tensorflow_serving_models, config_changed_time
         )
-        log.info(f"new tensorflow serving config: {config}")
 
     log.info(f"ending tensorflow serving config: {config}")
     log.info("finished pulling local models into the config.")
@@ -291,12 +343,63 @@ def pull_local_model_changes_into_config():
     config_update_data.sync()
 
 
+def report_model_load_times(records, known_tensorflow_serving_models, config_changed_time: float):
+    """Reports how long each added version took from the config change to being
+    AVAILABLE in tensorflow serving, as the tfserving.load_time timer. The versions
+    are polled every MODEL_LOAD_POLL_INTERVAL on a background thread, so the config
+    update isn't held up for up to MODEL_LOAD_TIMEOUT. Versions that were already
+    AVAILABLE, e.g. added back for a priority change, are skipped.
+    """
+    available = {
+        (record_key, tfserving_record.version)
+        for record_key, tfserving_records in known_tensorflow_serving_models.items()
+        for tfserving_record in tfserving_records
+        if tfserving_record.status == tfserving.TensorflowServingModelStatus.AVAILABLE
+    }
+    records = [record for record in records if (record.key, record.version) not in available]
+    if MODEL_LOAD_TIMEOUT <= 0 or not records:
+        return None
+
+    thread = threading.Thread(
+        target=_report_model_load_times,
+        args=(records, config_changed_time),
+        name="model_load_times",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def _report_model_load_times(records, config_changed_time: float):
+    try:
+        load_times = tfserving.wait_for_versions_available(
+            TENSORFLOW_SERVING_GRPC_TARGET,
+            records,
+            timeout=MODEL_LOAD_TIMEOUT,
+            poll_interval=MODEL_LOAD_POLL_INTERVAL,
+            start_time=config_changed_time,
+        )
+    except Exception as err:
+        log.exception("failed to poll tensorflow serving for load times", exc_info=err)
+        return
+
+    for load_time in load_times.values():
+        statsd_client.timing("tfserving.load_time", load_time * 1000)
+    if len(load_times) < len(records):
+        statsd_client.incr("tfserving.load_timeouts", len(records) - len(load_times))
+    load_times = {f"{key.name}/{version}": took for (key, version), took in load_times.items()}
+    log.info(f"versions became available load_times={load_times}")
+
+
 def remove_local_priority_model(framework: str, name: str):
     # start_time = time.time()
     log.info("initiating remove_local_priroty_model")
     key = RecordKey(framework=framework, name=name)
     config = tfserving.load_config(TENSORFLOW_SERVING_CONFIG_FILE)
     log.info(f"initial config = {config}")
+    # swap the priority model for the regular one in a single config write, so
+    # tensorflow serving never polls a config without the model in it
+    batch = config.batch()
     if name in config.model_config_lookup:
         all_current_tfserving_models = tfserving.get_current_tensorflow_serving_models(
             grpc_target=TENSORFLOW_SERVING_GRPC_TARGET, tensorflow_serving_config=config
@@ -305,7 +408,7 @@ def remove_local_priority_model(framework: str, name: str):
             name in all_current_tfserving_models
             and all_current_tfserving_models[name].is_priority
         ):
-            tfserving.remove_model(config, key)
+            batch.remove_model(key)
 
     local_filesystem.delete_local_priority_record(
         local_model_directory=LOCAL_MODEL_DIRECTORY, key=key
@@ -315,11 +418,9 @@ def remove_local_priority_model(framework: str, name: str):
         model_directory=LOCAL_MODEL_DIRECTORY,
         framework="tensorflow",
     )
-    config = tfserving.add_model(
-        tensorflow_serving_config=config,
-        record=locals[key],
-        local_path=locals[key].local_model_path,
-    )
+    batch.add_model(record=locals[key], local_path=locals[key].local_model_path)
+    config = batch.commit()
+    reload_tensorflow_serving_config(config)
     log.info(f"new tensorflow serving config: {config}")
 
 
@@ -409,10 +510,14 @@ def remove_local_models_by_key(framework: str, name: str):
     )
     log.info(f"known local records = {all_local_records_bykey}")
 
+    batch = config.batch()
     for record_key in all_known_tfserving_models:
         if record_key.name == name and record_key.framework == framework:
             log.info(f"remove record_key {record_key} from tfserving config")
-            tfserving.remove_model(config, record_key)
+            batch.remove_model(record_key)
+    config = batch.commit()
+    if batch.changes:
+        reload_tensorflow_serving_config(config)
 
     for record_key, records in all_local_records_bykey.items():
         for record in records:
@@ -0,0 +1,282 @@
+"""
+Caching gateway in front of GCS for the remote_model_pullers of a cluster.
+
+Pullers started with GCS_GATEWAY_URL pointing here list and download through
+this service instead of GCS, see model_manager_lib.gateway. Objects are kept
+in a bounded on-disk LRU and concurrent requests for the same object, listing
+or metadata share a single upstream call, so a release fetches each tarball
+from GCS once per gateway rather than once per puller.
+
+The cache, listing and coalescing state live in the process, run it with
+HTTP_WORKERS=1.
+"""
+from typing import Optional
+import logging.config
+import logging as log
+import threading
+import asyncio
+import pathlib
+import socket
+import time
+import os
+
+import fastapi
+from fastapi.concurrency import run_in_threadpool
+import statsd
+import uvicorn
+import uvloop
+from google.api_core import exceptions as gcs_exceptions
+
+from model_manager_lib import gcs, gateway
+from model_manager_lib.gcs import GcsApi
+
+HOSTNAME = socket.gethostname()
+HTTP_HOST = "0.0.0.0"
+HTTP_PORT = os.environ["HTTP_PORT"]
+HTTP_WORKERS = os.environ["HTTP_WORKERS"]
+ENVIRONMENT = os.environ["ENVIRONMENT"].lower()
+assert ENVIRONMENT in ["production", "integ", "staging", "test"]
+assert HTTP_WORKERS == "1", "the gateway cache lives in the process, run a single worker"
+
+GATEWAY_CACHE_DIRECTORY = pathlib.Path(os.environ["GATEWAY_CACHE_DIRECTORY"]).absolute()
+GATEWAY_CACHE_MAX_BYTES = int(os.environ.get("GATEWAY_CACHE_MAX_BYTES", 100 * 1024 ** 3))
+# listings and object metadata are answered from memory for this long
+GATEWAY_LISTING_MAX_AGE = int(os.environ.get("GATEWAY_LISTING_MAX_AGE", 30))
+DOWNLOAD_THREADS = int(os.environ.get("DOWNLOAD_THREADS", gcs.DEFAULT_DOWNLOAD_THREADS))
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", gcs.DEFAULT_DOWNLOAD_CHUNK_SIZE))
+
+__VERSION__ = "0.0.1"
+
+app = fastapi.FastAPI()
+logging.config.fileConfig("logging.cfg", disable_existing_loggers=False)
+start_time = time.time()
+
+statsd_client = statsd.StatsClient(host="localhost", port=8125, prefix=f'modelmanager.gateway.{HOSTNAME}')
+
+object_cache = gateway.GatewayObjectCache(
+    GATEWAY_CACHE_DIRECTORY, max_bytes=GATEWAY_CACHE_MAX_BYTES, statsd_client=statsd_client
+)
+metadata_coalescer = gateway.Coalescer()
+metadata_cache = {}
+metadata_cache_lock = threading.Lock()
+# object cache key -> the task filling it, only touched from the event loop
+object_fills = {}
+
+
+@app.get("/")
+def root():
+    return {
+        "environment": ENVIRONMENT,
+        "version": __VERSION__,
+        "uptime": time.time() - start_time,
+        "gateway_cache_directory": GATEWAY_CACHE_DIRECTORY,
+        "gateway_cache_max_bytes": GATEWAY_CACHE_MAX_BYTES,
+        "gateway_listing_max_age": GATEWAY_LISTING_MAX_AGE,
+        "download_threads": DOWNLOAD_THREADS,
+        "download_chunk_size": DOWNLOAD_CHUNK_SIZE,
+        "cache": object_cache.stats,
+    }
+
+
+@app.get("/health/ping")
+@app.get("/ping")
+def ping():
+    return ["pong"]
+
+
+@app.get("/health")
+@app.get("/health/check")
+@app.get("/health/test")
+def health_check():
+    return {"status": "green"}
+
+
+def cached_upstream(key: tuple, fn, refresh: bool = False):
+    """Answers from memory within GATEWAY_LISTING_MAX_AGE, otherwise calls fn once
+    for every concurrent caller asking for the same key.
+    """
+    now = time.time()
+    with metadata_cache_lock:
+        cached = metadata_cache.get(key)
+    if cached and not refresh and now - cached[0] <= GATEWAY_LISTING_MAX_AGE:
+        statsd_client.incr("metadata.hits")
+        return cached[1]
+
+    def fetch():
+        value = fn()
+        with metadata_cache_lock:
+            metadata_cache[key] = (time.time(), value)
+        return value
+
+    value, coalesced = metadata_coalescer.run(key, fetch)
+    statsd_client.incr("metadata.coalesced" if coalesced else "metadata.misses")
+    return value
+
+
+def get_object_metadata(bucket_name: str, name: str, refresh: bool = False) -> Optional[dict]:
+    def fetch():
+        blob = GcsApi.get_client().get_bucket(bucket_name).get_blob(name)
+        return gateway.blob_to_dict(blob) if blob else None
+
+    return cached_upstream(("object", bucket_name, name), fetch, refresh=refresh)
+
+
+@app.get("/b/{bucket_name}/o")
+def list_objects(bucket_name: str, prefix: str = "", delimiter: str = None):
+    def fetch():
+        client = GcsApi.get_client()
+        iterator = client.list_blobs(
+            client.get_bucket(bucket_name), prefix=prefix, delimiter=delimiter
+        )
+        items = [gateway.blob_to_dict(blob) for blob in iterator]
+        return {"items": items, "prefixes": sorted(iterator.prefixes)}
+
+    return cached_upstream(("list", bucket_name, prefix, delimiter), fetch)
+
+
+async def open_cached_object(key: str, size: int, fill):
+    """Opens the cached object, filling it first when it is missing.
+
+    The fill runs on the threadpool once per key. Every other request for the
+    object awaits it on the event loop rather than blocking a threadpool thread
+    of its own, so pullers all asking for a new tarball can't starve the
+    threadpool that serves listings and cache hits.
+    """
+    if size <= object_cache.max_bytes:
+        fill_task = object_fills.get(key)
+        if fill_task is None:
+            fill_task = object_fills[key] = asyncio.ensure_future(
+                run_in_threadpool(lambda: object_cache.open(key, size, fill).close())
+            )
+            fill_task.add_done_callback(lambda _: object_fills.pop(key, None))
+        else:
+            statsd_client.incr("objects.coalesced")
+        # a request going away must not cancel the fill the others wait on
+        await asyncio.shield(fill_task)
+    return await run_in_threadpool(object_cache.open, key, size, fill)
+
+
+@app.get("/b/{bucket_name}/o/{name:path}")
+async def get_object(
+    bucket_name: str,
+    name: str,
+    request: fastapi.Request,
+    alt: str = None,
+    ifGenerationMatch: int = None,
+):
+    metadata = await run_in_threadpool(get_object_metadata, bucket_name, name)
+    if metadata and ifGenerationMatch is not None and metadata["generation"] != ifGenerationMatch:
+        # the cached metadata may just be stale
+        metadata = await run_in_threadpool(get_object_metadata, bucket_name, name, True)
+    if metadata is None:
+        raise fastapi.HTTPException(status_code=404, detail=f"gs://{bucket_name}/{name} not found")
+    if ifGenerationMatch is not None and metadata["generation"] != ifGenerationMatch:
+        raise fastapi.HTTPException(
+            status_code=412,
+            detail=f"gs://{bucket_name}/{name} is at generation {metadata['generation']}",
+        )
+    if alt != "media":
+        return metadata
+
+    generation = metadata["generation"]
+
+    def fill(path: pathlib.Path):
+        with statsd_client.timer("upstream.download"):
+            blob = GcsApi.get_client().get_bucket(bucket_name).get_blob(name, generation=generation)
+            if blob is None:
+                raise gcs_exceptions.NotFound(f"gs://{bucket_name}/{name}#{generation} not found")
+            gcs.download_blob_in_chunks(
+                blob,
+                path,
+                chunk_size=DOWNLOAD_CHUNK_SIZE,
+                max_workers=DOWNLOAD_THREADS,
+                client=GcsApi.get_client(),
+                statsd_client=statsd_client,
+            )
+        statsd_client.incr("upstream.bytes", metadata["size"])
+
+    try:
+        object_file = await open_cached_object(
+            gateway.object_cache_key(bucket_name, name, generation), metadata["size"], fill
+        )
+    except gcs_exceptions.NotFound as err:
+        raise fastapi.HTTPException(status_code=404, detail=str(err))
+    except gcs_exceptions.PreconditionFailed as err:
+        raise fastapi.HTTPException(status_code=412, detail=str(err))
+
+    start, end = parse_range(request.headers.get("range"), metadata["size"])
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+        "x-goog-generation": str(generation),
+    }
+    status_code = 200
+    if request.headers.get("range"):
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{metadata['size']}"
+    statsd_client.incr("served.bytes", end - start + 1)
+    return fastapi.responses.StreamingResponse(
+        iter_file_range(object_file, start, end),
+        status_code=status_code,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
+
+
+def parse_range(range_header: Optional[str], size: int):
+    """Parses a single "bytes=start-end" range into inclusive offsets, the whole
+    object when there is no range header.
+    """
+    if not range_header:
+        return 0, size - 1
+    try:
+        unit, byte_range = range_header.split("=", 1)
+        start, end = byte_range.split("-", 1)
+        assert unit.strip() == "bytes" and "," not in byte_range
+        if start == "":
+            start, end = size - int(end), size - 1
+        else:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+    except (ValueError, AssertionError):
+        raise fastapi.HTTPException(status_code=400, detail=f"unsupported range {range_header}")
+    if start < 0 or start > end:
+        raise fastapi.HTTPException(status_code=416, detail=f"unsatisfiable range {range_header}")
+    return start, end
+
+
+def iter_file_range(object_file, start: int, end: int):
+    try:
+        object_file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = object_file.read(min(gateway.GATEWAY_READ_SIZE, remaining))
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+    finally:
+        object_file.close()
+
+
+if __name__ == "__main__":
+    statsd_client.incr("startup")
+    try:
+        log.warning(f"starting webserver at {HOSTNAME}:{HTTP_PORT}")
+        uvicorn.run(
+            "main:app",
+            loop="uvloop",
+            access_log=ENVIRONMENT == "test",
+            log_config="logging.cfg",
+            debug=ENVIRONMENT == "test",
+            reload=ENVIRONMENT == "test",
+            port=int(HTTP_PORT),
+            use_colors=False,
+            host=HTTP_HOST,
+            workers=int(HTTP_WORKERS),
+        )
+    except Exception as err:
+        log.exception(
+            "unhandled exception thrown during uvicorn server run", exc_info=err
+        )
+    finally:
+        log.critical("webserver stopped for some reason!")
@@ -3,7 +3,11 @@
 # reserved. For use only by Accretive Technology, its employees
 # and contractors. DO NOT DISTRIBUTE.
 import logging.config
+import multiprocessing as mp
 import logging as log
+import contextlib
+import asyncio
+import fcntl
 import time
 import sys
 import fastapi
@@ -11,12 +15,14 @@ import datetime
 from pydantic import BaseModel
 import os
 import requests
+import httpx
 from typing import Literal
 import socket
 
 import model_manager_lib
 
-from model_manager_lib import gcs, PriorityEndpoint
+from model_manager_lib import gcs, peer, retention, PriorityEndpoint
+from fastapi.concurrency import run_in_threadpool
 import uvloop
 import uvicorn
 
@@ -33,6 +39,20 @@ start_time = time.time()
 REMOTE_MODEL_DIRECTORY = model_manager_lib.load_remote_model_directory(
     os.environ["REMOTE_MODEL_DIRECTORY"], os.environ["ENVIRONMENT"]
 )
+REMOTE_INDEX_ENABLED = os.environ.get("REMOTE_INDEX_ENABLED", "false").lower() == "true"
+REMOTE_INDEX_REBUILD_FREQUENCY = int(os.environ.get("REMOTE_INDEX_REBUILD_FREQUENCY", 0))
+REMOTE_LATEST_POINTERS_ENABLED = os.environ.get("REMOTE_LATEST_POINTERS_ENABLED", "false").lower() == "true"
+CLUSTER_REPORT_CONCURRENCY = int(os.environ.get("CLUSTER_REPORT_CONCURRENCY", 20))
+CLUSTER_REPORT_NODE_DEADLINE = float(os.environ.get("CLUSTER_REPORT_NODE_DEADLINE", 3))
+PEER_FANOUT = int(os.environ.get("PEER_FANOUT", peer.DEFAULT_PEER_FANOUT))
+PEER_GCS_SEEDS = int(os.environ.get("PEER_GCS_SEEDS", peer.DEFAULT_PEER_GCS_SEEDS))
+PEER_LEASE_SECONDS = int(os.environ.get("PEER_LEASE_SECONDS", peer.DEFAULT_PEER_LEASE_SECONDS))
+RETENTION_KEEP_VERSIONS = int(os.environ.get("RETENTION_KEEP_VERSIONS", retention.DEFAULT_KEEP_VERSIONS))
+RETENTION_DELETE_BATCH_SIZE = int(
+    os.environ.get("RETENTION_DELETE_BATCH_SIZE", retention.DEFAULT_DELETE_BATCH_SIZE)
+)
+RETENTION_DELETE_THREADS = int(os.environ.get("RETENTION_DELETE_THREADS", retention.DEFAULT_DELETE_THREADS))
+NODE_REQUEST_TIMEOUT = 1
 
 __VERSION__ = "0.0.1"
 
@@ -51,6 +71,9 @@ registered_config_manager_cache = FileCache(
 registered_remote_model_puller_cache = FileCache(
     ".registered_remote_model_puller_cache", flag="cs"
 )
+# which pullers hold or are fetching each version, shared by every http worker
+peer_distribution_cache = FileCache(".peer_distribution_cache", flag="cs")
+PEER_DISTRIBUTION_LOCK_FILE = ".peer_distribution_cache.lock"
 
 
 class NodeEndpoint(BaseModel):
@@ -58,6 +81,54 @@ class NodeEndpoint(BaseModel):
     target: str
 
 
+class PeerEndpoint(BaseModel):
+    target: str
+    framework: str
+    name: str
+    version: int
+
+
+class PeerFetchResult(PeerEndpoint):
+    success: bool
+
+
+class AsyncNodeClient:
+    """Shared async http client for fanning requests out to the nodes. Connections
+    are pooled and kept alive between reports, and the semaphore caps how many
+    requests are in flight across the whole cluster at once.
+    """
+
+    client: httpx.AsyncClient = None
+    semaphore: asyncio.Semaphore = None
+
+    @classmethod
+    def setup(cls):
+        if not cls.client:
+            limits = httpx.Limits(
+                max_connections=CLUSTER_REPORT_CONCURRENCY,
+                max_keepalive_connections=CLUSTER_REPORT_CONCURRENCY,
+            )
+            cls.client = httpx.AsyncClient(limits=limits, timeout=NODE_REQUEST_TIMEOUT)
+            cls.semaphore = asyncio.Semaphore(CLUSTER_REPORT_CONCURRENCY)
+
+    @classmethod
+    async def close(cls):
+        if cls.client:
+            await cls.client.aclose()
+            cls.client = None
+            cls.semaphore = None
+
+
+@app.on_event("startup")
+def setup_async_node_client():
+    AsyncNodeClient.setup()
+
+
+@app.on_event("shutdown")
+async def close_async_node_client():
+    await AsyncNodeClient.close()
+
+
 @app.get("/")
 def root():
     return {
@@ -65,6 +136,10 @@ def root():
         "version": __VERSION__,
         "uptime": time.time() - start_time,
         "remote_model_directory": REMOTE_MODEL_DIRECTORY,
+        "remote_index_enabled": REMOTE_INDEX_ENABLED,
+        "remote_latest_pointers_enabled": REMOTE_LATEST_POINTERS_ENABLED,
+        "peer_fanout": PEER_FANOUT,
+        "peer_gcs_seeds": PEER_GCS_SEEDS,
         "config_manager_nodes": registered_config_manager_cache.items(),
         "remote_model_puller_nodes": registered_remote_model_puller_cache.items(),
     }
@@ -109,10 +184,7 @@ def get_data_for_path(
     except requests.exceptions.Timeout as err:
         ret_str = f"failed on request {err}"
         log.exception(f"failed on request {target}{path}", exc_info=err)
-        if node_type == "config_manager":
-            del registered_config_manager_cache[target]
-        else:
-            del registered_remote_model_puller_cache[target]
+        unregister_timed_out_node(node_type, target)
     except Exception as err:
         ret_str = f"failed on request {err}"
         log.exception(f"failed on request {target}{path}", exc_info=err)
@@ -120,44 +192,352 @@ def get_data_for_path(
     return ret_str
 
 
+async def async_get_data_for_path(
+    node_type, method, target, path, json_data=None, ret_format="json", deadline: float = None
+) -> str:
+    """Async version of get_data_for_path, sent through the shared AsyncNodeClient.
+    It will remove a node from registration cache if it resulted a timeout error.
+
+    The deadline only starts once the request holds the AsyncNodeClient semaphore,
+    so time spent queued behind other nodes never counts against it. A request
+    past its deadline raises asyncio.TimeoutError.
+    """
+    AsyncNodeClient.setup()
+    try:
+        async with AsyncNodeClient.semaphore:
+            res = await asyncio.wait_for(
+                AsyncNodeClient.client.request(method, f"http://{target}{path}", json=json_data),
+                timeout=deadline,
+            )
+        # Response.is_success only exists from httpx 0.20
+        if not res.is_error and ret_format == "json":
+            ret_str = res.json()
+        elif not res.is_error:
+            ret_str = res.text
+        else:
+            ret_str = ""
+    except asyncio.TimeoutError:
+        raise
+    except httpx.TimeoutException as err:
+        ret_str = f"failed on request {err!r}"
+        log.exception(f"failed on request {target}{path}", exc_info=err)
+        unregister_timed_out_node(node_type, target)
+    except Exception as err:
+        ret_str = f"failed on request {err!r}"
+        log.exception(f"failed on request {target}{path}", exc_info=err)
+
+    return ret_str
+
+
+def unregister_timed_out_node(node_type, target):
+    if node_type == "config_manager":
+        registered_config_manager_cache.pop(target, None)
+    else:
+        registered_remote_model_puller_cache.pop(target, None)
+
+
+async def gather_node_data(node_type: str, target: str, paths: dict) -> tuple:
+    """Fetches every path for a single node concurrently under the node deadline.
+
+    Each call gets CLUSTER_REPORT_NODE_DEADLINE from the moment it is sent, not
+    from when the report started, so a large cluster queueing on the
+    AsyncNodeClient semaphore doesn't fail healthy nodes. Calls that finish in
+    time keep their result, the rest are reported as exceeding it, so one slow
+    node only costs the report its own missing data.
+
+    :param node_type: str representing type of node
+    :param target: the node to query
+    :param paths: dict of result name to (path, ret_format)
+    :return: tuple of (results, latencies in ms)
+    """
+    node_start_time = time.time()
+    latencies = {}
+
+    async def timed(name, path, ret_format):
+        start = time.time()
+        try:
+            data = await async_get_data_for_path(
+                node_type, "GET", target, path, None, ret_format,
+                deadline=CLUSTER_REPORT_NODE_DEADLINE,
+            )
+        except asyncio.TimeoutError:
+            latencies[name] = None
+            return f"failed to respond within deadline {CLUSTER_REPORT_NODE_DEADLINE}s"
+        latencies[name] = round((time.time() - start) * 1000, 2)
+        return data
+
+    names = list(paths)
+    results = await asyncio.gather(
+        *[timed(name, *paths[name]) for name in names]
+    )
+    latencies["total"] = round((time.time() - node_start_time) * 1000, 2)
+    return dict(zip(names, results)), latencies
+
+
 @app.get("/report_cluster_state")
-def report_cluster_state():
-    def get_local_filesystem(target, node_type):
-        return get_data_for_path(node_type, "GET", target, "/local/all")
+async def report_cluster_state():
+    report_start_time = time.time()
+    config_manager_paths = {
+        "local_filesystem": ("/local/all", "json"),
+        "serving_all": ("/tensorflow_serving/all", "json"),
+        "serving_config": ("/tensorflow_serving/config", "text"),
+    }
+    remote_model_puller_paths = {
+        "local_filesystem": ("/local/all", "json"),
+    }
 
-    def get_serving_all(target):
-        return get_data_for_path(
-            "config_manager", "GET", target, "/tensorflow_serving/all"
-        )
+    config_manager_nodes = list(registered_config_manager_cache.keys())
+    remote_model_puller_nodes = list(registered_remote_model_puller_cache.keys())
+    responses = await asyncio.gather(
+        *[
+            gather_node_data("config_manager", node, config_manager_paths)
+            for node in config_manager_nodes
+        ],
+        *[
+            gather_node_data("remote_model_puller", node, remote_model_puller_paths)
+            for node in remote_model_puller_nodes
+        ],
+    )
+    config_manager_responses = responses[: len(config_manager_nodes)]
+    remote_model_puller_responses = responses[len(config_manager_nodes):]
 
-    def get_serving_config(target):
-        return get_data_for_path(
-            "config_manager", "GET", target, "/tensorflow_serving/config", None, "text"
-        )
+    return {
+        "config_manager": {
+            node: data
+            for node, (data, _) in zip(config_manager_nodes, config_manager_responses)
+        },
+        "remote_model_puller": {
+            node: data
+            for node, (data, _) in zip(
+                remote_model_puller_nodes, remote_model_puller_responses
+            )
+        },
+        "latency": {
+            "config_manager": {
+                node: latencies
+                for node, (_, latencies) in zip(
+                    config_manager_nodes, config_manager_responses
+                )
+            },
+            "remote_model_puller": {
+                node: latencies
+                for node, (_, latencies) in zip(
+                    remote_model_puller_nodes, remote_model_puller_responses
+                )
+            },
+            "total": round((time.time() - report_start_time) * 1000, 2),
+        },
+    }
 
-    config_manager_data = {
-        node: {
-            "local_filesystem": get_local_filesystem(node, "config_manager"),
-            "serving_all": get_serving_all(node),
-            "serving_config": get_serving_config(node),
-        }
-        for node in list(registered_config_manager_cache.keys())
+
+async def collect_served_versions():
+    """Asks every registered node which versions it serves or holds as current.
+
+    :return: tuple of the served versions by record key and the nodes that
+        failed to answer
+    """
+    config_manager_paths = {
+        "serving_all": ("/tensorflow_serving/all", "json"),
+        "local_current": ("/local/current", "json"),
+    }
+    remote_model_puller_paths = {
+        "local_current": ("/local/current", "json"),
     }
+    config_manager_nodes = list(registered_config_manager_cache.keys())
+    remote_model_puller_nodes = list(registered_remote_model_puller_cache.keys())
+    responses = await asyncio.gather(
+        *[
+            gather_node_data("config_manager", node, config_manager_paths)
+            for node in config_manager_nodes
+        ],
+        *[
+            gather_node_data("remote_model_puller", node, remote_model_puller_paths)
+            for node in remote_model_puller_nodes
+        ],
+    )
 
-    remote_model_puller_data = {
-        node: {"local_filesystem": get_local_filesystem(node, "remote_model_puller")}
-        for node in list(registered_remote_model_puller_cache.keys())
+    reports, failed_nodes = [], []
+    for node, (data, _) in zip(config_manager_nodes + remote_model_puller_nodes, responses):
+        if all(isinstance(report, dict) for report in data.values()):
+            reports += list(data.values())
+        else:
+            failed_nodes.append(node)
+    return retention.served_versions_from_reports(reports), failed_nodes
+
+
+@app.get("/retention/served")
+async def get_served_versions():
+    served, failed_nodes = await collect_served_versions()
+    if failed_nodes:
+        raise fastapi.HTTPException(
+            status_code=503, detail=f"nodes failed to report served versions {failed_nodes}"
+        )
+    return {
+        f"{key.framework}/{key.name}": sorted(versions)
+        for key, versions in served.items()
     }
 
+
+@app.post("/retention")
+async def apply_retention(keep_versions: int = RETENTION_KEEP_VERSIONS, dry_run: bool = True):
+    """Plans, and unless dry_run is set applies, the remote retention policy.
+    Versions any registered node serves are always kept, so nothing is deleted
+    unless every node answered.
+    """
+    if keep_versions < 1:
+        raise fastapi.HTTPException(status_code=400, detail="keep_versions needs to be at least 1")
+    served, failed_nodes = await collect_served_versions()
+    if failed_nodes and not dry_run:
+        raise fastapi.HTTPException(
+            status_code=503,
+            detail=f"nodes failed to report served versions {failed_nodes}, refusing to delete",
+        )
+    plan = await run_in_threadpool(
+        retention.plan_remote_retention, REMOTE_MODEL_DIRECTORY, keep_versions, served
+    )
+    deleted = 0
+    if not dry_run:
+        deleted = await run_in_threadpool(
+            retention.apply_remote_retention,
+            plan,
+            delete_batch_size=RETENTION_DELETE_BATCH_SIZE,
+            max_workers=RETENTION_DELETE_THREADS,
+        )
+    if deleted:
+        await run_in_threadpool(publish_latest_pointers)
+        await run_in_threadpool(rebuild_remote_index)
     return {
-        "config_manager": config_manager_data,
-        "remote_model_puller": remote_model_puller_data,
+        **plan.report(),
+        "dry_run": dry_run,
+        "objects_deleted": deleted,
+        "unreachable_nodes": failed_nodes,
     }
 
 
+def rebuild_remote_index():
+    """Republishes the remote index so pullers see a change on their next fetch.
+    Failures are logged and swallowed, pullers fall back to listing once the
+    index goes stale.
+    """
+    if not REMOTE_INDEX_ENABLED:
+        return None
+    try:
+        index = gcs.rebuild_remote_index(REMOTE_MODEL_DIRECTORY)
+        return {
+            "generation": index.generation,
+            "generated_at": index.generated_at,
+            "records": len(index.records),
+        }
+    except Exception as err:
+        log.exception("failed to rebuild remote index", exc_info=err)
+        return f"failed to rebuild remote index {err}"
+
+
+@app.post("/index/rebuild")
+def manually_rebuild_remote_index():
+    if not REMOTE_INDEX_ENABLED:
+        raise fastapi.HTTPException(
+            status_code=400,
+            detail="remote index is not enabled, set REMOTE_INDEX_ENABLED=true",
+        )
+    return rebuild_remote_index()
+
+
+def publish_latest_pointers(framework: str = None, name: str = None):
+    """Republishes the latest pointers of one model, or of every model when name
+    is None. Failures are logged and swallowed like rebuild_remote_index.
+    """
+    if not REMOTE_LATEST_POINTERS_ENABLED:
+        return None
+    try:
+        pointers = gcs.publish_latest_pointers(REMOTE_MODEL_DIRECTORY, framework, name)
+        return {"pointers": len(pointers)}
+    except Exception as err:
+        log.exception("failed to publish latest pointers", exc_info=err)
+
+
+@app.post("/pointers/rebuild")
+def manually_publish_latest_pointers():
+    if not REMOTE_LATEST_POINTERS_ENABLED:
+        raise fastapi.HTTPException(
+            status_code=400,
+            detail="latest pointers are not enabled, set REMOTE_LATEST_POINTERS_ENABLED=true",
+        )
+    return publish_latest_pointers()
+
+
+def rebuild_remote_index_loop():
+    log.info("starting remote index rebuild loop")
+    while True:
+        rebuild_remote_index()
+        # keeps pointers fresh for pullers' REMOTE_LATEST_POINTERS_MAX_AGE and
+        # picks up versions uploaded without /pointers/rebuild
+        publish_latest_pointers()
+        time.sleep(REMOTE_INDEX_REBUILD_FREQUENCY)
+
+
+@contextlib.contextmanager
+def peer_distribution_state(key: str):
+    """Yields the distribution state of a version for read-modify-write, holding
+    a file lock so concurrent workers don't hand out the same fanout slot.
+    """
+    with open(PEER_DISTRIBUTION_LOCK_FILE, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            state = peer_distribution_cache.get(key, {})
+            yield state
+            peer_distribution_cache[key] = state
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def peer_distribution_key(framework: str, name: str, version: int) -> str:
+    return f"{framework}/{name}/{version}"
+
+
+@app.post("/peers/assign")
+def assign_peer_source(endpoint: PeerEndpoint):
+    """Tells a puller where to fetch a version from: a peer that already has it,
+    GCS, or to wait and ask again while the first pullers are still seeding.
+    """
+    key = peer_distribution_key(endpoint.framework, endpoint.name, endpoint.version)
+    with peer_distribution_state(key) as state:
+        assignment = peer.assign_peer_source(
+            state,
+            endpoint.target,
+            live_targets=list(registered_remote_model_puller_cache.keys()),
+            fanout=PEER_FANOUT,
+            gcs_seeds=PEER_GCS_SEEDS,
+            lease_seconds=PEER_LEASE_SECONDS,
+        )
+    log.info(f"assigned {endpoint.target} to fetch {key} from {assignment}")
+    return assignment
+
+
+@app.post("/peers/complete")
+def complete_peer_fetch(result: PeerFetchResult):
+    key = peer_distribution_key(result.framework, result.name, result.version)
+    with peer_distribution_state(key) as state:
+        peer.complete_peer_fetch(state, result.target, result.success)
+    return state
+
+
+@app.get("/peers")
+def all_peer_distribution_state():
+    return dict(peer_distribution_cache.items())
+
+
+def remove_peer_distribution_state(framework: str, name: str):
+    for key in list(peer_distribution_cache.keys()):
+        if key.startswith(f"{framework}/{name}/"):
+            peer_distribution_cache.pop(key, None)
+
+
 @app.delete("/models/{framework}/{model_name}")
 def delete_model(framework: str, model_name):
     gcs.remove_model_gcs_bucket(REMOTE_MODEL_DIRECTORY, framework, model_name)
+    rebuild_remote_index()
+    remove_peer_distribution_state(framework, model_name)
     registered_remote_model_pullers = registered_remote_model_puller_cache.items()
     remote_model_puller_data = {
         node: get_data_for_path(
@@ -238,6 +618,8 @@ def set_priority(endpoint: PriorityEndpoint):
     gcs.copy_remote_record_to_priority_bucket(
         REMOTE_MODEL_DIRECTORY, endpoint.framework, endpoint.name, endpoint.version
     )
+    publish_latest_pointers(endpoint.framework, endpoint.name)
+    rebuild_remote_index()
     # todo, send pull &  config_update to all nodes
     for node in list(registered_remote_model_puller_cache.keys()):
         get_data_for_path("remote_model_puller", "POST", node, "/pull")
@@ -262,6 +644,8 @@ def remove_priority(endpoint: PriorityEndpoint):
     gcs.remove_priority_bucket(
         REMOTE_MODEL_DIRECTORY, endpoint.framework, endpoint.name
     )
+    publish_latest_pointers(endpoint.framework, endpoint.name)
+    rebuild_remote_index()
     # Note when a node failed to receive delete priority call, it would result
     # discrepency between remote and local. Two jira tickets have been
     # added to address this problem  https://jira.atg-corp.com/browse/DEV-75599?and
@@ -284,6 +668,13 @@ def remove_priority(endpoint: PriorityEndpoint):
 
 if __name__ == "__main__":
     processes = []
+    if (REMOTE_INDEX_ENABLED or REMOTE_LATEST_POINTERS_ENABLED) and REMOTE_INDEX_REBUILD_FREQUENCY > 0:
+        processes.append(
+            mp.Process(
+                target=rebuild_remote_index_loop,
+                name="rebuild_remote_index_loop",
+            )
+        )
     for p in processes:
         log.warning(f"starting process: {p}")
         p.start()
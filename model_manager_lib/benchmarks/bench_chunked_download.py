@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+"""Benchmarks the single stream download against the ranged chunk downloader.
+
+GCS is stood in for by a local file whose reads are throttled per request, which
+is how a single GCS connection behaves in practice. The chunked downloader should
+scale with the number of workers until the (fake) NIC is saturated.
+
+usage:
+    python benchmarks/bench_chunked_download.py --sizes 100MB,1GB,5GB
+"""
+import argparse
+import tempfile
+import pathlib
+import base64
+import shutil
+import time
+import os
+
+import google_crc32c
+
+from model_manager_lib import gcs
+
+UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+
+class FakeGcsBlob:
+    """Serves byte ranges out of a local file, sleeping to simulate a per
+    connection bandwidth cap.
+    """
+
+    def __init__(self, backing_file: pathlib.Path, stream_bytes_per_second: int):
+        self.name = str(backing_file)
+        self.backing_file = backing_file
+        self.size = backing_file.stat().st_size
+        self.generation = 1
+        self.stream_bytes_per_second = stream_bytes_per_second
+        checksum = google_crc32c.Checksum()
+        with open(backing_file, "rb") as f:
+            for block in iter(lambda: f.read(gcs.CRC32C_READ_SIZE), b""):
+                checksum.update(block)
+        self.crc32c = base64.b64encode(checksum.digest()).decode("utf-8")
+
+    def download_as_bytes(self, client=None, start=0, end=None, **kwargs):
+        end = self.size - 1 if end is None else end
+        with open(self.backing_file, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        time.sleep(len(data) / self.stream_bytes_per_second)
+        return data
+
+    def download_to_filename(self, filename, client=None, **kwargs):
+        with open(filename, "wb") as f:
+            start = 0
+            while start < self.size:
+                end = min(start + gcs.DEFAULT_DOWNLOAD_CHUNK_SIZE, self.size) - 1
+                f.write(self.download_as_bytes(start=start, end=end))
+                start = end + 1
+
+
+def parse_size(size: str) -> int:
+    size = size.strip().upper()
+    for unit, multiplier in UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[: -len(unit)]) * multiplier)
+    return int(size)
+
+
+def make_backing_file(directory: pathlib.Path, size: int) -> pathlib.Path:
+    path = directory.joinpath(f"remote_{size}.bin")
+    block = os.urandom(8 * 1024 * 1024)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="100MB,1GB,5GB")
+    parser.add_argument("--workers", default="1,4,8,16")
+    parser.add_argument("--chunk-size", default="64MB")
+    parser.add_argument("--stream-mb-per-second", type=float, default=100)
+    args = parser.parse_args()
+
+    chunk_size = parse_size(args.chunk_size)
+    stream_bytes_per_second = int(args.stream_mb_per_second * UNITS["MB"])
+    work_dir = pathlib.Path(tempfile.mkdtemp())
+    try:
+        print(f"{'size':>8} {'workers':>8} {'seconds':>10} {'MB/s':>10} {'speedup':>8}")
+        for size_str in args.sizes.split(","):
+            size = parse_size(size_str)
+            blob = FakeGcsBlob(make_backing_file(work_dir, size), stream_bytes_per_second)
+            destination = work_dir.joinpath("model.tar.gz")
+            baseline = None
+            for workers in [int(w) for w in args.workers.split(",")]:
+                start = time.time()
+                if workers == 1:
+                    blob.download_to_filename(destination)
+                else:
+                    gcs.download_blob_in_chunks(
+                        blob, destination, chunk_size=chunk_size, max_workers=workers
+                    )
+                took = time.time() - start
+                baseline = baseline or took
+                print(
+                    f"{size_str:>8} {workers:>8} {took:>10.2f} "
+                    f"{size / took / UNITS['MB']:>10.1f} {baseline / took:>8.2f}x"
+                )
+                destination.unlink()
+            pathlib.Path(blob.backing_file).unlink()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
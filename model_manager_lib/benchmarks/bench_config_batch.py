@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+"""Benchmarks adding models to the tensorflow serving config one save at a time
+against staging them in a single batch commit.
+
+Each add_model call rewrites and re-parses the whole config, so the per model
+path grows quadratically with the number of models while the batch path does a
+single write.
+
+usage:
+    python benchmarks/bench_config_batch.py --models 10,100,1000
+"""
+import argparse
+import logging
+import tempfile
+import pathlib
+import shutil
+import time
+from uuid import uuid4 as uuid
+
+from model_manager_lib import Record, RecordKey
+from model_manager_lib import tfserving
+
+EMPTY_CONFIG = "model_config_list {\n\n}\n"
+
+
+def make_records(n: int):
+    return [
+        Record(key=RecordKey(framework="tensorflow", name=uuid().hex), version=1)
+        for _ in range(n)
+    ]
+
+
+def add_one_at_a_time(config_path: pathlib.Path, records, model_directory: pathlib.Path):
+    config = tfserving.load_config(str(config_path))
+    for record in records:
+        config = tfserving.add_model(
+            config, record, local_path=str(model_directory.joinpath(record.key.name))
+        )
+    return config
+
+
+def add_in_batch(config_path: pathlib.Path, records, model_directory: pathlib.Path):
+    config = tfserving.load_config(str(config_path))
+    batch = config.batch()
+    for record in records:
+        batch.add_model(
+            record, local_path=str(model_directory.joinpath(record.key.name))
+        )
+    return batch.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", default="10,100,1000")
+    args = parser.parse_args()
+    # add_model logs the whole config on every call
+    logging.basicConfig(level=logging.ERROR)
+
+    work_dir = pathlib.Path(tempfile.mkdtemp())
+    config_path = work_dir.joinpath("models.config")
+    try:
+        print(f"{'models':>8} {'per model s':>12} {'batch s':>10} {'speedup':>8}")
+        for n in [int(n) for n in args.models.split(",")]:
+            records = make_records(n)
+            timings = []
+            for add_fn in (add_one_at_a_time, add_in_batch):
+                config_path.write_text(EMPTY_CONFIG)
+                start = time.time()
+                config = add_fn(config_path, records, work_dir)
+                timings.append(time.time() - start)
+                assert len(config.known_model_names) == n
+
+            per_model, batch = timings
+            print(f"{n:>8} {per_model:>12.3f} {batch:>10.3f} {per_model / batch:>7.1f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
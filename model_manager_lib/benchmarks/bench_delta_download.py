@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+"""Benchmarks the bytes transferred by a full tarball download against a file
+level delta download for a typical retrain.
+
+The retrained model keeps its vocabulary assets and frozen embedding shard
+byte for byte, while the graph and the trained variable shard change. GCS is
+stood in for by an in memory bucket that counts downloaded bytes.
+
+usage:
+    python benchmarks/bench_delta_download.py --assets-mb 50 --frozen-mb 100 --trained-mb 20
+"""
+from unittest import mock
+import argparse
+import logging
+import tempfile
+import tarfile
+import pathlib
+import shutil
+import time
+import os
+
+from model_manager_lib import RecordKey
+from model_manager_lib import delta, gcs
+
+UNITS_MB = 1024 ** 2
+
+
+class FakeStoredBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def generation(self):
+        return self.bucket.generations[self.name]
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.store(self.name, data.encode("utf-8") if isinstance(data, str) else data)
+
+    def upload_from_filename(self, filename):
+        self.bucket.store(self.name, pathlib.Path(filename).read_bytes())
+
+    def download_as_bytes(self, client=None):
+        self.bucket.downloaded_bytes += len(self.bucket.objects[self.name])
+        return self.bucket.objects[self.name]
+
+    def download_to_filename(self, filename, client=None):
+        pathlib.Path(filename).write_bytes(self.download_as_bytes())
+
+
+class FakeBucket:
+    name = "bucket"
+
+    def __init__(self):
+        self.objects = {}
+        self.generations = {}
+        self.downloaded_bytes = 0
+
+    def store(self, name, data):
+        self.objects[name] = data
+        self.generations[name] = self.generations.get(name, 0) + 1
+
+    def blob(self, name):
+        return FakeStoredBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeStoredBlob(self, name) if name in self.objects else None
+
+    def list_blobs(self, prefix):
+        return [FakeStoredBlob(self, name) for name in self.objects if name.startswith(prefix)]
+
+
+def write_model(path: pathlib.Path, files: dict):
+    for file_path, data in files.items():
+        path.joinpath(file_path).parent.mkdir(parents=True, exist_ok=True)
+        path.joinpath(file_path).write_bytes(data)
+
+
+def make_tarball(model_path: pathlib.Path, tarball_path: pathlib.Path) -> bytes:
+    with tarfile.open(tarball_path, "w:gz", compresslevel=1) as tar:
+        for child in model_path.iterdir():
+            tar.add(child, arcname=child.name)
+    return tarball_path.read_bytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--assets-mb", type=float, default=50)
+    parser.add_argument("--frozen-mb", type=float, default=100)
+    parser.add_argument("--trained-mb", type=float, default=20)
+    parser.add_argument("--graph-mb", type=float, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    def random_mb(mb):
+        return os.urandom(int(mb * UNITS_MB))
+
+    frozen_files = {
+        "assets/vocab.txt": random_mb(args.assets_mb),
+        "variables/variables.data-00000-of-00002": random_mb(args.frozen_mb),
+    }
+    base_files = {
+        **frozen_files,
+        "saved_model.pb": random_mb(args.graph_mb),
+        "variables/variables.data-00001-of-00002": random_mb(args.trained_mb),
+        "variables/variables.index": os.urandom(4096),
+    }
+    retrained_files = {
+        **frozen_files,
+        "saved_model.pb": random_mb(args.graph_mb),
+        "variables/variables.data-00001-of-00002": random_mb(args.trained_mb),
+        "variables/variables.index": os.urandom(4096),
+    }
+
+    work_dir = pathlib.Path(tempfile.mkdtemp())
+    bucket = FakeBucket()
+    try:
+        with mock.patch("model_manager_lib.gcs.GcsApi.client") as gcs_client:
+            gcs_client.get_bucket.return_value = bucket
+            gcs_client.list_blobs.side_effect = lambda b, prefix: b.list_blobs(prefix)
+
+            local_directory = work_dir.joinpath("local", "tensorflow", "model_a")
+            write_model(local_directory.joinpath("1"), base_files)
+            published_path = work_dir.joinpath("published")
+            write_model(published_path, retrained_files)
+
+            record = gcs.RemoteRecord(
+                key=RecordKey(framework="tensorflow", name="model_a"),
+                version=2,
+                remote_path="gs://bucket/env/tensorflow/model_a/2/model.tar.gz",
+            )
+            tarball_name = "env/tensorflow/model_a/2/model.tar.gz"
+            bucket.store(tarball_name, make_tarball(published_path, work_dir.joinpath("model.tar.gz")))
+            delta.publish_manifest(record, published_path, bucket.generations[tarball_name])
+
+            bucket.downloaded_bytes = 0
+            bucket.blob(tarball_name).download_as_bytes()
+            full_bytes = bucket.downloaded_bytes
+
+            bucket.downloaded_bytes = 0
+            start = time.time()
+            stats = delta.download_remote_record_delta(
+                record,
+                base_model_directory=local_directory.joinpath("1"),
+                local_directory=local_directory.joinpath("2"),
+                staging_directory=work_dir.joinpath("local", ".staging"),
+            )
+            took = time.time() - start
+            delta_bytes = bucket.downloaded_bytes
+
+        print(f"{'download':>10} {'MB transferred':>15} {'files fetched':>14} {'files reused':>13}")
+        print(f"{'full':>10} {full_bytes / UNITS_MB:>15.1f} {len(retrained_files):>14} {0:>13}")
+        print(
+            f"{'delta':>10} {delta_bytes / UNITS_MB:>15.1f} "
+            f"{stats.files_fetched:>14} {stats.files_reused:>13}"
+        )
+        print(
+            f"delta transferred {100 * delta_bytes / full_bytes:.1f}% of the tarball "
+            f"and assembled in {took:.2f}s"
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
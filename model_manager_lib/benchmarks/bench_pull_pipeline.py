@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+"""Benchmarks the whole pull pipeline, listing, download, extraction and publish,
+against a file:// remote model directory, so no network or GCS credentials are
+involved. Point --remote-root at an NFS mount to measure the mount instead of
+the local disk.
+
+usage:
+    python benchmarks/bench_pull_pipeline.py --models 4 --model-size 256MB
+"""
+import argparse
+import tempfile
+import tarfile
+import pathlib
+import shutil
+import time
+import os
+
+from model_manager_lib import gcs
+
+UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+MODES = {
+    "single": {},
+    "chunked": {"max_workers": 8},
+    "streaming": {"streaming": True},
+    "journaled": {"max_workers": 8, "journaled": True},
+}
+
+
+def parse_size(size: str) -> int:
+    size = size.strip().upper()
+    for unit, multiplier in UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[: -len(unit)]) * multiplier)
+    return int(size)
+
+
+def make_remote(remote_root: pathlib.Path, models: int, model_size: int):
+    """Writes models random, incompressible model tarballs of about model_size bytes"""
+    block = os.urandom(8 * 1024 * 1024)
+    for i in range(models):
+        version_path = remote_root.joinpath("bench", "tensorflow", f"model_{i}", "1")
+        version_path.mkdir(parents=True, exist_ok=True)
+        variables = version_path.joinpath("variables.data")
+        with open(variables, "wb") as f:
+            remaining = model_size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+        with tarfile.open(version_path.joinpath("model.tar.gz"), "w:gz", compresslevel=1) as tar:
+            tar.add(variables, arcname="variables/variables.data")
+        variables.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", type=int, default=4)
+    parser.add_argument("--model-size", default="256MB")
+    parser.add_argument("--chunk-size", default="64MB")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--remote-root", default=None, help="defaults to a temporary directory")
+    args = parser.parse_args()
+
+    model_size = parse_size(args.model_size)
+    chunk_size = parse_size(args.chunk_size)
+    work_dir = pathlib.Path(tempfile.mkdtemp())
+    remote_root = pathlib.Path(args.remote_root or work_dir.joinpath("remote")).absolute()
+    try:
+        make_remote(remote_root, args.models, model_size)
+        remote_directory = f"file://{remote_root}/bench"
+
+        start = time.time()
+        records = gcs.get_current_remote_records(remote_directory)
+        print(f"listed {len(records)} records in {time.time() - start:.3f}s")
+
+        print(f"{'mode':>10} {'seconds':>10} {'MB/s':>10}")
+        for mode in args.modes.split(","):
+            local_directory = work_dir.joinpath("local", mode)
+            start = time.time()
+            for record in records.values():
+                gcs.download_remote_record_locally(
+                    record,
+                    str(local_directory.joinpath(record.key.framework, record.key.name, str(record.version))),
+                    temp_directory=str(work_dir.joinpath("tmp", mode)),
+                    chunk_size=chunk_size,
+                    **MODES[mode],
+                )
+            took = time.time() - start
+            print(f"{mode:>10} {took:>10.2f} {args.models * model_size / took / UNITS['MB']:>10.1f}")
+            shutil.rmtree(local_directory, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if args.remote_root:
+            shutil.rmtree(remote_root.joinpath("bench"), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+"""Benchmarks polling model statuses one at a time against the concurrent
+polling in get_known_tensorflow_serving_models.
+
+Tensorflow serving is stood in for by an in-process grpc ModelService that
+answers GetModelStatus after a fixed delay, which approximates the round trip
+to a real model server.
+
+usage:
+    python benchmarks/bench_status_polling.py --models 10,100,500,2000
+"""
+from concurrent import futures
+import argparse
+import logging
+import tempfile
+import pathlib
+import shutil
+import time
+from uuid import uuid4 as uuid
+
+import grpc
+from tensorflow_serving.apis import get_model_status_pb2
+from tensorflow_serving.apis import model_service_pb2_grpc
+
+from model_manager_lib import Record, RecordKey
+from model_manager_lib import tfserving
+
+
+class FakeModelService(model_service_pb2_grpc.ModelServiceServicer):
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+
+    def GetModelStatus(self, request, context):
+        time.sleep(self.latency_seconds)
+        return get_model_status_pb2.GetModelStatusResponse(
+            model_version_status=[
+                get_model_status_pb2.ModelVersionStatus(
+                    version=1,
+                    state=tfserving.TensorflowServingModelStatus.AVAILABLE.value,
+                )
+            ]
+        )
+
+
+def start_fake_server(latency_seconds: float, workers: int) -> (grpc.Server, str):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+    model_service_pb2_grpc.add_ModelServiceServicer_to_server(
+        FakeModelService(latency_seconds), server
+    )
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return server, f"127.0.0.1:{port}"
+
+
+def make_config(config_path: pathlib.Path, n: int) -> tfserving.TensorflowServingConfig:
+    config_path.write_text("model_config_list {\n\n}\n")
+    config = tfserving.load_config(str(config_path))
+    batch = config.batch()
+    for _ in range(n):
+        name = uuid().hex
+        batch.add_model(
+            Record(key=RecordKey("tensorflow", name), version=1),
+            local_path=str(config_path.parent.joinpath(name)),
+        )
+    return batch.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", default="10,100,500,2000")
+    parser.add_argument("--max-in-flight", type=int, default=tfserving.DEFAULT_STATUS_MAX_IN_FLIGHT)
+    parser.add_argument("--latency-ms", type=float, default=2)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    server, target = start_fake_server(args.latency_ms / 1000, workers=args.max_in_flight)
+    work_dir = pathlib.Path(tempfile.mkdtemp())
+    try:
+        print(f"{'models':>8} {'serial s':>10} {'concurrent s':>13} {'speedup':>8}")
+        for n in [int(n) for n in args.models.split(",")]:
+            config = make_config(work_dir.joinpath("models.config"), n)
+            timings = []
+            for max_in_flight in (1, args.max_in_flight):
+                start = time.time()
+                known = tfserving.get_known_tensorflow_serving_models(
+                    target, config, max_in_flight=max_in_flight
+                )
+                timings.append(time.time() - start)
+                assert len(known) == n
+
+            serial, concurrent = timings
+            print(f"{n:>8} {serial:>10.3f} {concurrent:>13.3f} {serial / concurrent:>7.1f}x")
+    finally:
+        server.stop(grace=None)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
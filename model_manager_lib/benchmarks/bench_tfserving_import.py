@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+"""Benchmarks the startup time and memory of importing the tensorflow serving
+protobufs through tensorflow_serving, which imports all of tensorflow, against
+model_manager_lib.tfserving_protos, which doesn't. Every import runs in a fresh
+interpreter, the times and peak RSS reported are medians.
+
+usage:
+    python benchmarks/bench_tfserving_import.py --runs 5
+"""
+import statistics
+import subprocess
+import argparse
+import json
+import sys
+
+IMPORTS = {
+    "tensorflow_serving": (
+        "from tensorflow_serving.apis import get_model_status_pb2, model_service_pb2_grpc\n"
+        "from tensorflow_serving.config import model_server_config_pb2\n"
+    ),
+    "tfserving_protos": (
+        "from model_manager_lib.tfserving_protos import get_model_status_pb2, model_service_pb2_grpc\n"
+        "from model_manager_lib.tfserving_protos import model_server_config_pb2\n"
+    ),
+    "model_manager_lib.tfserving": "from model_manager_lib import tfserving\n",
+}
+
+MEASURE = """
+import resource, time, json, sys
+start = time.perf_counter()
+{statement}
+took = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": took,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "tensorflow_loaded": "tensorflow" in sys.modules,
+}}))
+"""
+
+
+def measure(statement: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE.format(statement=statement)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--imports", default=",".join(IMPORTS))
+    args = parser.parse_args()
+
+    print(f"{'import':>28} {'seconds':>9} {'max rss MB':>11} {'tensorflow':>11}")
+    for name in args.imports.split(","):
+        runs = [measure(IMPORTS[name]) for _ in range(args.runs)]
+        seconds = statistics.median(run["seconds"] for run in runs)
+        max_rss_mb = statistics.median(run["max_rss_kb"] for run in runs) / 1024
+        tensorflow_loaded = any(run["tensorflow_loaded"] for run in runs)
+        print(f"{name:>28} {seconds:>9.3f} {max_rss_mb:>11.1f} {str(tensorflow_loaded):>11}")
+
+
+if __name__ == "__main__":
+    main()
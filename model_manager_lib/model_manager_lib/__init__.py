@@ -46,4 +46,4 @@ def records_dict_to_jsonable(records_dict) -> dict:
 
 def load_remote_model_directory(remote_model_directory, environment):
     path = pathlib.Path(remote_model_directory).joinpath(environment)
-    return str(path).replace("gs:/", "gs://")
+    return str(path).replace("gs:/", "gs://").replace("file:/", "file:///")
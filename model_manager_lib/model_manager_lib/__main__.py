@@ -0,0 +1,158 @@
+"""
+Administrative commands that operate directly against the remote model directory.
+
+usage:
+    python -m model_manager_lib rebuild-index gs://bucket/environment
+    python -m model_manager_lib publish-manifest gs://bucket/environment/framework/name/version/model.tar.gz
+    python -m model_manager_lib mirror gs://bucket/environment file:///mnt/models/environment
+    python -m model_manager_lib publish-pointers gs://bucket/environment [--framework f [--name n]]
+    python -m model_manager_lib retention gs://bucket/environment --keep-versions 3 [--apply --master host:port]
+"""
+import argparse
+import tempfile
+import logging
+import json
+import sys
+
+import requests
+
+from model_manager_lib import RecordKey
+from model_manager_lib import gcs, delta, retention, storage_backend
+
+
+def rebuild_index(args: argparse.Namespace):
+    index = gcs.rebuild_remote_index(args.remote_model_directory)
+    print(
+        f"published remote index generation={index.generation} "
+        f"records={len(index.records)}"
+    )
+
+
+def publish_manifest(args: argparse.Namespace):
+    remote_record = gcs._dict_to_remote_record(
+        {
+            **_remote_path_to_record_dict(args.remote_path),
+            "remote_path": args.remote_path,
+        }
+    )
+    manifest = delta.publish_manifest_for_remote_record(
+        remote_record, temp_directory=args.temp_directory
+    )
+    print(
+        f"published manifest for {args.remote_path} "
+        f"files={len(manifest.files)} bytes={manifest.size}"
+    )
+
+
+def publish_pointers(args: argparse.Namespace):
+    pointers = gcs.publish_latest_pointers(
+        args.remote_model_directory, framework=args.framework, name=args.name
+    )
+    print(f"published {len(pointers)} latest pointers")
+
+
+def apply_retention(args: argparse.Namespace):
+    protected_versions = {}
+    if args.master:
+        response = requests.get(f"http://{args.master}/retention/served", timeout=30)
+        response.raise_for_status()
+        for model_name, versions in response.json().items():
+            framework, name = model_name.split("/", 1)
+            protected_versions[RecordKey(framework=framework, name=name)] = set(versions)
+    elif args.apply:
+        sys.exit("--apply needs --master so versions served by the cluster are kept")
+
+    plan = retention.plan_remote_retention(
+        args.remote_model_directory,
+        keep_versions=args.keep_versions,
+        protected_versions=protected_versions,
+    )
+    report = plan.report()
+    if args.apply:
+        report["objects_deleted"] = retention.apply_remote_retention(
+            plan, delete_batch_size=args.delete_batch_size, max_workers=args.delete_threads
+        )
+    print(json.dumps(report, indent=2))
+
+
+def mirror(args: argparse.Namespace):
+    source, source_path = gcs.get_storage_backend(args.source)
+    destination, destination_path = gcs.get_storage_backend(args.destination)
+    stats = storage_backend.mirror(
+        source, str(source_path), destination, str(destination_path), read_size=args.read_size
+    )
+    print(
+        f"mirrored {args.source} to {args.destination} copied={stats.objects_copied} "
+        f"bytes={stats.bytes_copied} skipped={stats.objects_skipped}"
+    )
+
+
+def _remote_path_to_record_dict(remote_path: str) -> dict:
+    *_, framework, name, version, file_name = remote_path.rstrip("/").split("/")
+    assert file_name == "model.tar.gz", f"expected a model.tar.gz path not {remote_path}"
+    return {
+        "framework": framework,
+        "name": name,
+        "version": int(version),
+        "is_priority": int(version) == gcs.PRIORITY_VERSION,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m model_manager_lib")
+    parser.add_argument("--log-level", default="INFO")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_index_parser = commands.add_parser(
+        "rebuild-index", help="republish <env>/_index.json from a full listing"
+    )
+    rebuild_index_parser.add_argument("remote_model_directory")
+    rebuild_index_parser.set_defaults(fn=rebuild_index)
+
+    publish_manifest_parser = commands.add_parser(
+        "publish-manifest",
+        help="publish the per file manifest used by delta downloads for a model tarball",
+    )
+    publish_manifest_parser.add_argument("remote_path")
+    publish_manifest_parser.add_argument("--temp-directory", default=tempfile.gettempdir())
+    publish_manifest_parser.set_defaults(fn=publish_manifest)
+
+    publish_pointers_parser = commands.add_parser(
+        "publish-pointers",
+        help="republish the <framework>/<name>/_latest.json pointers, run after uploading versions",
+    )
+    publish_pointers_parser.add_argument("remote_model_directory")
+    publish_pointers_parser.add_argument("--framework", default=None)
+    publish_pointers_parser.add_argument("--name", default=None)
+    publish_pointers_parser.set_defaults(fn=publish_pointers)
+
+    retention_parser = commands.add_parser(
+        "retention",
+        help="report, or with --apply delete, versions beyond the latest --keep-versions of every model",
+    )
+    retention_parser.add_argument("remote_model_directory")
+    retention_parser.add_argument("--keep-versions", type=int, default=retention.DEFAULT_KEEP_VERSIONS)
+    retention_parser.add_argument("--apply", action="store_true", help="delete instead of the dry run report")
+    retention_parser.add_argument("--master", default=None, help="host:port of the master to ask for served versions")
+    retention_parser.add_argument("--delete-batch-size", type=int, default=retention.DEFAULT_DELETE_BATCH_SIZE)
+    retention_parser.add_argument("--delete-threads", type=int, default=retention.DEFAULT_DELETE_THREADS)
+    retention_parser.set_defaults(fn=apply_retention)
+
+    mirror_parser = commands.add_parser(
+        "mirror",
+        help="copy a remote model directory to another backend, e.g. an NFS mount",
+    )
+    mirror_parser.add_argument("source")
+    mirror_parser.add_argument("destination")
+    mirror_parser.add_argument(
+        "--read-size", type=int, default=storage_backend.DEFAULT_RANGE_READ_SIZE
+    )
+    mirror_parser.set_defaults(fn=mirror)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr)
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Generated by python -m model_manager_lib.tfserving_protos, do not edit.
+
+The base64 serialized FileDescriptorSet of the tensorflow serving protobufs
+tfserving_protos builds, with their dependencies, dependencies first:
+
+    tensorflow_serving/apis/model.proto
+    tensorflow/core/protobuf/error_codes.proto
+    tensorflow_serving/util/status.proto
+    tensorflow_serving/apis/get_model_status.proto
+    tensorflow_serving/config/file_system_storage_path_source.proto
+    tensorflow_serving/config/log_collector_config.proto
+    tensorflow_serving/config/logging_config.proto
+    tensorflow_serving/config/model_server_config.proto
+    tensorflow_serving/apis/model_management.proto
+    tensorflow_serving/apis/model_service.proto
+"""
+FILE_DESCRIPTOR_SET = """
+CvUBCiN0ZW5zb3JmbG93X3NlcnZpbmcvYXBpcy9tb2RlbC5wcm90bxISdGVuc29yZmxvdy5zZXJ2
+aW5nGh5nb29nbGUvcHJvdG9idWYvd3JhcHBlcnMucHJvdG8ijAEKCU1vZGVsU3BlYxIMCgRuYW1l
+GAEgASgJEi4KB3ZlcnNpb24YAiABKAsyGy5nb29nbGUucHJvdG9idWYuSW50NjRWYWx1ZUgAEhcK
+DXZlcnNpb25fbGFiZWwYBCABKAlIABIWCg5zaWduYXR1cmVfbmFtZRgDIAEoCUIQCg52ZXJzaW9u
+X2Nob2ljZUID+AEBYgZwcm90bzMK2AQKKnRlbnNvcmZsb3cvY29yZS9wcm90b2J1Zi9lcnJvcl9j
+b2Rlcy5wcm90bxIQdGVuc29yZmxvdy5lcnJvciqEAwoEQ29kZRIGCgJPSxAAEg0KCUNBTkNFTExF
+RBABEgsKB1VOS05PV04QAhIUChBJTlZBTElEX0FSR1VNRU5UEAMSFQoRREVBRExJTkVfRVhDRUVE
+RUQQBBINCglOT1RfRk9VTkQQBRISCg5BTFJFQURZX0VYSVNUUxAGEhUKEVBFUk1JU1NJT05fREVO
+SUVEEAcSEwoPVU5BVVRIRU5USUNBVEVEEBASFgoSUkVTT1VSQ0VfRVhIQVVTVEVEEAgSFwoTRkFJ
+TEVEX1BSRUNPTkRJVElPThAJEgsKB0FCT1JURUQQChIQCgxPVVRfT0ZfUkFOR0UQCxIRCg1VTklN
+UExFTUVOVEVEEAwSDAoISU5URVJOQUwQDRIPCgtVTkFWQUlMQUJMRRAOEg0KCURBVEFfTE9TUxAP
+EksKR0RPX05PVF9VU0VfUkVTRVJWRURfRk9SX0ZVVFVSRV9FWFBBTlNJT05fVVNFX0RFRkFVTFRf
+SU5fU1dJVENIX0lOU1RFQURfEBRCiAEKGG9yZy50ZW5zb3JmbG93LmZyYW1ld29ya0IQRXJyb3JD
+b2Rlc1Byb3Rvc1ABWlVnaXRodWIuY29tL3RlbnNvcmZsb3cvdGVuc29yZmxvdy90ZW5zb3JmbG93
+L2dvL2NvcmUvcHJvdG9idWYvZm9yX2NvcmVfcHJvdG9zX2dvX3Byb3Rv+AEBYgZwcm90bzMK4AEK
+JHRlbnNvcmZsb3dfc2VydmluZy91dGlsL3N0YXR1cy5wcm90bxISdGVuc29yZmxvdy5zZXJ2aW5n
+Gip0ZW5zb3JmbG93L2NvcmUvcHJvdG9idWYvZXJyb3JfY29kZXMucHJvdG8iawoLU3RhdHVzUHJv
+dG8SNgoKZXJyb3JfY29kZRgBIAEoDjIWLnRlbnNvcmZsb3cuZXJyb3IuQ29kZVIKZXJyb3JfY29k
+ZRIkCg1lcnJvcl9tZXNzYWdlGAIgASgJUg1lcnJvcl9tZXNzYWdlQgP4AQFiBnByb3RvMwrJBAou
+dGVuc29yZmxvd19zZXJ2aW5nL2FwaXMvZ2V0X21vZGVsX3N0YXR1cy5wcm90bxISdGVuc29yZmxv
+dy5zZXJ2aW5nGiN0ZW5zb3JmbG93X3NlcnZpbmcvYXBpcy9tb2RlbC5wcm90bxokdGVuc29yZmxv
+d19zZXJ2aW5nL3V0aWwvc3RhdHVzLnByb3RvIkoKFUdldE1vZGVsU3RhdHVzUmVxdWVzdBIxCgpt
+b2RlbF9zcGVjGAEgASgLMh0udGVuc29yZmxvdy5zZXJ2aW5nLk1vZGVsU3BlYyLoAQoSTW9kZWxW
+ZXJzaW9uU3RhdHVzEg8KB3ZlcnNpb24YASABKAMSOwoFc3RhdGUYAiABKA4yLC50ZW5zb3JmbG93
+LnNlcnZpbmcuTW9kZWxWZXJzaW9uU3RhdHVzLlN0YXRlEi8KBnN0YXR1cxgDIAEoCzIfLnRlbnNv
+cmZsb3cuc2VydmluZy5TdGF0dXNQcm90byJTCgVTdGF0ZRILCgdVTktOT1dOEAASCQoFU1RBUlQQ
+ChILCgdMT0FESU5HEBQSDQoJQVZBSUxBQkxFEB4SDQoJVU5MT0FESU5HECgSBwoDRU5EEDIidAoW
+R2V0TW9kZWxTdGF0dXNSZXNwb25zZRJaChRtb2RlbF92ZXJzaW9uX3N0YXR1cxgBIAMoCzImLnRl
+bnNvcmZsb3cuc2VydmluZy5Nb2RlbFZlcnNpb25TdGF0dXNSFG1vZGVsX3ZlcnNpb25fc3RhdHVz
+QgP4AQFiBnByb3RvMwrkBwo/dGVuc29yZmxvd19zZXJ2aW5nL2NvbmZpZy9maWxlX3N5c3RlbV9z
+dG9yYWdlX3BhdGhfc291cmNlLnByb3RvEhJ0ZW5zb3JmbG93LnNlcnZpbmcihAcKIUZpbGVTeXN0
+ZW1TdG9yYWdlUGF0aFNvdXJjZUNvbmZpZxJaCglzZXJ2YWJsZXMYBSADKAsyRy50ZW5zb3JmbG93
+LnNlcnZpbmcuRmlsZVN5c3RlbVN0b3JhZ2VQYXRoU291cmNlQ29uZmlnLlNlcnZhYmxlVG9Nb25p
+dG9yEhkKDXNlcnZhYmxlX25hbWUYASABKAlCAhgBEhUKCWJhc2VfcGF0aBgCIAEoCUICGAESJQod
+ZmlsZV9zeXN0ZW1fcG9sbF93YWl0X3NlY29uZHMYAyABKAMSLAogZmFpbF9pZl96ZXJvX3ZlcnNp
+b25zX2F0X3N0YXJ0dXAYBCABKAhCAhgBEigKIHNlcnZhYmxlX3ZlcnNpb25zX2Fsd2F5c19wcmVz
+ZW50GAYgASgIGp0DChVTZXJ2YWJsZVZlcnNpb25Qb2xpY3kSZAoGbGF0ZXN0GGQgASgLMlIudGVu
+c29yZmxvdy5zZXJ2aW5nLkZpbGVTeXN0ZW1TdG9yYWdlUGF0aFNvdXJjZUNvbmZpZy5TZXJ2YWJs
+ZVZlcnNpb25Qb2xpY3kuTGF0ZXN0SAASXgoDYWxsGGUgASgLMk8udGVuc29yZmxvdy5zZXJ2aW5n
+LkZpbGVTeXN0ZW1TdG9yYWdlUGF0aFNvdXJjZUNvbmZpZy5TZXJ2YWJsZVZlcnNpb25Qb2xpY3ku
+QWxsSAASaAoIc3BlY2lmaWMYZiABKAsyVC50ZW5zb3JmbG93LnNlcnZpbmcuRmlsZVN5c3RlbVN0
+b3JhZ2VQYXRoU291cmNlQ29uZmlnLlNlcnZhYmxlVmVyc2lvblBvbGljeS5TcGVjaWZpY0gAGh4K
+BkxhdGVzdBIUCgxudW1fdmVyc2lvbnMYASABKA0aBQoDQWxsGhwKCFNwZWNpZmljEhAKCHZlcnNp
+b25zGAEgAygDQg8KDXBvbGljeV9jaG9pY2UasQEKEVNlcnZhYmxlVG9Nb25pdG9yEhUKDXNlcnZh
+YmxlX25hbWUYASABKAkSEQoJYmFzZV9wYXRoGAIgASgJEmwKF3NlcnZhYmxlX3ZlcnNpb25fcG9s
+aWN5GAQgASgLMksudGVuc29yZmxvdy5zZXJ2aW5nLkZpbGVTeXN0ZW1TdG9yYWdlUGF0aFNvdXJj
+ZUNvbmZpZy5TZXJ2YWJsZVZlcnNpb25Qb2xpY3lKBAgDEARiBnByb3RvMwqUAQo0dGVuc29yZmxv
+d19zZXJ2aW5nL2NvbmZpZy9sb2dfY29sbGVjdG9yX2NvbmZpZy5wcm90bxISdGVuc29yZmxvdy5z
+ZXJ2aW5nIjsKEkxvZ0NvbGxlY3RvckNvbmZpZxIMCgR0eXBlGAEgASgJEhcKD2ZpbGVuYW1lX3By
+ZWZpeBgCIAEoCUID+AEBYgZwcm90bzMKxQIKLnRlbnNvcmZsb3dfc2VydmluZy9jb25maWcvbG9n
+Z2luZ19jb25maWcucHJvdG8SEnRlbnNvcmZsb3cuc2VydmluZxo0dGVuc29yZmxvd19zZXJ2aW5n
+L2NvbmZpZy9sb2dfY29sbGVjdG9yX2NvbmZpZy5wcm90byInCg5TYW1wbGluZ0NvbmZpZxIVCg1z
+YW1wbGluZ19yYXRlGAEgASgBIpIBCg1Mb2dnaW5nQ29uZmlnEkQKFGxvZ19jb2xsZWN0b3JfY29u
+ZmlnGAEgASgLMiYudGVuc29yZmxvdy5zZXJ2aW5nLkxvZ0NvbGxlY3RvckNvbmZpZxI7Cg9zYW1w
+bGluZ19jb25maWcYAiABKAsyIi50ZW5zb3JmbG93LnNlcnZpbmcuU2FtcGxpbmdDb25maWdCA/gB
+AWIGcHJvdG8zCsEHCjN0ZW5zb3JmbG93X3NlcnZpbmcvY29uZmlnL21vZGVsX3NlcnZlcl9jb25m
+aWcucHJvdG8SEnRlbnNvcmZsb3cuc2VydmluZxoZZ29vZ2xlL3Byb3RvYnVmL2FueS5wcm90bxo/
+dGVuc29yZmxvd19zZXJ2aW5nL2NvbmZpZy9maWxlX3N5c3RlbV9zdG9yYWdlX3BhdGhfc291cmNl
+LnByb3RvGi50ZW5zb3JmbG93X3NlcnZpbmcvY29uZmlnL2xvZ2dpbmdfY29uZmlnLnByb3RvIrED
+CgtNb2RlbENvbmZpZxIMCgRuYW1lGAEgASgJEhEKCWJhc2VfcGF0aBgCIAEoCRI1Cgptb2RlbF90
+eXBlGAMgASgOMh0udGVuc29yZmxvdy5zZXJ2aW5nLk1vZGVsVHlwZUICGAESFgoObW9kZWxfcGxh
+dGZvcm0YBCABKAkSaQoUbW9kZWxfdmVyc2lvbl9wb2xpY3kYByABKAsySy50ZW5zb3JmbG93LnNl
+cnZpbmcuRmlsZVN5c3RlbVN0b3JhZ2VQYXRoU291cmNlQ29uZmlnLlNlcnZhYmxlVmVyc2lvblBv
+bGljeRJKCg52ZXJzaW9uX2xhYmVscxgIIAMoCzIyLnRlbnNvcmZsb3cuc2VydmluZy5Nb2RlbENv
+bmZpZy5WZXJzaW9uTGFiZWxzRW50cnkSOQoObG9nZ2luZ19jb25maWcYBiABKAsyIS50ZW5zb3Jm
+bG93LnNlcnZpbmcuTG9nZ2luZ0NvbmZpZxo0ChJWZXJzaW9uTGFiZWxzRW50cnkSCwoDa2V5GAEg
+ASgJEg0KBXZhbHVlGAIgASgDOgI4AUoECAUQBkoECAkQCiJCCg9Nb2RlbENvbmZpZ0xpc3QSLwoG
+Y29uZmlnGAEgAygLMh8udGVuc29yZmxvdy5zZXJ2aW5nLk1vZGVsQ29uZmlnIpQBChFNb2RlbFNl
+cnZlckNvbmZpZxJAChFtb2RlbF9jb25maWdfbGlzdBgBIAEoCzIjLnRlbnNvcmZsb3cuc2Vydmlu
+Zy5Nb2RlbENvbmZpZ0xpc3RIABIzChNjdXN0b21fbW9kZWxfY29uZmlnGAIgASgLMhQuZ29vZ2xl
+LnByb3RvYnVmLkFueUgAQggKBmNvbmZpZypOCglNb2RlbFR5cGUSHgoWTU9ERUxfVFlQRV9VTlNQ
+RUNJRklFRBAAGgIIARISCgpURU5TT1JGTE9XEAEaAggBEg0KBU9USEVSEAIaAggBQgP4AQFiBnBy
+b3RvMwrDAgoudGVuc29yZmxvd19zZXJ2aW5nL2FwaXMvbW9kZWxfbWFuYWdlbWVudC5wcm90bxIS
+dGVuc29yZmxvdy5zZXJ2aW5nGjN0ZW5zb3JmbG93X3NlcnZpbmcvY29uZmlnL21vZGVsX3NlcnZl
+cl9jb25maWcucHJvdG8aJHRlbnNvcmZsb3dfc2VydmluZy91dGlsL3N0YXR1cy5wcm90byJMChNS
+ZWxvYWRDb25maWdSZXF1ZXN0EjUKBmNvbmZpZxgBIAEoCzIlLnRlbnNvcmZsb3cuc2VydmluZy5N
+b2RlbFNlcnZlckNvbmZpZyJHChRSZWxvYWRDb25maWdSZXNwb25zZRIvCgZzdGF0dXMYASABKAsy
+Hy50ZW5zb3JmbG93LnNlcnZpbmcuU3RhdHVzUHJvdG9CA/gBAWIGcHJvdG8zCpgDCit0ZW5zb3Jm
+bG93X3NlcnZpbmcvYXBpcy9tb2RlbF9zZXJ2aWNlLnByb3RvEhJ0ZW5zb3JmbG93LnNlcnZpbmca
+LnRlbnNvcmZsb3dfc2VydmluZy9hcGlzL2dldF9tb2RlbF9zdGF0dXMucHJvdG8aLnRlbnNvcmZs
+b3dfc2VydmluZy9hcGlzL21vZGVsX21hbmFnZW1lbnQucHJvdG8y5wEKDE1vZGVsU2VydmljZRJn
+Cg5HZXRNb2RlbFN0YXR1cxIpLnRlbnNvcmZsb3cuc2VydmluZy5HZXRNb2RlbFN0YXR1c1JlcXVl
+c3QaKi50ZW5zb3JmbG93LnNlcnZpbmcuR2V0TW9kZWxTdGF0dXNSZXNwb25zZRJuChlIYW5kbGVS
+ZWxvYWRDb25maWdSZXF1ZXN0EicudGVuc29yZmxvdy5zZXJ2aW5nLlJlbG9hZENvbmZpZ1JlcXVl
+c3QaKC50ZW5zb3JmbG93LnNlcnZpbmcuUmVsb2FkQ29uZmlnUmVzcG9uc2VCA/gBAWIGcHJvdG8z
+"""
@@ -0,0 +1,332 @@
+"""
+This module handles file level delta downloads between model versions.
+
+Next to each model tarball a manifest can be published listing every file in
+the model with its size and sha256:
+
+    <env>/<framework>/<name>/<version>/model.tar.gz
+    <env>/<framework>/<name>/<version>/manifest.json
+    <env>/<framework>/<name>/_files/<sha256>
+
+The file objects are shared by every version of the model, so publishing a new
+version only uploads the files that changed. A puller that already holds an
+older version locally can then assemble the new version from its own copies
+plus the fetched files, instead of downloading the whole tarball.
+
+The manifest records the generation of the tarball it was built from, a
+manifest that doesn't match the current tarball is ignored.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from uuid import uuid4 as uuid
+import logging as log
+import pathlib
+import tempfile
+import shutil
+import json
+import os
+
+from model_manager_lib import gcs, local_filesystem
+from model_manager_lib.gcs import GcsDownloadException, RemoteRecord
+
+MANIFEST_NAME = "manifest.json"
+FILES_DIRECTORY_NAME = "_files"
+MANIFEST_FORMAT_VERSION = 1
+
+
+@dataclass()
+class ManifestEntry:
+    path: str
+    size: int
+    sha256: str
+
+
+@dataclass()
+class Manifest:
+    tarball_generation: int
+    files: List[ManifestEntry] = field(default_factory=list)
+    directories: List[str] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return sum(entry.size for entry in self.files)
+
+
+@dataclass()
+class DeltaDownloadStats:
+    files_fetched: int = 0
+    bytes_fetched: int = 0
+    files_reused: int = 0
+    bytes_reused: int = 0
+
+
+def build_manifest(model_directory: str, tarball_generation: int = None) -> Manifest:
+    """Describes every file and directory in an extracted model.
+
+    :param model_directory: the extracted model version
+    :param tarball_generation: generation of the tarball the model came from
+    :return: Manifest
+    """
+    model_path = pathlib.Path(model_directory)
+    manifest = Manifest(tarball_generation=tarball_generation)
+    for directory, directory_names, file_names in os.walk(model_path):
+        directory_path = pathlib.Path(directory)
+        for directory_name in sorted(directory_names):
+            manifest.directories.append(
+                str(directory_path.joinpath(directory_name).relative_to(model_path))
+            )
+        for file_name in sorted(file_names):
+            file_path = directory_path.joinpath(file_name)
+            if file_path.is_symlink() or not file_path.is_file():
+                continue
+            manifest.files.append(
+                ManifestEntry(
+                    path=str(file_path.relative_to(model_path)),
+                    size=file_path.stat().st_size,
+                    sha256=local_filesystem._hash_file(file_path),
+                )
+            )
+    return manifest
+
+
+def publish_manifest(
+    remote_record: RemoteRecord, model_directory: str, tarball_generation: int
+) -> Manifest:
+    """Uploads the files of an extracted model that the remote doesn't have yet,
+    then the manifest itself, so a published manifest never points at missing files.
+
+    :param remote_record: the record the model was extracted from
+    :param model_directory: the extracted model version
+    :param tarball_generation: generation of the record's tarball
+    :return: the published Manifest
+    """
+    manifest = build_manifest(model_directory, tarball_generation=tarball_generation)
+    bucket, blob_path = gcs._get_gcs_bucket_and_remaining_path(remote_record.remote_path)
+    files_prefix = _files_prefix(blob_path)
+    known_files = {
+        blob.name
+        for blob in gcs.list_blobs(bucket, prefix=f"{files_prefix}/")
+    }
+
+    uploaded_files, uploaded_bytes = 0, 0
+    for entry in manifest.files:
+        file_blob_name = f"{files_prefix}/{entry.sha256}"
+        if file_blob_name in known_files:
+            continue
+        bucket.blob(file_blob_name).upload_from_filename(
+            str(pathlib.Path(model_directory).joinpath(entry.path))
+        )
+        known_files.add(file_blob_name)
+        uploaded_files += 1
+        uploaded_bytes += entry.size
+
+    bucket.blob(str(_manifest_path(blob_path))).upload_from_string(
+        json.dumps(_manifest_to_dict(manifest)), content_type="application/json"
+    )
+    log.info(
+        f"published manifest for {remote_record} files={len(manifest.files)} "
+        f"uploaded_files={uploaded_files} uploaded_bytes={uploaded_bytes}"
+    )
+    return manifest
+
+
+def publish_manifest_for_remote_record(
+    remote_record: RemoteRecord, temp_directory: str
+) -> Manifest:
+    """Builds and publishes the manifest of an already uploaded model tarball.
+
+    :param remote_record: the record to publish a manifest for
+    :param temp_directory: where to extract the tarball while building the manifest
+    :return: the published Manifest
+    """
+    bucket, blob_path = gcs._get_gcs_bucket_and_remaining_path(remote_record.remote_path)
+    blob = bucket.get_blob(str(blob_path))
+    if blob is None:
+        raise GcsDownloadException(
+            remote=remote_record, message=f"{remote_record} no longer exists remotely"
+        )
+
+    temp_directory_path = pathlib.Path(temp_directory)
+    temp_directory_path.mkdir(parents=True, exist_ok=True)
+    model_directory = pathlib.Path(tempfile.mkdtemp(dir=str(temp_directory_path)))
+    try:
+        gcs.stream_extract_blob(blob, model_directory)
+        return publish_manifest(remote_record, model_directory, blob.generation)
+    finally:
+        shutil.rmtree(model_directory, ignore_errors=True)
+
+
+def read_manifest(remote_record: RemoteRecord) -> Optional[Manifest]:
+    """Reads the manifest published next to the record's tarball.
+
+    :param remote_record: the record to read the manifest of
+    :return: the Manifest, None if it is missing or doesn't match the current tarball
+    """
+    bucket, blob_path = gcs._get_gcs_bucket_and_remaining_path(remote_record.remote_path)
+    manifest_blob = bucket.get_blob(str(_manifest_path(blob_path)))
+    if manifest_blob is None:
+        log.info(f"no manifest published for {remote_record}")
+        return None
+
+    manifest = _dict_to_manifest(json.loads(manifest_blob.download_as_bytes()))
+    tarball_blob = bucket.get_blob(str(blob_path))
+    if tarball_blob is None or tarball_blob.generation != manifest.tarball_generation:
+        log.warning(
+            f"manifest for {remote_record} was built from tarball generation "
+            f"{manifest.tarball_generation}, ignoring it"
+        )
+        return None
+    return manifest
+
+
+def download_remote_record_delta(
+    remote_record: RemoteRecord,
+    base_model_directory: str,
+    local_directory: str,
+    staging_directory: str,
+    statsd_client=None,
+    content_store_directory: str = None,
+) -> Optional[DeltaDownloadStats]:
+    """Assembles the remote record locally from an older local version of the
+    same model plus the files that changed, then publishes it with
+    local_filesystem.publish_model_directory.
+
+    :param remote_record: the record to download
+    :param base_model_directory: an older local version of the same model
+    :param local_directory: the version directory to publish as
+    :param staging_directory: where to assemble, on the same filesystem as local_directory
+    :param statsd_client: optional statsd client to report fetched and reused bytes to
+    :param content_store_directory: when set, unchanged files are hardlinked to
+        the base version instead of copied and the assembled model is deduplicated
+        before it is published, see local_filesystem.deduplicate_model_directory
+    :return: DeltaDownloadStats, None if no usable manifest was published
+    :raises GcsDownloadException: if a fetched file doesn't match its manifest hash,
+        or the manifest has a path outside the model
+    """
+    manifest = read_manifest(remote_record)
+    if manifest is None:
+        return None
+
+    bucket, blob_path = gcs._get_gcs_bucket_and_remaining_path(remote_record.remote_path)
+    base_files = _hash_candidate_base_files(base_model_directory, manifest)
+    staging_path = pathlib.Path(staging_directory).joinpath(uuid().hex)
+    assembled_path = staging_path.joinpath("assembled_model")
+    stats = DeltaDownloadStats()
+    try:
+        assembled_path.mkdir(parents=True)
+        for directory in manifest.directories:
+            _inside(remote_record, assembled_path, directory).mkdir(parents=True, exist_ok=True)
+
+        for entry in manifest.files:
+            destination = _inside(remote_record, assembled_path, entry.path)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            if entry.sha256 in base_files:
+                _reuse_base_file(
+                    base_files[entry.sha256], destination, link=bool(content_store_directory)
+                )
+                stats.files_reused += 1
+                stats.bytes_reused += entry.size
+                continue
+
+            file_blob = bucket.blob(f"{_files_prefix(blob_path)}/{entry.sha256}")
+            file_blob.download_to_filename(str(destination), client=gcs.get_bucket_client(bucket))
+            if local_filesystem._hash_file(destination) != entry.sha256:
+                raise GcsDownloadException(
+                    remote=remote_record,
+                    message=f"{remote_record} file {entry.path} failed its sha256 check",
+                )
+            stats.files_fetched += 1
+            stats.bytes_fetched += entry.size
+
+        if content_store_directory:
+            local_filesystem.deduplicate_model_directory(
+                assembled_path, content_store_directory, statsd_client=statsd_client
+            )
+        local_filesystem.publish_model_directory(
+            assembled_path,
+            local_directory,
+            statsd_client=statsd_client,
+            remote_metadata=gcs.remote_record_metadata(remote_record),
+        )
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+    log.info(f"assembled {remote_record} from {base_model_directory} stats={stats}")
+    if statsd_client:
+        statsd_client.incr("delta.bytes_fetched", stats.bytes_fetched)
+        statsd_client.incr("delta.bytes_reused", stats.bytes_reused)
+    return stats
+
+
+def _reuse_base_file(base_file: pathlib.Path, destination: pathlib.Path, link: bool):
+    if link:
+        try:
+            os.link(base_file, destination)
+            return
+        except OSError as err:
+            # e.g. the staging directory is on another filesystem
+            log.warning(f"failed to hardlink {base_file}, copying it instead err={err}")
+    shutil.copyfile(base_file, destination)
+
+
+def _inside(remote_record: RemoteRecord, directory: pathlib.Path, relative_path: str) -> pathlib.Path:
+    path = directory.joinpath(relative_path).resolve()
+    if directory.resolve() not in path.parents:
+        raise GcsDownloadException(
+            remote=remote_record,
+            message=f"{remote_record} manifest has a path outside the model {relative_path}",
+        )
+    return path
+
+
+def _hash_candidate_base_files(
+    base_model_directory: str, manifest: Manifest
+) -> Dict[str, pathlib.Path]:
+    """Hashes the base files that could match a manifest entry, which is only
+    files of a size the manifest contains.
+    """
+    wanted_sizes = {entry.size for entry in manifest.files}
+    base_files = {}
+    for directory, _, file_names in os.walk(base_model_directory):
+        for file_name in file_names:
+            file_path = pathlib.Path(directory).joinpath(file_name)
+            if file_path.is_symlink() or not file_path.is_file():
+                continue
+            if file_path.stat().st_size in wanted_sizes:
+                base_files.setdefault(local_filesystem._hash_file(file_path), file_path)
+    return base_files
+
+
+def _manifest_path(blob_path: pathlib.Path) -> pathlib.Path:
+    return blob_path.parent.joinpath(MANIFEST_NAME)
+
+
+def _files_prefix(blob_path: pathlib.Path) -> str:
+    # <env>/<framework>/<name>/<version>/model.tar.gz -> <env>/<framework>/<name>/_files
+    return str(blob_path.parent.parent.joinpath(FILES_DIRECTORY_NAME))
+
+
+def _manifest_to_dict(manifest: Manifest) -> dict:
+    return {
+        "format_version": MANIFEST_FORMAT_VERSION,
+        "tarball_generation": manifest.tarball_generation,
+        "directories": manifest.directories,
+        "files": [
+            {"path": entry.path, "size": entry.size, "sha256": entry.sha256}
+            for entry in manifest.files
+        ],
+    }
+
+
+def _dict_to_manifest(data: dict) -> Manifest:
+    assert (
+        data.get("format_version") == MANIFEST_FORMAT_VERSION
+    ), f"unknown manifest format_version={data.get('format_version')}"
+    return Manifest(
+        tarball_generation=data["tarball_generation"],
+        directories=data["directories"],
+        files=[
+            ManifestEntry(path=entry["path"], size=entry["size"], sha256=entry["sha256"])
+            for entry in data["files"]
+        ],
+    )
@@ -0,0 +1,227 @@
+"""
+This module keeps a journal for each in progress tarball download so that a
+puller restarted mid download picks up where it left off instead of starting
+over from byte zero.
+
+Each remote path gets a stable directory under the temporary download
+directory holding the partial tarball and a journal.json recording the remote
+path, the blob generation and size, the chunk size and which chunks are
+already durable on disk. A journal only resumes when the blob generation,
+size and chunk size all still match, anything else restarts the download.
+
+sweep_stale_downloads is meant to run once at startup, before any download,
+to clear out directories that can't be resumed.
+"""
+from dataclasses import dataclass, field
+from typing import Optional, Set
+import logging as log
+import threading
+import fcntl
+import hashlib
+import pathlib
+import shutil
+import json
+import time
+import os
+
+JOURNAL_FILE_NAME = "journal.json"
+TARBALL_FILE_NAME = "model.tar.gz"
+DEFAULT_MAX_JOURNAL_AGE = 24 * 60 * 60
+
+
+class DownloadInProgressException(Exception):
+    def __init__(self, remote_path, message):
+        self.remote_path = remote_path
+        self.message = message
+
+
+@dataclass()
+class DownloadJournal:
+    directory: pathlib.Path
+    remote_path: str
+    generation: int
+    size: int
+    chunk_size: int
+    completed_chunks: Set[int] = field(default_factory=set)
+    updated_at: float = 0
+    lock_fd: Optional[int] = field(default=None, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def tarball_path(self) -> pathlib.Path:
+        return self.directory.joinpath(TARBALL_FILE_NAME)
+
+    @property
+    def bytes_completed(self) -> int:
+        return sum(
+            min(start + self.chunk_size, self.size) - start for start in self.completed_chunks
+        )
+
+    def mark_completed(self, start: int):
+        """Records the chunk starting at start as durable. The caller must have
+        flushed the chunk to disk first.
+        """
+        with self._lock:
+            self.completed_chunks.add(start)
+            self.save()
+
+    def save(self):
+        self.updated_at = time.time()
+        data = {
+            "remote_path": self.remote_path,
+            "generation": self.generation,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "staging_path": str(self.directory),
+            "bytes_completed": self.bytes_completed,
+            "completed_chunks": sorted(self.completed_chunks),
+            "updated_at": self.updated_at,
+        }
+        journal_path = self.directory.joinpath(JOURNAL_FILE_NAME)
+        temp_path = journal_path.with_name(f".{JOURNAL_FILE_NAME}.{os.getpid()}")
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, journal_path)
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def release(self):
+        """Lets another process download this remote path again."""
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+
+def download_directory_for(temp_directory: str, remote_path: str) -> pathlib.Path:
+    remote_path_hash = hashlib.sha1(str(remote_path).encode("utf-8")).hexdigest()
+    return pathlib.Path(temp_directory).joinpath(f"journaled-{remote_path_hash}")
+
+
+def open_journal(
+    temp_directory: str, remote_path: str, generation: int, size: int, chunk_size: int
+) -> DownloadJournal:
+    """Returns the journal to download the given blob with, resuming an existing
+    one when it is for the same generation, size and chunk size.
+
+    The journal holds an exclusive lock on the remote path until released, so two
+    processes never write the same partial download.
+
+    :raises DownloadInProgressException: if the remote path is already being downloaded
+    """
+    directory = download_directory_for(temp_directory, remote_path)
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    lock_fd = _lock_download(directory.with_name(f"{directory.name}.lock"), remote_path)
+    try:
+        journal = _open_locked_journal(directory, remote_path, generation, size, chunk_size)
+    except Exception:
+        os.close(lock_fd)
+        raise
+    journal.lock_fd = lock_fd
+    return journal
+
+
+def _lock_download(lock_path: pathlib.Path, remote_path: str) -> int:
+    lock_fd = os.open(str(lock_path), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(lock_fd)
+        raise DownloadInProgressException(
+            remote_path=remote_path,
+            message=f"{remote_path} is already being downloaded by another process",
+        )
+    return lock_fd
+
+
+def _open_locked_journal(
+    directory: pathlib.Path, remote_path: str, generation: int, size: int, chunk_size: int
+) -> DownloadJournal:
+    journal = load_journal(directory)
+    if (
+        journal
+        and journal.remote_path == str(remote_path)
+        and journal.generation == generation
+        and journal.size == size
+        and journal.chunk_size == chunk_size
+        and journal.tarball_path.exists()
+    ):
+        log.warning(
+            f"resuming download of {remote_path} generation={generation} "
+            f"from {journal.bytes_completed}/{size} bytes"
+        )
+        return journal
+
+    if journal:
+        log.warning(f"discarding download journal {journal} for {remote_path} generation={generation}")
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+    journal = DownloadJournal(
+        directory=directory,
+        remote_path=str(remote_path),
+        generation=generation,
+        size=size,
+        chunk_size=chunk_size,
+    )
+    journal.save()
+    return journal
+
+
+def load_journal(directory: pathlib.Path) -> Optional[DownloadJournal]:
+    journal_path = pathlib.Path(directory).joinpath(JOURNAL_FILE_NAME)
+    try:
+        with open(journal_path, "r") as f:
+            data = json.load(f)
+        return DownloadJournal(
+            directory=pathlib.Path(directory),
+            remote_path=data["remote_path"],
+            generation=data["generation"],
+            size=data["size"],
+            chunk_size=data["chunk_size"],
+            completed_chunks=set(data["completed_chunks"]),
+            updated_at=data["updated_at"],
+        )
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as err:
+        log.warning(f"failed to read download journal at {journal_path} err={err}")
+        return None
+
+
+def sweep_stale_downloads(
+    temp_directory: str,
+    staging_directory: str = None,
+    max_age_seconds: float = DEFAULT_MAX_JOURNAL_AGE,
+) -> int:
+    """Removes everything under the temporary download directory except journaled
+    downloads updated within max_age_seconds, and everything under the staging
+    directory since a half extracted model can't be resumed.
+
+    :param temp_directory: the temporary download directory
+    :param staging_directory: optional staging directory used for extraction
+    :param max_age_seconds: oldest journal that is still worth resuming
+    :return: number of files and directories removed
+    """
+    removed = 0
+    now = time.time()
+    for directory in (temp_directory, staging_directory):
+        if not directory or not pathlib.Path(directory).exists():
+            continue
+        children = list(pathlib.Path(directory).iterdir())
+        resumable = set()
+        if directory == temp_directory:
+            for child in children:
+                journal = load_journal(child) if child.is_dir() else None
+                if journal and now - journal.updated_at <= max_age_seconds:
+                    resumable.update({child.name, f"{child.name}.lock"})
+
+        for child in children:
+            if child.name in resumable:
+                continue
+            log.warning(f"removing stale download data at {child}")
+            if child.is_dir() and not child.is_symlink():
+                shutil.rmtree(child, ignore_errors=True)
+            else:
+                child.unlink()
+            removed += 1
+    return removed
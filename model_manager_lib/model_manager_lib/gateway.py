@@ -0,0 +1,396 @@
+"""
+This module holds both halves of the optional caching gateway in front of GCS.
+
+GatewayClient stands in for storage.Client when a puller is pointed at a
+gateway with GcsApi.use_gateway. It covers the read side of the storage client
+the rest of model_manager_lib uses: get_bucket, list_blobs, bucket.get_blob,
+bucket.blob and the blob download methods, including ranged and
+generation pinned reads, so gcs.download_blob_in_chunks and
+gcs.stream_extract_blob work unchanged. Anything that writes to the bucket
+still has to go to GCS directly.
+
+The gateway service speaks a small subset of the GCS JSON api:
+
+    GET /b/<bucket>/o?prefix=<prefix>               listing
+    GET /b/<bucket>/o/<name>                        object metadata
+    GET /b/<bucket>/o/<name>?alt=media              object bytes, honours Range
+        &ifGenerationMatch=<generation>
+
+and keeps the objects in a GatewayObjectCache, a bounded on-disk LRU where
+concurrent misses for the same object share a single upstream fetch.
+"""
+from concurrent.futures import Future
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import quote
+from uuid import uuid4 as uuid
+import logging as log
+import threading
+import hashlib
+import pathlib
+import os
+
+import requests
+
+DEFAULT_GATEWAY_TIMEOUT = 60
+GATEWAY_READ_SIZE = 1024 * 1024
+
+
+class GatewayException(Exception):
+    def __init__(self, name, message):
+        self.name = name
+        self.message = message
+        super().__init__(message)
+
+
+class GatewayClient:
+    """Read only, duck typed replacement for storage.Client backed by a gateway"""
+
+    def __init__(self, gateway_url: str, timeout: float = DEFAULT_GATEWAY_TIMEOUT):
+        self.gateway_url = gateway_url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        # chunked downloads read from a thread pool, keep a session per thread
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def get_bucket(self, bucket_name: str) -> "GatewayBucket":
+        return GatewayBucket(client=self, name=bucket_name)
+
+    def bucket(self, bucket_name: str) -> "GatewayBucket":
+        return self.get_bucket(bucket_name)
+
+    def list_blobs(
+        self, bucket, prefix: str = None, fields: str = None, delimiter: str = None
+    ) -> "GatewayListing":
+        bucket = bucket if isinstance(bucket, GatewayBucket) else self.get_bucket(bucket)
+        params = {"prefix": prefix or ""}
+        if delimiter:
+            params["delimiter"] = delimiter
+        data = self.request(f"/b/{quote(bucket.name)}/o", params=params).json()
+        listing = GatewayListing(_dict_to_blob(bucket, item) for item in data["items"])
+        listing.prefixes = set(data.get("prefixes", []))
+        return listing
+
+    def request(self, path: str, params: dict = None, headers: dict = None, stream: bool = False):
+        url = f"{self.gateway_url}{path}"
+        try:
+            response = self.session.get(
+                url, params=params, headers=headers, stream=stream, timeout=self.timeout
+            )
+        except requests.RequestException as err:
+            raise GatewayException(name=path, message=f"request to {url} failed err={err!r}")
+        if response.status_code == 404:
+            return None
+        if not response.ok:
+            message = f"request to {url} failed with {response.status_code} {response.text[:200]}"
+            response.close()
+            raise GatewayException(name=path, message=message)
+        return response
+
+
+@dataclass()
+class GatewayBucket:
+    client: GatewayClient
+    name: str
+
+    def get_blob(self, blob_name: str) -> Optional["GatewayBlob"]:
+        response = self.client.request(_object_path(self.name, blob_name))
+        if response is None:
+            return None
+        return _dict_to_blob(self, response.json())
+
+    def blob(self, blob_name: str) -> "GatewayBlob":
+        return GatewayBlob(bucket=self, name=blob_name)
+
+    def list_blobs(self, prefix: str = None, delimiter: str = None) -> "GatewayListing":
+        return self.client.list_blobs(self, prefix=prefix, delimiter=delimiter)
+
+
+class GatewayListing(list):
+    """The blobs of a listing, plus the prefixes of a delimited one like the
+    page iterator of the storage client
+    """
+
+    prefixes: set = frozenset()
+
+
+@dataclass()
+class GatewayBlob:
+    bucket: GatewayBucket
+    name: str
+    size: int = None
+    generation: int = None
+    crc32c: str = None
+    updated: datetime = None
+    metadata: dict = None
+
+    def download_as_bytes(
+        self, client=None, start: int = None, end: int = None, if_generation_match: int = None, **kwargs
+    ) -> bytes:
+        response = self._media(start=start, end=end, if_generation_match=if_generation_match)
+        return response.content
+
+    def download_to_filename(self, filename: str, client=None, if_generation_match: int = None, **kwargs):
+        response = self._media(if_generation_match=if_generation_match, stream=True)
+        with response, open(filename, "wb") as f:
+            for data in response.iter_content(chunk_size=GATEWAY_READ_SIZE):
+                f.write(data)
+
+    def open(self, mode: str = "rb", chunk_size: int = None, if_generation_match: int = None, **kwargs):
+        assert mode == "rb", "gateway blobs can only be opened for binary reads"
+        response = self._media(if_generation_match=if_generation_match, stream=True)
+        return _GatewayReader(response)
+
+    def _media(self, start=None, end=None, if_generation_match=None, stream=False):
+        params = {"alt": "media"}
+        if if_generation_match is not None:
+            params["ifGenerationMatch"] = if_generation_match
+        headers = {}
+        if start is not None or end is not None:
+            headers["Range"] = f"bytes={start or 0}-{'' if end is None else end}"
+        response = self.bucket.client.request(
+            _object_path(self.bucket.name, self.name), params=params, headers=headers, stream=stream
+        )
+        if response is None:
+            raise GatewayException(name=self.name, message=f"{self.name} not found on the gateway")
+        return response
+
+
+class _GatewayReader:
+    """File like reader over a streamed gateway response"""
+
+    def __init__(self, response: requests.Response):
+        self.response = response
+
+    def read(self, size: int = -1) -> bytes:
+        return self.response.raw.read(None if size is None or size < 0 else size)
+
+    def close(self):
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def blob_to_dict(blob) -> dict:
+    """Serializes a storage.Blob the way the gateway returns object metadata"""
+    return {
+        "name": blob.name,
+        "size": blob.size,
+        "generation": blob.generation,
+        "crc32c": blob.crc32c,
+        "updated": blob.updated.isoformat() if blob.updated else None,
+        "metadata": blob.metadata,
+    }
+
+
+def _dict_to_blob(bucket: GatewayBucket, data: dict) -> GatewayBlob:
+    return GatewayBlob(
+        bucket=bucket,
+        name=data["name"],
+        size=None if data.get("size") is None else int(data["size"]),
+        generation=None if data.get("generation") is None else int(data["generation"]),
+        crc32c=data.get("crc32c"),
+        updated=datetime.fromisoformat(data["updated"]) if data.get("updated") else None,
+        metadata=data.get("metadata"),
+    )
+
+
+def _object_path(bucket_name: str, blob_name: str) -> str:
+    return f"/b/{quote(bucket_name)}/o/{quote(blob_name)}"
+
+
+def object_cache_key(bucket_name: str, blob_name: str, generation: int) -> str:
+    return hashlib.sha256(f"{bucket_name}/{blob_name}#{generation}".encode("utf-8")).hexdigest()
+
+
+class Coalescer:
+    """Runs one call per key at a time. Callers arriving while a call for their
+    key is in flight wait for it and share its result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def run(self, key, fn: Callable) -> Tuple[object, bool]:
+        """
+        :return: tuple of (result, whether it was shared from another caller)
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+@dataclass()
+class GatewayCacheStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+    bytes: int = 0
+    entries: int = 0
+
+
+class GatewayObjectCache:
+    """Bounded on-disk LRU of whole objects.
+
+    Usage is one cache per gateway process:
+
+    cache = GatewayObjectCache("/data/gateway_cache", max_bytes=100 * 1024 ** 3)
+    with cache.open(object_cache_key(bucket, name, generation), size, fill) as f:
+        ...
+
+    fill(path) is called to write a missing object to path, only once however
+    many requests miss on it concurrently. Entries are evicted least recently
+    used first to make room before a fill starts. An object larger than the
+    whole cache is fetched and served but not kept. Files handed out stay
+    readable after eviction since eviction only unlinks them.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, statsd_client=None):
+        assert max_bytes > 0, "max_bytes needs to be positive"
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.statsd_client = statsd_client
+        self.stats = GatewayCacheStats()
+        self._entries = OrderedDict()
+        self._reserved_bytes = 0
+        self._lock = threading.Lock()
+        self._coalescer = Coalescer()
+        self._load()
+
+    def _load(self):
+        """Picks up the objects a previous process left, oldest access first, and
+        drops partial fills.
+        """
+        entries = []
+        for path in self.directory.iterdir():
+            if path.name.startswith("."):
+                path.unlink()
+                continue
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self.stats.bytes += size
+        self.stats.entries = len(self._entries)
+        self._evict(0)
+        log.info(f"loaded gateway cache {self.directory} stats={self.stats}")
+
+    def open(self, key: str, size: int, fill: Callable[[pathlib.Path], None]):
+        """Opens the cached object for reading, filling it first when it is missing.
+
+        :param key: the object key, see object_cache_key
+        :param size: the object size in bytes, used to make room before filling
+        :param fill: writes the object to the path it is given
+        :return: a binary file object, the caller closes it
+        """
+        filled = False
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    if not filled:
+                        self.stats.hits += 1
+                        self._incr("cache.hits")
+                    path = self.directory.joinpath(key)
+                    os.utime(path)
+                    return open(path, "rb")
+
+            if size > self.max_bytes:
+                return self._open_uncached(key, fill)
+
+            _, coalesced = self._coalescer.run(key, lambda: self._fill(key, size, fill))
+            filled = True
+            if coalesced:
+                with self._lock:
+                    self.stats.coalesced += 1
+                self._incr("cache.coalesced")
+            # loop back round to open it, unless it was evicted again right away
+            # in which case it is refilled
+
+    def _open_uncached(self, key: str, fill: Callable[[pathlib.Path], None]):
+        log.warning(f"object {key} is larger than the whole gateway cache, not caching it")
+        temp_path = self.directory.joinpath(f".{key}.{uuid().hex}")
+        try:
+            fill(temp_path)
+            return open(temp_path, "rb")
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    def _fill(self, key: str, size: int, fill: Callable[[pathlib.Path], None]):
+        with self._lock:
+            if key in self._entries:
+                return
+            self.stats.misses += 1
+            self._reserved_bytes += size
+            self._evict(0)
+        self._incr("cache.misses")
+
+        temp_path = self.directory.joinpath(f".{key}.{uuid().hex}")
+        try:
+            fill(temp_path)
+            filled_size = temp_path.stat().st_size
+            os.rename(temp_path, self.directory.joinpath(key))
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            with self._lock:
+                self._reserved_bytes -= size
+
+        with self._lock:
+            self._entries[key] = filled_size
+            self.stats.bytes += filled_size
+            self.stats.entries = len(self._entries)
+            # the entry just filled is kept even if it alone overshoots the estimate
+            self._evict(1)
+        if self.statsd_client:
+            self.statsd_client.incr("cache.filled_bytes", filled_size)
+            self.statsd_client.gauge("cache.bytes", self.stats.bytes)
+
+    def _evict(self, keep_newest: int):
+        """Evicts least recently used entries until the cache plus in flight fills
+        fits in max_bytes. Must be called holding the lock.
+        """
+        while (
+            len(self._entries) > keep_newest
+            and self.stats.bytes + self._reserved_bytes > self.max_bytes
+        ):
+            key, size = self._entries.popitem(last=False)
+            self.directory.joinpath(key).unlink(missing_ok=True)
+            self.stats.bytes -= size
+            self.stats.evictions += 1
+            self._incr("cache.evictions")
+        self.stats.entries = len(self._entries)
+
+    def _incr(self, stat: str):
+        if self.statsd_client:
+            self.statsd_client.incr(stat)
@@ -6,21 +6,49 @@ of GCS and determining meaning in the file structure/system there.
 The main method of interacting is through RemoteRecords which encapsulate GCS
 stage, and the GoogleCloudStorage class which encapsulates how to retrieve and
 download models to the local file system.
+
+The remote directory is usually gs://bucket/environment. A file:///path/environment
+directory, e.g. a local mirror or an NFS mount, is served through a
+storage_backend.BackendBucket instead of a storage.Bucket, see
+_get_gcs_bucket_and_remaining_path. Everything else in here works on either.
 """
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from dataclasses import dataclass, field
 from typing import Dict, Tuple, List
 from uuid import uuid4 as uuid
-import subprocess as sp
 import tempfile
 import tarfile
 import pathlib
 import logging as log
+import base64
 import shutil
 import fnmatch
+import json
+import time
+import os
 
 from google.cloud import storage
+import google_crc32c
 
 from model_manager_lib import RecordKey, Record, PRIORITY_VERSION
+from model_manager_lib import local_filesystem, download_journal
+from model_manager_lib.download_journal import DownloadJournal
+from model_manager_lib.gateway import GatewayClient
+from model_manager_lib.storage_backend import (
+    FILE_SCHEME,
+    BackendBucket,
+    FileStorageBackend,
+    GcsStorageBackend,
+    StorageBackend,
+)
+
+DEFAULT_DOWNLOAD_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_DOWNLOAD_THREADS = 1
+CRC32C_READ_SIZE = 8 * 1024 * 1024
+STREAMING_READ_SIZE = 8 * 1024 * 1024
+REMOTE_INDEX_NAME = "_index.json"
+LATEST_POINTER_NAME = "_latest.json"
+DEFAULT_POINTER_READ_THREADS = 16
 
 
 class GcsApi:
@@ -34,12 +62,42 @@ class GcsApi:
             log.info("successfully connected to GCS client")
         return cls.client
 
+    @classmethod
+    def use_gateway(cls, gateway_url: str):
+        """Sends every listing and download through the caching gateway at
+        gateway_url instead of GCS, see model_manager_lib.gateway. Writes are
+        not supported through the gateway.
+        """
+        log.info(f"reading GCS through the gateway at {gateway_url}")
+        cls.client = GatewayClient(gateway_url)
+
 
 @dataclass(order=False, eq=True)
 class RemoteRecord(Record):
-    """Container for passing the GCS state around in a sane way"""
+    """Container for passing the GCS state around in a sane way.
+
+    generation, size, crc32c and updated (epoch seconds) describe the tarball
+    object the record was built from, None when unknown. A tarball re-uploaded
+    to the same version path keeps its version but gets a new generation.
+    """
 
     remote_path: pathlib.Path = None
+    generation: int = None
+    size: int = None
+    crc32c: str = None
+    updated: float = None
+
+
+@dataclass()
+class RemoteIndex:
+    """The published index of current remote records, see rebuild_remote_index.
+
+    records maps each current blob name to its generation and record
+    """
+
+    generation: int
+    generated_at: float
+    records: Dict[str, Tuple[int, RemoteRecord]] = None
 
 
 class GcsDownloadException(Exception):
@@ -50,25 +108,66 @@ class GcsDownloadException(Exception):
 
 
 def get_current_remote_records(
-        gcs_model_directory: str, framework=None
+        gcs_model_directory: str,
+        framework=None,
+        use_pointers: bool = False,
+        pointer_max_age_seconds: float = 0,
 ) -> Dict[RecordKey, RemoteRecord]:
     """Retrieves the known current remote records from the given gcs directory string. This function will only
     return records that it deems as "current"
 
     :param gcs_model_directory: str representing the gcs model directory to check
     :param framework: the framework to search, default=* or any
+    :param use_pointers: read the latest pointer of each model instead of listing
+        every version, see read_latest_pointers
+    :param pointer_max_age_seconds: list the versions of models whose pointer is
+        older than this, 0 trusts every pointer
     :return: Tuple[RemoteRecord]
     """
-    gcs_api = GcsApi.get_client()
-    bucket, env_path = _get_gcs_bucket_and_remaining_path(gcs_model_directory)
-    prefix = _format_gcs_search_prefix(env_path, framework=framework)
+    if use_pointers:
+        return read_latest_pointers(
+            gcs_model_directory, framework=framework, max_age_seconds=pointer_max_age_seconds
+        )
 
     remote_records: List[RemoteRecord] = [
         _blob_to_remote_record(gcs_blob)
-        for gcs_blob in gcs_api.list_blobs(bucket, prefix=prefix)
+        for gcs_blob in list_model_blobs(gcs_model_directory, framework=framework)
+    ]
+
+    return reduce_to_current_records(remote_records)
+
+
+def list_model_blobs(
+        gcs_model_directory: str, framework=None, fields: str = None
+) -> List[storage.Blob]:
+    """Lists every model tarball blob under the given gcs directory
+
+    :param gcs_model_directory: str representing the gcs model directory to check
+    :param framework: the framework to search, default=* or any
+    :param fields: optional partial response selector to trim the listing payload
+    :return: List[storage.Blob]
+    """
+    bucket, env_path = _get_gcs_bucket_and_remaining_path(gcs_model_directory)
+    prefix = _format_gcs_search_prefix(env_path, framework=framework)
+    list_kwargs = {"prefix": prefix}
+    if fields:
+        list_kwargs["fields"] = fields
+
+    return [
+        gcs_blob
+        for gcs_blob in list_blobs(bucket, **list_kwargs)
         if _is_valid_model(gcs_blob)
     ]
 
+
+def reduce_to_current_records(
+        remote_records: List[RemoteRecord],
+) -> Dict[RecordKey, RemoteRecord]:
+    """Reduces every known version of each model down to the "current" one
+
+    :param remote_records: the records to reduce, None values are skipped
+    :return: Dict[RecordKey, RemoteRecord]
+    """
     results: Dict[RecordKey, RemoteRecord] = dict()
     for remote_record in remote_records:
         if remote_record:
@@ -80,6 +179,223 @@ def get_current_remote_records(
     return results
 
 
+def rebuild_remote_index(gcs_model_directory: str) -> RemoteIndex:
+    """Lists the whole remote tree and publishes the current records to a single
+    index object at <env>/_index.json. Pullers can then fetch that one object
+    instead of listing every blob, see read_remote_index.
+
+    :param gcs_model_directory: str representing the gcs model directory to index
+    :return: RemoteIndex
+    """
+    bucket, env_path = _get_gcs_bucket_and_remaining_path(gcs_model_directory)
+    blob_records = [
+        (blob, _blob_to_remote_record(blob))
+        for blob in list_model_blobs(gcs_model_directory)
+    ]
+    current_records = reduce_to_current_records([record for _, record in blob_records])
+    current_remote_paths = {record.remote_path for record in current_records.values()}
+    generated_at = time.time()
+    data = {
+        "generated_at": generated_at,
+        "records": [
+            {
+                "name": blob.name,
+                "generation": blob.generation,
+                "record": _remote_record_to_dict(record),
+            }
+            for blob, record in blob_records
+            if record and record.remote_path in current_remote_paths
+        ],
+    }
+    index_blob = bucket.blob(str(env_path.joinpath(REMOTE_INDEX_NAME)))
+    index_blob.metadata = {"generated_at": str(generated_at)}
+    index_blob.upload_from_string(json.dumps(data), content_type="application/json")
+    log.info(
+        f"published remote index of {len(data['records'])} records to "
+        f"{_bucket_url(bucket)}/{index_blob.name}"
+    )
+    return _parse_remote_index(index_blob.generation, data)
+
+
+def read_remote_index(gcs_model_directory: str, known_generation: int = None) -> RemoteIndex:
+    """Reads the published remote index.
+
+    Returns None when there is no index. When the index generation matches
+    known_generation only its metadata is fetched and records is left as None,
+    the caller already has them.
+
+    :param gcs_model_directory: str representing the gcs model directory
+    :param known_generation: generation of the index the caller already holds
+    :return: RemoteIndex
+    """
+    bucket, env_path = _get_gcs_bucket_and_remaining_path(gcs_model_directory)
+    index_blob = bucket.get_blob(str(env_path.joinpath(REMOTE_INDEX_NAME)))
+    if index_blob is None:
+        log.info(f"no remote index found for {gcs_model_directory}")
+        return None
+
+    if known_generation is not None and index_blob.generation == known_generation:
+        return RemoteIndex(
+            generation=index_blob.generation,
+            generated_at=float((index_blob.metadata or {}).get("generated_at", 0)),
+        )
+
+    data = json.loads(
+        index_blob.download_as_bytes(if_generation_match=index_blob.generation)
+    )
+    return _parse_remote_index(index_blob.generation, data)
+
+
+def publish_latest_pointers(
+        gcs_model_directory: str, framework: str = None, name: str = None
+) -> Dict[RecordKey, dict]:
+    """Publishes a small <framework>/<name>/_latest.json pointer per model with its
+    latest version and its priority version, so readers can find the current
+    record of a model without listing every version, see read_latest_pointers.
+
+    Call it whenever versions are published or removed. It lists the versions of
+    a single model when name is set, otherwise of every model, and removes the
+    pointers of models that have no versions left.
+
+    :param gcs_model_directory: str representing the gcs model directory
+    :param framework: only publish the pointers of this framework
+    :param name: only publish the pointer of this model, needs framework
+    :return: the published pointers by model
+    """
+    assert framework or not name, "framework needs to be set if name is set"
+    bucket, env_path = _get_gcs_bucket_and_remaining_path(gcs_model_directory)
+    prefix = _format_gcs_search_prefix(env_path, framework=framework, model_name=name)
+    if framework:
+        prefix = prefix.rstrip("/") + "/"
+
+    records: Dict[RecordKey, List[RemoteRecord]] = dict()
+    pointer_names = set()
+    for blob in list_blobs(bucket, prefix=prefix):
+        if blob.name.endswith(f"/{LATEST_POINTER_NAME}"):
+            pointer_names.add(blob.name)
+        elif _is_valid_model(blob):
+            record = _blob_to_remote_record(blob)
+            if record:
+                records.setdefault(record.key, []).append(record)
+
+    pointers = dict()
+    for key, key_records in records.items():
+        pointer_name = _latest_pointer_name(env_path, key)
+        pointers[key] = _latest_pointer(key_records)
+        pointer_blob = bucket.blob(pointer_name)
+        pointer_blob.upload_from_string(json.dumps(pointers[key]), content_type="application/json")
+        pointer_names.discard(pointer_name)
+
+    if pointer_names:
+        log.info(f"removing latest pointers of models without versions {sorted(pointer_names)}")
+        bucket.delete_blobs([bucket.blob(pointer_name) for pointer_name in pointer_names])
+    log.info(f"published {len(pointers)} latest pointers under {_bucket_url(bucket)}/{prefix}")
+    return pointers
+
+
+def read_latest_pointers(
+        gcs_model_directory: str,
+        framework: str = None,
+        max_workers: int = DEFAULT_POINTER_READ_THREADS,
+        max_age_seconds: float = 0,
+) -> Dict[RecordKey, RemoteRecord]:
+    """Retrieves the current remote records from the latest pointer of every model.
+
+    Models are found with delimited listings of the framework and model "directories",
+    and their pointers are read concurrently, so the cost scales with the number of
+    models rather than the number of versions. A model without a pointer, or with
+    one older than max_age_seconds, falls back to listing its own versions, so a
+    version uploaded without republishing the pointer is found once it goes stale.
+
+    :param gcs_model_directory: str representing the gcs model directory to check
+    :param framework: the framework to search, default=* or any
+    :param max_workers: number of pointers read concurrently
+    :param max_age_seconds: oldest pointer trusted, 0 trusts every pointer
+    :return: Dict[RecordKey, RemoteRecord]
+    """
+    bucket, env_path = _get_gcs_bucket_and_remaining_path(gcs_model_directory)
+    if framework:
+        framework_prefixes = [f"{env_path}/{framework}/"]
+    else:
+        framework_prefixes = list_prefixes(bucket, f"{env_path}/")
+    model_prefixes = [
+        model_prefix
+        for framework_prefix in framework_prefixes
+        for model_prefix in list_prefixes(bucket, framework_prefix)
+    ]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        model_records = list(executor.map(
+            lambda model_prefix: _read_latest_pointer(bucket, model_prefix, max_age_seconds),
+            model_prefixes,
+        ))
+    return reduce_to_current_records(
+        [record for records in model_records for record in records]
+    )
+
+
+def _read_latest_pointer(bucket, model_prefix: str, max_age_seconds: float = 0) -> List[RemoteRecord]:
+    pointer_blob = bucket.get_blob(f"{model_prefix}{LATEST_POINTER_NAME}")
+    if pointer_blob is None:
+        log.warning(f"no latest pointer for {_bucket_url(bucket)}/{model_prefix}, listing its versions")
+        return _list_model_versions(bucket, model_prefix)
+
+    pointer = json.loads(pointer_blob.download_as_bytes(if_generation_match=pointer_blob.generation))
+    pointer_age = time.time() - pointer.get("generated_at", 0)
+    if max_age_seconds > 0 and pointer_age > max_age_seconds:
+        log.warning(
+            f"latest pointer for {_bucket_url(bucket)}/{model_prefix} is stale "
+            f"age={round(pointer_age)}s max_age={max_age_seconds}s, listing its versions"
+        )
+        return _list_model_versions(bucket, model_prefix)
+
+    return [
+        _dict_to_remote_record(pointer[kind])
+        for kind in ("priority", "latest")
+        if pointer.get(kind)
+    ]
+
+
+def _list_model_versions(bucket, model_prefix: str) -> List[RemoteRecord]:
+    return [
+        _blob_to_remote_record(blob)
+        for blob in list_blobs(bucket, prefix=model_prefix)
+        if _is_valid_model(blob)
+    ]
+
+
+def _latest_pointer(records: List[RemoteRecord]) -> dict:
+    versions = [record for record in records if not record.is_priority]
+    priority = [record for record in records if record.is_priority]
+    return {
+        "generated_at": time.time(),
+        "latest": _remote_record_to_dict(max(versions, key=lambda r: r.version)) if versions else None,
+        "priority": _remote_record_to_dict(priority[0]) if priority else None,
+    }
+
+
+def _latest_pointer_name(env_path: pathlib.Path, key: RecordKey) -> str:
+    return str(env_path.joinpath(key.framework, key.name, LATEST_POINTER_NAME))
+
+
+def get_remote_record_size(remote_record: RemoteRecord) -> int:
+    """Looks up the size in bytes of the tarball behind the given remote record
+
+    :param remote_record: the record to look up
+    :return: int
+    """
+    if remote_record.size is not None:
+        return remote_record.size
+
+    bucket, blob_path = _get_gcs_bucket_and_remaining_path(remote_record.remote_path)
+    blob = bucket.get_blob(str(blob_path))
+    if blob is None:
+        raise GcsDownloadException(
+            remote=remote_record, message=f"{remote_record} no longer exists remotely"
+        )
+    return blob.size
+
+
 def copy_remote_record_to_priority_bucket(
         gcs_model_directory: str, framework: str, name: str, version: int
 ):
@@ -118,71 +434,259 @@ def download_remote_record_locally(
         remote_record: RemoteRecord,
         local_directory: str,
         temp_directory: str,
+        chunk_size: int = DEFAULT_DOWNLOAD_CHUNK_SIZE,
+        max_workers: int = DEFAULT_DOWNLOAD_THREADS,
+        statsd_client=None,
+        streaming: bool = False,
+        staging_directory: str = None,
+        content_store_directory: str = None,
+        journaled: bool = False,
+        replace: bool = False,
+        executor: ThreadPoolExecutor = None,
 ):
     """Downloads the given remote record to the local directory.
 
-    This process will download to a temporary directory then untar the result.
+    This process will download to a temporary directory then untar the result
+    into the staging directory, which is published into place with
+    local_filesystem.publish_model_directory. When max_workers is greater than
+    one the tarball is fetched as byte ranges in parallel, see
+    download_blob_in_chunks. When streaming is set the tarball never touches
+    the disk, see stream_extract_blob. When journaled is set the tarball is
+    always fetched in chunks and a download interrupted by a restart resumes
+    from its last durable chunk, see download_journal.
 
     :param remote_record: the record to download
     :param local_directory: a path to the string to download
     :param temp_directory: a path to the temporary directory to use for downloading
+    :param chunk_size: size in bytes of each ranged request
+    :param max_workers: number of concurrent ranged requests
+    :param statsd_client: optional statsd client to report throughput to
+    :param streaming: decompress and untar the blob as it is downloaded
+    :param staging_directory: where to extract, must be on the same filesystem as
+        local_directory. Defaults to temp_directory
+    :param content_store_directory: when set, files already present in this
+        content store are hardlinked instead of kept as new copies, see
+        local_filesystem.deduplicate_model_directory
+    :param journaled: resume interrupted downloads, ignored when streaming
+    :param replace: replace an existing local_directory, used when the tarball
+        was re-uploaded under the same version
+    :param executor: optional executor shared between downloads to fetch byte
+        ranges on, see download_blob_in_chunks
     :return: None
     """
-    gcs_api = GcsApi.get_client()
     bucket, blob_path = _get_gcs_bucket_and_remaining_path(remote_record.remote_path)
+    gcs_api = get_bucket_client(bucket)
     blob = bucket.get_blob(str(blob_path))
-    temp_directory_path = pathlib.Path(temp_directory).joinpath(uuid().hex)
-    temp_directory_path.mkdir(parents=True, exist_ok=True)
-
     log.info(f"downloading record: {remote_record} to location {local_directory}")
-    temp_dir = pathlib.Path(tempfile.mkdtemp(dir=str(temp_directory_path.absolute())))
-
-    temp_dir.mkdir(parents=True, exist_ok=True)
-    temp_tar_file = temp_dir.joinpath(f"model.tar.gz")
-    temp_model_directory = temp_dir.joinpath("untared_model")
-    temp_model_directory.mkdir(parents=True, exist_ok=True)
-    log.warning(
-        f"downloading record: {remote_record} to temporary location {temp_tar_file} for unpacking"
-    )
-    blob.download_to_filename(temp_tar_file, client=gcs_api)
-    if not temp_tar_file.exists():
-        log.error(f"""
-        Failed to download model blob from remote for unknown reason!
-
-        remote_record:
-        {remote_record}
-
-        temp_file:
-        {temp_tar_file}
-        
-        temp_model_directory:
-        {temp_model_directory}
-
-        local_directory:
-        {local_directory}
-        """)
-        raise GcsDownloadException(remote=remote_record, message=f'{remote_record} failed to download')
-
-    log.debug(f"extracting tarfile at {temp_tar_file} to {temp_model_directory}")
-    with tarfile.open(temp_tar_file, mode="r") as tar:
-        for member in tar.getmembers():
-            if _tar_member_is_valid(member):
-                tar.extract(member, temp_model_directory.absolute())
+    journal = None
+    if journaled and not streaming and blob is not None:
+        try:
+            journal = download_journal.open_journal(
+                temp_directory,
+                remote_record.remote_path,
+                generation=blob.generation,
+                size=blob.size,
+                chunk_size=chunk_size,
+            )
+        except download_journal.DownloadInProgressException as err:
+            raise GcsDownloadException(remote=remote_record, message=err.message)
+        temp_directory_path = journal.directory
+        temp_tar_file = journal.tarball_path
+    else:
+        temp_directory_path = pathlib.Path(temp_directory).joinpath(uuid().hex)
+        temp_directory_path.mkdir(parents=True, exist_ok=True)
+        temp_dir = pathlib.Path(tempfile.mkdtemp(dir=str(temp_directory_path.absolute())))
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        temp_tar_file = temp_dir.joinpath(f"model.tar.gz")
+    if staging_directory:
+        staging_directory_path = pathlib.Path(staging_directory).joinpath(uuid().hex)
+    else:
+        staging_directory_path = temp_directory_path
+    temp_model_directory = staging_directory_path.joinpath("untared_model")
+    # a journaled tarball is kept for the next attempt until it has been extracted
+    keep_temp_directory = journal is not None
     try:
-        local_path = pathlib.Path(local_directory)
-        local_path.parent.mkdir(parents=True, exist_ok=True)
-        if local_path.exists():
-            log.error(
-                f"Attempt to move directory from {temp_model_directory} to {local_path} "
-                "but found race condition! Cowardly ignoring"
+        temp_model_directory.mkdir(parents=True, exist_ok=True)
+        if streaming:
+            log.warning(
+                f"streaming record: {remote_record} into temporary location {temp_model_directory}"
+            )
+            stream_extract_blob(blob, temp_model_directory)
+        else:
+            log.warning(
+                f"downloading record: {remote_record} to temporary location {temp_tar_file} for unpacking"
+            )
+            if journal or ((executor or max_workers > 1) and blob.size and blob.size > chunk_size):
+                try:
+                    download_blob_in_chunks(
+                        blob,
+                        temp_tar_file,
+                        chunk_size=chunk_size,
+                        max_workers=max_workers,
+                        client=gcs_api,
+                        statsd_client=statsd_client,
+                        journal=journal,
+                        executor=executor,
+                    )
+                except GcsDownloadException:
+                    # the partial download can't be trusted, start over next time
+                    if journal:
+                        journal.remove()
+                    raise
+            else:
+                blob.download_to_filename(temp_tar_file, client=gcs_api)
+            if not temp_tar_file.exists():
+                log.error(f"""
+                Failed to download model blob from remote for unknown reason!
+
+                remote_record:
+                {remote_record}
+
+                temp_file:
+                {temp_tar_file}
+
+                temp_model_directory:
+                {temp_model_directory}
+
+                local_directory:
+                {local_directory}
+                """)
+                raise GcsDownloadException(remote=remote_record, message=f'{remote_record} failed to download')
+
+            log.debug(f"extracting tarfile at {temp_tar_file} to {temp_model_directory}")
+            with tarfile.open(temp_tar_file, mode="r") as tar:
+                for member in tar.getmembers():
+                    if _tar_member_is_valid(member):
+                        tar.extract(member, temp_model_directory.absolute())
+        keep_temp_directory = False
+        try:
+            if content_store_directory:
+                local_filesystem.deduplicate_model_directory(
+                    temp_model_directory,
+                    content_store_directory,
+                    statsd_client=statsd_client,
+                )
+            local_filesystem.publish_model_directory(
+                temp_model_directory,
+                local_directory,
+                statsd_client=statsd_client,
+                remote_metadata=remote_record_metadata(remote_record, blob),
+                replace=replace,
             )
+        except Exception as err:
+            log.exception(err)
+            raise err
+    finally:
+        if keep_temp_directory:
+            shutil.rmtree(temp_model_directory.absolute(), ignore_errors=True)
+        else:
+            shutil.rmtree(temp_directory_path.absolute(), ignore_errors=True)
+        if staging_directory_path != temp_directory_path:
+            shutil.rmtree(staging_directory_path.absolute(), ignore_errors=True)
+        if journal:
+            journal.release()
+
+
+def download_blob_in_chunks(
+        blob: storage.Blob,
+        destination: pathlib.Path,
+        chunk_size: int = DEFAULT_DOWNLOAD_CHUNK_SIZE,
+        max_workers: int = 8,
+        client: storage.Client = None,
+        statsd_client=None,
+        journal: DownloadJournal = None,
+        executor: ThreadPoolExecutor = None,
+):
+    """Downloads the given blob as a set of byte ranges fetched concurrently.
+
+    A single download stream is capped well below what the NIC can do, so for
+    large tarballs we split the object into chunk_size ranges and fetch them
+    on a thread pool. Each range is written at its offset into a file that is
+    preallocated to the full object size. All ranges are pinned to the blob
+    generation so a re-upload mid download can't mix two objects together.
+
+    Once every range lands the whole file is checked against the object CRC32C.
+
+    With a journal, ranges it already holds are skipped and each new range is
+    flushed to disk before being recorded, so the download can be resumed.
+
+    Every range in flight is held in memory whole, so concurrent downloads should
+    share one executor, which bounds the memory of all of them to its max_workers
+    times chunk_size.
+
+    :param blob: the blob to download, must have its metadata loaded
+    :param destination: the file to write the blob into
+    :param chunk_size: size in bytes of each ranged request
+    :param max_workers: number of concurrent ranged requests
+    :param client: the storage client to download with
+    :param statsd_client: optional statsd client to report chunk throughput to
+    :param journal: optional journal to resume from and record progress in
+    :param executor: optional executor shared between downloads to fetch the
+        ranges on, max_workers is ignored when it is set
+    :return: None
+    """
+    assert blob.size is not None, "blob metadata needs to be loaded to download in chunks"
+    assert chunk_size > 0, "chunk_size needs to be positive"
+    destination = pathlib.Path(destination)
+    ranges = _chunk_ranges(blob.size, chunk_size)
+    if journal:
+        assert journal.chunk_size == chunk_size, "journal was written with another chunk_size"
+        ranges = [(start, end) for start, end in ranges if start not in journal.completed_chunks]
+        if statsd_client and journal.completed_chunks:
+            statsd_client.incr("gcs.download_resumed_bytes", journal.bytes_completed)
+    log.info(
+        f"downloading blob={blob.name} size={blob.size} in {len(ranges)} chunks "
+        f"with max_workers={max_workers if executor is None else 'shared'}"
+    )
+
+    flags = os.O_RDWR | os.O_CREAT
+    if not journal:
+        flags |= os.O_TRUNC
+    fd = os.open(str(destination), flags, 0o644)
+    try:
+        if os.fstat(fd).st_size != blob.size:
+            _preallocate(fd, blob.size)
+        if executor:
+            _download_ranges(executor, blob, fd, ranges, client, statsd_client, journal)
         else:
-            sp.run(["mv", temp_model_directory.absolute(), local_path.absolute()])
-    except Exception as err:
-        log.exception(err)
-        raise err
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                _download_ranges(executor, blob, fd, ranges, client, statsd_client, journal)
     finally:
-        shutil.rmtree(temp_directory_path.absolute(), ignore_errors=True)
+        os.close(fd)
+
+    _verify_crc32c(blob, destination)
+
+
+def stream_extract_blob(
+        blob: storage.Blob,
+        destination: pathlib.Path,
+        read_size: int = STREAMING_READ_SIZE,
+):
+    """Pipes the blob byte stream straight through gzip and tar stream mode into
+    the destination directory, so the tarball itself is never written to disk.
+
+    Every member still has to pass _tar_member_is_valid before it is written. The
+    CRC32C of the compressed stream is computed on the way through and checked
+    against the blob once the stream has been fully consumed.
+
+    :param blob: the blob to stream, must have its metadata loaded
+    :param destination: the directory to extract the members into
+    :param read_size: size in bytes of each read from GCS
+    :return: None
+    """
+    destination = pathlib.Path(destination)
+    with blob.open("rb", chunk_size=read_size, if_generation_match=blob.generation) as reader:
+        crc_reader = _Crc32cReader(reader)
+        with tarfile.open(fileobj=crc_reader, mode="r|gz") as tar:
+            for member in tar:
+                if _tar_member_is_valid(member):
+                    tar.extract(member, destination.absolute())
+        # tar stops reading at the end of archive marker, drain any padding so
+        # the checksum covers the whole object
+        while crc_reader.read(read_size):
+            ...
+
+    _check_crc32c(blob, crc_reader.b64digest())
 
 
 def remove_model_gcs_bucket(gcs_model_directory: str, framework: str, model_name: str):
@@ -200,6 +704,49 @@ def remove_model_gcs_bucket(gcs_model_directory: str, framework: str, model_name
     return
 
 
+def get_storage_backend(remote_directory: str) -> Tuple[StorageBackend, pathlib.Path]:
+    """Looks up the storage backend holding the given remote directory
+
+    :param remote_directory: a gs:// or file:// remote directory
+    :return: the backend and the path of the directory within it
+    """
+    bucket, path = _get_gcs_bucket_and_remaining_path(remote_directory)
+    if isinstance(bucket, BackendBucket):
+        return bucket.backend, path
+    return GcsStorageBackend(bucket), path
+
+
+def list_blobs(bucket, prefix: str, **list_kwargs) -> List[storage.Blob]:
+    """Lists the blobs under prefix of a bucket from _get_gcs_bucket_and_remaining_path"""
+    if isinstance(bucket, BackendBucket):
+        return bucket.list_blobs(prefix=prefix)
+    return GcsApi.get_client().list_blobs(bucket, prefix=prefix, **list_kwargs)
+
+
+def list_prefixes(bucket, prefix: str) -> List[str]:
+    """Lists the "directories" directly under prefix, each ending in a /"""
+    if isinstance(bucket, BackendBucket):
+        return bucket.backend.list_prefixes(prefix)
+    iterator = GcsApi.get_client().list_blobs(bucket, prefix=prefix, delimiter="/")
+    # prefixes are only known once every page has been read
+    for _ in iterator:
+        ...
+    return sorted(iterator.prefixes)
+
+
+def get_bucket_client(bucket) -> storage.Client:
+    """The client to pass to blob calls of the bucket, None for backend buckets"""
+    if isinstance(bucket, BackendBucket):
+        return None
+    return GcsApi.get_client()
+
+
+def _bucket_url(bucket) -> str:
+    if isinstance(bucket, BackendBucket):
+        return bucket.backend.url
+    return f"gs://{bucket.name}"
+
+
 def _is_valid_model(blob: storage.Blob) -> bool:
     """Valid models are those that can be handled
     by our system and should be processed
@@ -234,8 +781,78 @@ def _blob_to_remote_record(blob: storage.Blob) -> RemoteRecord:
             ),
             version=int(version) if not is_priority else 0,
             is_priority=is_priority,
-            remote_path=f"gs://{blob.bucket.name}/{blob.name}",
+            remote_path=f"{_bucket_url(blob.bucket)}/{blob.name}",
+            generation=blob.generation,
+            size=blob.size,
+            crc32c=blob.crc32c,
+            updated=blob.updated.timestamp() if blob.updated else None,
+        )
+
+
+def remote_record_metadata(remote_record: RemoteRecord, blob: storage.Blob = None) -> dict:
+    """The remote metadata kept beside a local version, see
+    local_filesystem.write_remote_metadata. The blob that was actually
+    downloaded, when given, wins over what the record was listed with.
+    """
+    metadata = _remote_record_to_dict(remote_record)
+    if blob is not None:
+        metadata.update(
+            generation=blob.generation,
+            size=blob.size,
+            crc32c=blob.crc32c,
+            updated=blob.updated.timestamp() if blob.updated else None,
         )
+    return metadata
+
+
+def remote_record_changed(remote_record: RemoteRecord, remote_metadata: dict) -> bool:
+    """Whether remote_record is a re-upload of the version described by the
+    remote_metadata of a local copy. Unknown generations are never considered changed.
+    """
+    if not remote_metadata or remote_record.generation is None:
+        return False
+    local_generation = remote_metadata.get("generation")
+    if local_generation is None or remote_metadata.get("remote_path") != remote_record.remote_path:
+        return False
+    return int(local_generation) != remote_record.generation
+
+
+def _remote_record_to_dict(record: RemoteRecord) -> dict:
+    return {
+        "framework": record.key.framework,
+        "name": record.key.name,
+        "version": record.version,
+        "is_priority": record.is_priority,
+        "remote_path": record.remote_path,
+        "generation": record.generation,
+        "size": record.size,
+        "crc32c": record.crc32c,
+        "updated": record.updated,
+    }
+
+
+def _dict_to_remote_record(data: dict) -> RemoteRecord:
+    return RemoteRecord(
+        key=RecordKey(framework=data["framework"], name=data["name"]),
+        version=data["version"],
+        is_priority=data["is_priority"],
+        remote_path=data["remote_path"],
+        generation=data.get("generation"),
+        size=data.get("size"),
+        crc32c=data.get("crc32c"),
+        updated=data.get("updated"),
+    )
+
+
+def _parse_remote_index(generation: int, data: dict) -> RemoteIndex:
+    return RemoteIndex(
+        generation=generation,
+        generated_at=data["generated_at"],
+        records={
+            entry["name"]: (entry["generation"], _dict_to_remote_record(entry["record"]))
+            for entry in data["records"]
+        },
+    )
 
 
 def _record_to_keep(record1: RemoteRecord, record2: RemoteRecord) -> RemoteRecord:
@@ -294,16 +911,152 @@ def _tar_member_is_valid(member: tarfile.TarInfo) -> bool:
     return True
 
 
+class _Crc32cReader:
+    """Wraps a readable file object and checksums everything read through it"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.checksum = google_crc32c.Checksum()
+
+    def read(self, size=-1) -> bytes:
+        data = self.fileobj.read(size)
+        self.checksum.update(data)
+        return data
+
+    def b64digest(self) -> str:
+        return base64.b64encode(self.checksum.digest()).decode("utf-8")
+
+
+def _chunk_ranges(size: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """Splits an object of the given size into inclusive byte ranges, which
+    is the format GCS expects for ranged reads.
+    """
+    return [
+        (start, min(start + chunk_size, size) - 1)
+        for start in range(0, size, chunk_size)
+    ]
+
+
+def _preallocate(fd: int, size: int):
+    if size == 0:
+        return
+    if hasattr(os, "posix_fallocate"):
+        os.posix_fallocate(fd, 0, size)
+    else:
+        os.ftruncate(fd, size)
+
+
+def _download_ranges(
+        executor: ThreadPoolExecutor,
+        blob: storage.Blob,
+        fd: int,
+        ranges: List[Tuple[int, int]],
+        client: storage.Client = None,
+        statsd_client=None,
+        journal: DownloadJournal = None,
+):
+    futures = {
+        executor.submit(_download_chunk, blob, fd, start, end, client, statsd_client): start
+        for start, end in ranges
+    }
+    try:
+        for future in as_completed(futures):
+            future.result()
+            if journal:
+                os.fsync(fd)
+                journal.mark_completed(futures[future])
+    except BaseException:
+        # the executor may be shared, don't leave ranges writing into fd once it
+        # is closed
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        raise
+
+
+def _download_chunk(
+        blob: storage.Blob,
+        fd: int,
+        start: int,
+        end: int,
+        client: storage.Client = None,
+        statsd_client=None,
+):
+    chunk_start_time = time.time()
+    data = blob.download_as_bytes(
+        client=client,
+        start=start,
+        end=end,
+        if_generation_match=blob.generation,
+        checksum=None,
+    )
+    expected_length = end - start + 1
+    if len(data) != expected_length:
+        raise GcsDownloadException(
+            remote=blob.name,
+            message=f"chunk {start}-{end} of {blob.name} returned {len(data)} bytes "
+                    f"expected {expected_length}",
+        )
+
+    view = memoryview(data)
+    offset = start
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+    took = time.time() - chunk_start_time
+    log.debug(f"downloaded chunk {start}-{end} of {blob.name} in {round(took, 3)}s")
+    if statsd_client:
+        statsd_client.timing("gcs.download_chunk", took * 1000)
+        statsd_client.incr("gcs.download_chunk.bytes", expected_length)
+        if took > 0:
+            statsd_client.gauge(
+                "gcs.download_chunk.bytes_per_second", int(expected_length / took)
+            )
+
+
+def _verify_crc32c(blob: storage.Blob, file_path: pathlib.Path):
+    if not blob.crc32c:
+        log.warning(f"blob={blob.name} has no crc32c! skipping integrity check")
+        return
+
+    with open(file_path, "rb") as f:
+        crc_reader = _Crc32cReader(f)
+        while crc_reader.read(CRC32C_READ_SIZE):
+            ...
+
+    _check_crc32c(blob, crc_reader.b64digest())
+
+
+def _check_crc32c(blob: storage.Blob, actual: str):
+    if not blob.crc32c:
+        log.warning(f"blob={blob.name} has no crc32c! skipping integrity check")
+        return
+
+    if actual != blob.crc32c:
+        log.error(
+            f"crc32c mismatch for blob={blob.name} expected={blob.crc32c} actual={actual}"
+        )
+        raise GcsDownloadException(
+            remote=blob.name,
+            message=f"{blob.name} failed crc32c check expected={blob.crc32c} actual={actual}",
+        )
+
+
 def _get_gcs_bucket_and_remaining_path(
         gcs_directory: str,
 ) -> Tuple[storage.Bucket, pathlib.Path]:
+    if gcs_directory.startswith(FILE_SCHEME):
+        return _get_file_bucket_and_remaining_path(gcs_directory)
+
     assert gcs_directory.startswith(
         "gs://"
     ), f"""
     Expected valid gcs format for given GCS model directory!
 
     expected:
-    stats with 'gs://'
+    stats with 'gs://' or 'file://'
 
     actual:
     {gcs_directory}
@@ -346,6 +1099,31 @@ def _get_gcs_bucket_and_remaining_path(
     return bucket, environment_path
 
 
+def _get_file_bucket_and_remaining_path(
+        file_directory: str,
+) -> Tuple[BackendBucket, pathlib.Path]:
+    """file:// directories live in a FileStorageBackend rooted at /, so blob
+    names are absolute paths without their leading slash.
+    """
+    file_path = pathlib.Path(file_directory[len(FILE_SCHEME):])
+    assert file_path.is_absolute(), f"""
+    Expected an absolute path for the given file model directory!
+
+    expected:
+    starts with 'file:///'
+
+    actual:
+    {file_directory}
+    """
+    assert len(file_path.parts) >= 2, f"""
+    Environment path of the file directory must have atleast one valid value in it!
+
+    actual:
+    {file_directory}
+    """
+    return BackendBucket(FileStorageBackend("/")), pathlib.Path(*file_path.parts[1:])
+
+
 def _format_gcs_search_prefix(
         env_path: pathlib.Path,
         framework=None,
@@ -0,0 +1,277 @@
+"""
+This module keeps a catalog of the versions in a local model directory, with
+what can't be parsed from their paths: how big a version is, when it was
+published, which remote object it came from and how long fetching it took.
+
+The catalog is a SQLite database in WAL mode, a hidden file in the local model
+directory so every service sharing the directory shares it:
+
+    <local model directory>/.local_catalog.sqlite3
+
+The puller is the only writer: it records every version it publishes, see
+record_version, and reconciles the catalog. Readers never block on it and each
+other in WAL mode. Once registered with local_filesystem.use_catalog,
+local_filesystem.get_known_local_models is answered with one indexed query
+instead of a glob of the directory tree, and remove_record drops the removed
+version.
+
+Versions published or removed behind the catalog's back, e.g. by an older
+release or a crash between publish and record, are repaired by reconcile, which
+compares the catalog with a scan of the directory. Until the first reconcile,
+and from a failed record until the next one, the catalog isn't trusted and
+is_reconciled is False, local_filesystem then scans the directory instead.
+"""
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+import logging as log
+import threading
+import sqlite3
+import pathlib
+import time
+import os
+
+from model_manager_lib import RecordKey
+from model_manager_lib import local_filesystem
+from model_manager_lib.local_filesystem import LocalRecord, LocalRecordDict
+
+CATALOG_FILE_NAME = ".local_catalog.sqlite3"
+CATALOG_BUSY_TIMEOUT_MS = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    framework TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    is_priority INTEGER NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    inode INTEGER NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    file_count INTEGER NOT NULL,
+    published_at REAL NOT NULL,
+    recorded_at REAL NOT NULL,
+    remote_path TEXT,
+    remote_generation INTEGER,
+    remote_crc32c TEXT,
+    fetch_seconds REAL,
+    source TEXT,
+    PRIMARY KEY (framework, name, version)
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+
+@dataclass()
+class LocalVersionMetadata:
+    framework: str
+    name: str
+    version: int
+    is_priority: bool
+    path: str
+    inode: int
+    size_bytes: int
+    file_count: int
+    published_at: float
+    recorded_at: float
+    remote_path: Optional[str] = None
+    remote_generation: Optional[int] = None
+    remote_crc32c: Optional[str] = None
+    fetch_seconds: Optional[float] = None
+    source: Optional[str] = None
+
+    def to_local_record(self) -> LocalRecord:
+        full_model_path = pathlib.Path(self.path)
+        return LocalRecord(
+            key=RecordKey(framework=self.framework, name=self.name),
+            version=self.version,
+            is_priority=self.is_priority,
+            full_model_path=full_model_path,
+            local_model_path=full_model_path.parent,
+        )
+
+
+_COLUMNS = list(LocalVersionMetadata.__dataclass_fields__)
+
+
+class LocalCatalog:
+    """Represents the catalog of a single local model directory.
+
+    Connections are opened per process and thread on first use, so a catalog is
+    safe to create before forking workers and to share between download threads.
+    """
+
+    def __init__(self, model_directory: str, catalog_path: str = None):
+        self.model_directory = pathlib.Path(model_directory).absolute()
+        self.catalog_path = pathlib.Path(
+            catalog_path or self.model_directory.joinpath(CATALOG_FILE_NAME)
+        )
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(_SCHEMA)
+
+    def record_version(
+        self, local_model_path: str, fetch_seconds: float = None, source: str = None
+    ) -> LocalVersionMetadata:
+        """Measures a published version and records it, replacing what was
+        recorded for the same version before.
+
+        :param local_model_path: the published version directory
+        :param fetch_seconds: how long downloading and extracting it took
+        :param source: where it was fetched from, e.g. gcs, delta or peer
+        :return: LocalVersionMetadata
+        """
+        full_model_path = pathlib.Path(local_model_path).absolute()
+        record = local_filesystem._path_to_local_record(full_model_path)
+        stat = full_model_path.stat()
+        remote_metadata = local_filesystem.read_remote_metadata(full_model_path) or {}
+        file_count = sum(len(file_names) for _, _, file_names in os.walk(full_model_path))
+        metadata = LocalVersionMetadata(
+            framework=record.key.framework,
+            name=record.key.name,
+            version=record.version,
+            is_priority=record.is_priority,
+            path=str(full_model_path),
+            inode=stat.st_ino,
+            size_bytes=local_filesystem._directory_usage(full_model_path),
+            file_count=file_count,
+            published_at=stat.st_ctime,
+            recorded_at=time.time(),
+            remote_path=remote_metadata.get("remote_path"),
+            remote_generation=remote_metadata.get("generation"),
+            remote_crc32c=remote_metadata.get("crc32c"),
+            fetch_seconds=fetch_seconds,
+            source=source,
+        )
+        with self._connection() as connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO versions ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in _COLUMNS)})",
+                [getattr(metadata, column) for column in _COLUMNS],
+            )
+        log.debug(f"recorded local version {metadata}")
+        return metadata
+
+    def remove_version(self, local_model_path: str):
+        with self._connection() as connection:
+            connection.execute(
+                "DELETE FROM versions WHERE path = ?",
+                (str(pathlib.Path(local_model_path).absolute()),),
+            )
+
+    def get_versions(self, framework: str = "*", name: str = "*") -> List[LocalVersionMetadata]:
+        rows = self._connection().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM versions "
+            "WHERE framework GLOB ? AND name GLOB ? "
+            "ORDER BY framework, name, is_priority DESC, version DESC",
+            (framework, name),
+        )
+        return [_row_to_metadata(row) for row in rows]
+
+    def get_known_local_models(self, framework: str = "*", name: str = "*") -> LocalRecordDict:
+        results: Dict[RecordKey, List[LocalRecord]] = dict()
+        for metadata in self.get_versions(framework=framework, name=name):
+            record = metadata.to_local_record()
+            results.setdefault(record.key, []).append(record)
+        return {key: tuple(records) for key, records in results.items()}
+
+    def summary(self) -> dict:
+        versions, size_bytes, last_recorded_at = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), MAX(recorded_at) FROM versions"
+        ).fetchone()
+        return {
+            "catalog_path": str(self.catalog_path),
+            "versions": versions,
+            "size_bytes": size_bytes,
+            "last_recorded_at": last_recorded_at,
+            "reconciled": self.is_reconciled(),
+        }
+
+    def is_reconciled(self) -> bool:
+        """Whether the catalog matched the directory as of its last reconcile and
+        nothing failed to be recorded since.
+        """
+        return self._connection().execute(
+            "SELECT 1 FROM state WHERE key = 'reconciled_at'"
+        ).fetchone() is not None
+
+    def invalidate(self):
+        """Stops the catalog being trusted until the next reconcile, e.g. after a
+        version failed to be recorded.
+        """
+        with self._connection() as connection:
+            connection.execute("DELETE FROM state WHERE key = 'reconciled_at'")
+
+    def reconcile(self) -> Tuple[int, int]:
+        """Brings the catalog in line with a scan of the model directory. Versions
+        missing from the catalog, or replaced since they were recorded, are
+        measured and recorded, rows of versions that are gone are dropped.
+
+        :return: tuple of versions recorded and rows dropped
+        """
+        start_time = time.time()
+        recorded_inodes = {
+            path: inode
+            for path, inode in self._connection().execute("SELECT path, inode FROM versions")
+        }
+        on_disk = {
+            str(record.full_model_path)
+            for records in local_filesystem._scan_known_local_models(
+                str(self.model_directory)
+            ).values()
+            for record in records
+        }
+
+        recorded = 0
+        for path in sorted(on_disk):
+            try:
+                inode = os.stat(path).st_ino
+            except FileNotFoundError:
+                continue
+            if recorded_inodes.get(path) != inode:
+                self.record_version(path, source="reconcile")
+                recorded += 1
+
+        dropped = sorted(set(recorded_inodes) - on_disk)
+        for path in dropped:
+            self.remove_version(path)
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES ('reconciled_at', ?)",
+                (time.time(),),
+            )
+
+        if recorded or dropped:
+            log.warning(
+                f"reconciled local catalog {self.catalog_path} recorded={recorded} "
+                f"dropped={len(dropped)} took={time.time() - start_time:.3f}s"
+            )
+        return recorded, len(dropped)
+
+    def _connection(self) -> sqlite3.Connection:
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(
+                str(self.catalog_path), timeout=CATALOG_BUSY_TIMEOUT_MS / 1000
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+
+def _row_to_metadata(row) -> LocalVersionMetadata:
+    metadata = LocalVersionMetadata(**dict(zip(_COLUMNS, row)))
+    metadata.is_priority = bool(metadata.is_priority)
+    return metadata
+
+
+def metadata_to_jsonable(versions: List[LocalVersionMetadata]) -> dict:
+    """Groups versions the same way as records_dict_to_jsonable"""
+    results = {}
+    for metadata in versions:
+        results.setdefault(metadata.framework, {}).setdefault(metadata.name, []).append(
+            asdict(metadata)
+        )
+    return results
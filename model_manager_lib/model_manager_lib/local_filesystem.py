@@ -1,13 +1,28 @@
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from typing import Dict, Tuple
+from fnmatch import fnmatchcase
+from uuid import uuid4 as uuid
 from glob import glob
 import logging as log
+import threading
+import hashlib
+import fcntl
 import pathlib
+import json
 import shutil
+import time
+import os
 
 from dataclasses_json import dataclass_json
 
+# inotify is optional, without it a watched directory is rescanned on every read
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+    inotify_flags = None
+
 from . import RecordKey, Record, PRIORITY_VERSION
 
 
@@ -20,9 +35,40 @@ class LocalRecord(Record):
 
 LocalRecordDict = Dict[RecordKey, Tuple[LocalRecord, ...]]
 
+CONTENT_STORE_DIRECTORY_NAME = ".content_store"
+CONTENT_STORE_MIN_FILE_SIZE = 64 * 1024
+CONTENT_HASH_READ_SIZE = 1024 * 1024
+REMOTE_METADATA_SUFFIX = ".remote.json"
+TRASH_DIRECTORY_NAME = ".trash"
+# held by whichever process empties the trash
+TRASH_LOCK_FILE_NAME = ".trash.lock"
+PREWARM_READ_SIZE = 8 * 1024 * 1024
+# a download holds the tarball and its extracted copy until it is published
+DOWNLOAD_DISK_OVERHEAD = 2
+
+
+class LocalPublishException(Exception):
+    def __init__(self, path, message):
+        self.path = path
+        self.message = message
+
 
 def get_known_local_models(
     model_directory: str, framework: str = "*", name: str = "*"
+) -> LocalRecordDict:
+    catalog = get_local_catalog(model_directory)
+    if catalog and catalog.is_reconciled():
+        return catalog.get_known_local_models(framework=framework, name=name)
+
+    index = get_local_model_index(model_directory)
+    if index:
+        return index.get_known_local_models(framework=framework, name=name)
+
+    return _scan_known_local_models(model_directory, framework=framework, name=name)
+
+
+def _scan_known_local_models(
+    model_directory: str, framework: str = "*", name: str = "*"
 ) -> LocalRecordDict:
     model_search_path = (
         pathlib.Path(model_directory).joinpath(framework).joinpath(name).absolute()
@@ -65,10 +111,733 @@ def get_expected_local_path(model_directory: str, record: Record) -> str:
     return str(local_path.absolute())
 
 
+def check_same_filesystem(staging_directory: str, model_directory: str):
+    """Raises LocalPublishException unless both directories live on the same
+    filesystem, which is what makes publish_model_directory a rename and not a copy.
+    """
+    staging_path = pathlib.Path(staging_directory)
+    model_path = pathlib.Path(model_directory)
+    staging_path.mkdir(parents=True, exist_ok=True)
+    model_path.mkdir(parents=True, exist_ok=True)
+    if staging_path.stat().st_dev != model_path.stat().st_dev:
+        log.error(
+            f"staging directory {staging_path} is not on the same filesystem as {model_path}!"
+        )
+        raise LocalPublishException(
+            path=staging_path,
+            message=f"staging directory {staging_path} is not on the same filesystem as {model_path}",
+        )
+
+
+def publish_model_directory(
+    staged_model_directory: str,
+    local_model_path: str,
+    statsd_client=None,
+    remote_metadata: dict = None,
+    replace: bool = False,
+) -> int:
+    """Atomically moves a fully extracted model version into the local model tree.
+
+    Every file in the staged directory is fsynced before the directory is renamed
+    into place, so tensorflow serving's filesystem poller either sees nothing or
+    the complete version directory. The staged directory has to be on the same
+    filesystem as the destination, otherwise LocalPublishException is raised
+    rather than falling back to a slow, partially visible copy.
+
+    :param staged_model_directory: the extracted model version to publish
+    :param local_model_path: the version directory to publish it as
+    :param statsd_client: optional statsd client to report publish latency and bytes to
+    :param remote_metadata: optional description of the remote object the version
+        came from, written beside it, see write_remote_metadata
+    :param replace: replace a version that is already present. The old directory
+        is moved aside and removed once the new one is in place
+    :return: bytes published, 0 if the version was already present
+    """
+    start_time = time.time()
+    staged_path = pathlib.Path(staged_model_directory).absolute()
+    local_path = pathlib.Path(local_model_path).absolute()
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    if local_path.exists() and not replace:
+        log.error(
+            f"Attempt to move directory from {staged_path} to {local_path} "
+            "but found race condition! Cowardly ignoring"
+        )
+        return 0
+
+    check_same_filesystem(staged_path, local_path.parent)
+    published_bytes = _fsync_tree(staged_path)
+    replaced_path = None
+    if local_path.exists():
+        replaced_path = local_path.with_name(f".{local_path.name}.replaced-{uuid().hex}")
+        log.warning(f"replacing {local_path} with {staged_path}")
+        os.rename(local_path, replaced_path)
+    os.rename(staged_path, local_path)
+    if remote_metadata is not None:
+        write_remote_metadata(local_path, remote_metadata)
+    _fsync_directory(local_path.parent)
+    if replaced_path:
+        trash = get_trash_collector(str(local_path.parents[2]))
+        if trash:
+            trash.put(replaced_path)
+        else:
+            shutil.rmtree(replaced_path, ignore_errors=True)
+
+    took = time.time() - start_time
+    log.info(f"published {published_bytes} bytes to {local_path} in {took:.3f}s")
+    if statsd_client:
+        statsd_client.timing("local.publish", took * 1000)
+        statsd_client.incr("local.publish_bytes", published_bytes)
+    return published_bytes
+
+
+def write_remote_metadata(local_model_path: str, remote_metadata: dict):
+    """Records what remote object a local version came from in a hidden
+    .<version>.remote.json file beside the version directory. Keeping it outside
+    the version keeps it out of tensorflow serving and the delta manifests.
+    """
+    metadata_path = _remote_metadata_path(local_model_path)
+    temp_path = metadata_path.with_name(f"{metadata_path.name}.{uuid().hex}")
+    with open(temp_path, "w") as f:
+        json.dump(remote_metadata, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, metadata_path)
+
+
+def read_remote_metadata(local_model_path: str) -> dict:
+    """The remote metadata written beside a local version, None when there is
+    none, e.g. for versions published before it was recorded.
+    """
+    try:
+        with open(_remote_metadata_path(local_model_path), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remote_metadata_path(local_model_path: str) -> pathlib.Path:
+    local_path = pathlib.Path(local_model_path).absolute()
+    return local_path.with_name(f".{local_path.name}{REMOTE_METADATA_SUFFIX}")
+
+
+def _fsync_tree(path: pathlib.Path) -> int:
+    total_bytes = 0
+    for directory, _, file_names in os.walk(path):
+        for file_name in file_names:
+            file_path = os.path.join(directory, file_name)
+            if os.path.islink(file_path):
+                continue
+            fd = os.open(file_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+                total_bytes += os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+        _fsync_directory(directory)
+    return total_bytes
+
+
+def _fsync_directory(path):
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def deduplicate_model_directory(
+    staged_model_directory: str,
+    content_store_directory: str,
+    min_file_size: int = CONTENT_STORE_MIN_FILE_SIZE,
+    statsd_client=None,
+) -> Tuple[int, int]:
+    """Replaces files in a staged model with hardlinks into a content addressed
+    store, so bytes shared between versions (assets, vocabularies) are kept once.
+
+    Files are keyed by sha256 under <store>/<first two hex chars>/<hash>. A file
+    whose hash is already stored is swapped for a link to the stored copy, any
+    other file is linked into the store as is. The store has to be on the same
+    filesystem as the model, and linked files must never be modified in place.
+    Files smaller than min_file_size are left alone.
+
+    The store is reference counted by the links themselves, see remove_record.
+
+    :param staged_model_directory: extracted model that hasn't been published yet
+    :param content_store_directory: root of the content store
+    :param min_file_size: smallest file in bytes worth deduplicating
+    :param statsd_client: optional statsd client to report deduplicated bytes to
+    :return: tuple of files and bytes that were already in the store
+    """
+    store_path = pathlib.Path(content_store_directory)
+    store_path.mkdir(parents=True, exist_ok=True)
+    check_same_filesystem(store_path, staged_model_directory)
+
+    linked_files, linked_bytes = 0, 0
+    for directory, _, file_names in os.walk(staged_model_directory):
+        for file_name in file_names:
+            file_path = pathlib.Path(directory).joinpath(file_name)
+            if file_path.is_symlink() or not file_path.is_file():
+                continue
+            size = file_path.stat().st_size
+            if size < min_file_size:
+                continue
+
+            stored_path = _content_store_path(store_path, _hash_file(file_path))
+            if _link_from_content_store(stored_path, file_path, size):
+                linked_files += 1
+                linked_bytes += size
+            else:
+                _link_into_content_store(file_path, stored_path)
+
+    log.info(
+        f"deduplicated {linked_files} files {linked_bytes} bytes in {staged_model_directory}"
+    )
+    if statsd_client:
+        statsd_client.incr("local.dedup_files", linked_files)
+        statsd_client.incr("local.dedup_bytes", linked_bytes)
+    return linked_files, linked_bytes
+
+
+def collect_content_store_garbage(content_store_directory: str) -> int:
+    """Removes stored files that no model version links to anymore.
+
+    :param content_store_directory: root of the content store
+    :return: bytes freed
+    """
+    freed_bytes = 0
+    for stored_path in pathlib.Path(content_store_directory).glob("*/*"):
+        try:
+            stat = stored_path.stat()
+            if stat.st_nlink == 1:
+                stored_path.unlink()
+                freed_bytes += stat.st_size
+        except FileNotFoundError:
+            continue
+    log.info(f"freed {freed_bytes} bytes from content store {content_store_directory}")
+    return freed_bytes
+
+
+def _hash_file(file_path: pathlib.Path) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(CONTENT_HASH_READ_SIZE), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def _content_store_path(store_path: pathlib.Path, content_hash: str) -> pathlib.Path:
+    return store_path.joinpath(content_hash[:2], content_hash)
+
+
+def _link_from_content_store(
+    stored_path: pathlib.Path, file_path: pathlib.Path, size: int
+) -> bool:
+    temp_path = file_path.with_name(f".{file_path.name}.{uuid().hex}")
+    try:
+        if stored_path.stat().st_size != size:
+            log.error(f"content store entry {stored_path} has an unexpected size! ignoring")
+            return False
+        os.link(stored_path, temp_path)
+    except FileNotFoundError:
+        # not stored yet, or garbage collected out from under us
+        return False
+    os.replace(temp_path, file_path)
+    return True
+
+
+def _link_into_content_store(file_path: pathlib.Path, stored_path: pathlib.Path):
+    stored_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(file_path, stored_path)
+    except FileExistsError:
+        # stored concurrently by another download, this copy stays unshared
+        pass
+
+
 def remove_record(record: LocalRecord):
+    """Deletes a local version. Under a model directory that uses_trash the version
+    is only renamed into the trash and reclaimed in the background.
+    """
     model_path = str(record.full_model_path.absolute())
+    catalog = get_local_catalog(str(record.full_model_path.absolute().parents[2]))
+    if catalog:
+        catalog.remove_version(model_path)
+    trash = get_trash_collector(str(record.full_model_path.absolute().parents[2]))
+    if trash:
+        trash.put(model_path)
+        _remote_metadata_path(model_path).unlink(missing_ok=True)
+        return
+
+    shares_content = _has_linked_files(model_path)
     log.warning(f"permanently deleting model at {model_path}")
     shutil.rmtree(model_path, ignore_errors=True)
+    _remote_metadata_path(model_path).unlink(missing_ok=True)
+
+    content_store_path = record.full_model_path.absolute().parents[2].joinpath(
+        CONTENT_STORE_DIRECTORY_NAME
+    )
+    if shares_content and content_store_path.exists():
+        collect_content_store_garbage(str(content_store_path))
+
+
+def _has_linked_files(model_path: str) -> bool:
+    for directory, _, file_names in os.walk(model_path):
+        for file_name in file_names:
+            try:
+                if os.lstat(os.path.join(directory, file_name)).st_nlink > 1:
+                    return True
+            except FileNotFoundError:
+                continue
+    return False
+
+
+class TrashCollector:
+    """Deletes local versions in the background.
+
+    put renames a version directory into <model directory>/.trash, which takes it
+    out of tensorflow serving's view and the local model listing at once. A
+    daemon thread then unlinks the trashed files at no more than
+    max_bytes_per_second, so removing a multi GB version doesn't starve serving
+    of disk I/O, and collects the content store once trashed files linked into
+    it are gone. Anything left in the trash by a previous process is reclaimed
+    the first time the thread runs.
+
+    Every process sharing the model directory puts into the same trash, but only
+    one of them should start the thread, else the throttle is multiplied by the
+    number of processes. collect also holds an flock on .trash.lock, so a second
+    collector skips its turn instead of racing the first for the same entries.
+
+    pending_bytes is the size of what's still in the trash, as of the last time
+    the thread looked, and is reported as the local.trash.pending_bytes gauge. It
+    is only tracked in the process that collects.
+    """
+
+    def __init__(
+        self,
+        model_directory: str,
+        max_bytes_per_second: int = 0,
+        statsd_client=None,
+        poll_seconds: float = 60,
+    ):
+        self.model_directory = pathlib.Path(model_directory).absolute()
+        self.trash_directory = self.model_directory.joinpath(TRASH_DIRECTORY_NAME)
+        self.max_bytes_per_second = max_bytes_per_second
+        self.statsd_client = statsd_client
+        self.poll_seconds = poll_seconds
+        self.pending_bytes = 0
+        self.reclaimed_bytes = 0
+        self._wake = threading.Event()
+        self._thread = None
+        self.trash_directory.mkdir(parents=True, exist_ok=True)
+
+    def put(self, path: str) -> pathlib.Path:
+        """Moves path into the trash and wakes the collector thread."""
+        path = pathlib.Path(path).absolute()
+        relative_name = ".".join(path.relative_to(self.model_directory).parts)
+        trashed_path = self.trash_directory.joinpath(f"{relative_name}.{uuid().hex}")
+        log.warning(f"moving model at {path} to trash {trashed_path}")
+        try:
+            os.rename(path, trashed_path)
+        except FileNotFoundError:
+            log.warning(f"model at {path} is already gone")
+            return None
+        self._wake.set()
+        return trashed_path
+
+    def start(self):
+        if self._thread is None:
+            self._wake.set()
+            self._thread = threading.Thread(target=self._run, name="trash_collector", daemon=True)
+            self._thread.start()
+
+    def collect(self) -> int:
+        """Deletes everything in the trash right now.
+
+        :return: bytes reclaimed, 0 when another process is collecting
+        """
+        lock_fd = os.open(
+            str(self.model_directory.joinpath(TRASH_LOCK_FILE_NAME)), os.O_RDWR | os.O_CREAT, 0o644
+        )
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                log.info(f"trash {self.trash_directory} is being emptied by another process")
+                return 0
+            return self._collect()
+        finally:
+            os.close(lock_fd)
+
+    def _collect(self) -> int:
+        entries = [
+            (entry, _directory_usage(entry) if entry.is_dir() else 0)
+            for entry in self.trash_directory.iterdir()
+        ]
+        self.pending_bytes = sum(size for _, size in entries)
+        self._report_pending()
+
+        start_time = time.time()
+        reclaimed_bytes, shares_content = 0, False
+        for entry, size in entries:
+            entry_bytes, entry_shares_content = self._delete_tree(entry, reclaimed_bytes, start_time)
+            reclaimed_bytes += entry_bytes
+            shares_content = shares_content or entry_shares_content
+            self.pending_bytes = max(self.pending_bytes - size, 0)
+            self._report_pending()
+
+        content_store_path = self.model_directory.joinpath(CONTENT_STORE_DIRECTORY_NAME)
+        if shares_content and content_store_path.exists():
+            reclaimed_bytes += collect_content_store_garbage(str(content_store_path))
+
+        self.reclaimed_bytes += reclaimed_bytes
+        if entries:
+            log.info(
+                f"reclaimed {reclaimed_bytes} bytes from {len(entries)} trashed models "
+                f"in {time.time() - start_time:.3f}s"
+            )
+            if self.statsd_client:
+                self.statsd_client.incr("local.trash.reclaimed_bytes", reclaimed_bytes)
+        return reclaimed_bytes
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self.poll_seconds)
+            self._wake.clear()
+            try:
+                self.collect()
+            except Exception as err:
+                log.exception(f"failed to empty trash {self.trash_directory}", exc_info=err)
+
+    def _delete_tree(self, path: pathlib.Path, throttled_bytes: int, start_time: float):
+        if not path.is_dir() or path.is_symlink():
+            path.unlink(missing_ok=True)
+            return 0, False
+
+        deleted_bytes, shares_content = 0, False
+        for directory, _, file_names in os.walk(path, topdown=False):
+            for file_name in file_names:
+                file_path = os.path.join(directory, file_name)
+                try:
+                    stat = os.lstat(file_path)
+                    os.unlink(file_path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_nlink > 1:
+                    # the bytes stay in the content store until it's collected
+                    shares_content = True
+                    continue
+                deleted_bytes += stat.st_size
+                self._throttle(throttled_bytes + deleted_bytes, start_time)
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+        return deleted_bytes, shares_content
+
+    def _throttle(self, deleted_bytes: int, start_time: float):
+        if not self.max_bytes_per_second:
+            return
+        ahead = deleted_bytes / self.max_bytes_per_second - (time.time() - start_time)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    def _report_pending(self):
+        if self.statsd_client:
+            self.statsd_client.gauge("local.trash.pending_bytes", self.pending_bytes)
+
+
+_trash_settings: Dict[str, dict] = {}
+_trash_collectors: Dict[Tuple[int, str], TrashCollector] = {}
+
+
+def use_trash(model_directory: str, max_bytes_per_second: int = 0, statsd_client=None):
+    """Makes remove_record trash versions under model_directory, see TrashCollector.
+
+    Collectors are created per process on first use, so this is safe to call
+    before forking workers. They only put into the trash, a single process has
+    to start the thread that empties it with get_trash_collector(...).start().
+
+    :param model_directory: the local model directory
+    :param max_bytes_per_second: rate the trash is reclaimed at, 0 is unthrottled
+    :param statsd_client: optional statsd client to report the trash to
+    """
+    _trash_settings[str(pathlib.Path(model_directory).absolute())] = dict(
+        max_bytes_per_second=max_bytes_per_second, statsd_client=statsd_client
+    )
+
+
+def get_trash_collector(model_directory: str) -> TrashCollector:
+    model_directory = str(pathlib.Path(model_directory).absolute())
+    if model_directory not in _trash_settings:
+        return None
+
+    collector_key = (os.getpid(), model_directory)
+    if collector_key not in _trash_collectors:
+        collector = TrashCollector(model_directory, **_trash_settings[model_directory])
+        _trash_collectors[collector_key] = collector
+    return _trash_collectors[collector_key]
+
+
+@dataclass()
+class LocalRetentionPolicy:
+    """Limits on what a node keeps in its local model directory, 0 disables a limit.
+
+    max_versions: versions kept per model, not counting the priority version
+    max_bytes: bytes all local versions together may use
+    min_free_bytes: bytes left free on the filesystem once a download lands
+    keep_rollback: keep the version before the newest one of every model
+    """
+
+    max_versions: int = 0
+    max_bytes: int = 0
+    min_free_bytes: int = 0
+    keep_rollback: bool = True
+
+
+@dataclass()
+class _VersionUsage:
+    inode: int
+    bytes: int
+    mtime: float
+
+
+class LocalRetention:
+    """Keeps a local model directory within a LocalRetentionPolicy.
+
+    Disk usage is tracked per version directory and measured once, when the
+    version is first seen. Published versions are never modified in place and a
+    replaced version is a new directory, so a changed inode is all it takes to
+    notice one. Files linked from the content store are split between the
+    versions linking them.
+
+    reserve is called before a download starts. It evicts the versions over
+    max_versions, evicts the oldest other versions until the download fits
+    max_bytes and min_free_bytes, and reserves room for it. When the download
+    doesn't fit even then nothing but the versions over max_versions is evicted
+    and the download is refused. The newest version of every model, its rollback
+    and the priority version are never evicted. The download being reserved for
+    counts as the newest version of its model.
+
+    Only space that is actually free counts. Under a model directory that
+    uses_trash, evicted versions keep their bytes until the trash is collected,
+    so reserve collects it itself whenever the download needs the room. When
+    another process is emptying the trash at the time, the download is refused.
+    """
+
+    def __init__(self, model_directory: str, policy: LocalRetentionPolicy, statsd_client=None):
+        self.model_directory = pathlib.Path(model_directory).absolute()
+        self.policy = policy
+        self.statsd_client = statsd_client
+        self.reserved_bytes = 0
+        self._lock = threading.Lock()
+        self._usage: Dict[pathlib.Path, _VersionUsage] = {}
+
+    def reserve(self, record: Record, incoming_bytes: int) -> bool:
+        """Makes room for a download of record, see the class docstring.
+
+        :param record: the record about to be downloaded
+        :param incoming_bytes: disk space the download needs until it is published
+        :return: whether the download fits, release has to be called once it's done
+        """
+        with self._lock:
+            records = get_known_local_models(str(self.model_directory))
+            used_bytes = self._refresh(records)
+            over_limit, candidates = self._eviction_candidates(records, record)
+
+            evicted = list(over_limit)
+            freed_bytes = sum(self._version_bytes(r) for r in evicted)
+            free_bytes = shutil.disk_usage(self.model_directory).free
+            trash = get_trash_collector(str(self.model_directory))
+            if trash and not self._fits(used_bytes, free_bytes, incoming_bytes):
+                # reclaim what earlier evictions trashed before evicting anything more
+                free_bytes = self._empty_trash(trash)
+            for candidate in sorted(candidates, key=self._version_mtime):
+                if self._fits(used_bytes - freed_bytes, free_bytes + freed_bytes, incoming_bytes):
+                    break
+                evicted.append(candidate)
+                freed_bytes += self._version_bytes(candidate)
+
+            fits = self._fits(used_bytes - freed_bytes, free_bytes + freed_bytes, incoming_bytes)
+            self._evict(evicted if fits else over_limit)
+            if fits and trash and freed_bytes:
+                # trashed versions hold on to their bytes until they are collected
+                free_bytes = self._empty_trash(trash)
+                fits = self._fits(used_bytes - freed_bytes, free_bytes, incoming_bytes)
+            if not fits:
+                log.warning(
+                    f"not enough local disk for record={record} incoming_bytes={incoming_bytes} "
+                    f"used_bytes={used_bytes} reserved_bytes={self.reserved_bytes} free_bytes={free_bytes}"
+                )
+                if self.statsd_client:
+                    self.statsd_client.incr("local.retention.refused")
+                return False
+
+            self.reserved_bytes += incoming_bytes
+            return True
+
+    def release(self, incoming_bytes: int):
+        with self._lock:
+            self.reserved_bytes -= incoming_bytes
+
+    def report(self) -> dict:
+        with self._lock:
+            used_bytes = self._refresh(get_known_local_models(str(self.model_directory)))
+            return {
+                "policy": asdict(self.policy),
+                "versions": len(self._usage),
+                "used_bytes": used_bytes,
+                "reserved_bytes": self.reserved_bytes,
+                "free_bytes": shutil.disk_usage(self.model_directory).free,
+            }
+
+    def _refresh(self, records: LocalRecordDict) -> int:
+        usage = {}
+        for model_records in records.values():
+            for record in model_records:
+                path = record.full_model_path
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                known = self._usage.get(path)
+                if known is None or known.inode != stat.st_ino:
+                    known = _VersionUsage(
+                        inode=stat.st_ino, bytes=_directory_usage(path), mtime=stat.st_mtime
+                    )
+                usage[path] = known
+        self._usage = usage
+        used_bytes = sum(u.bytes for u in usage.values())
+        if self.statsd_client:
+            self.statsd_client.gauge("local.retention.used_bytes", used_bytes)
+        return used_bytes
+
+    def _eviction_candidates(self, records: LocalRecordDict, incoming: Record):
+        """The versions over max_versions and the other versions that may be evicted"""
+        protected_count = 2 if self.policy.keep_rollback else 1
+        max_versions = self.policy.max_versions and max(self.policy.max_versions, protected_count)
+        over_limit, candidates = [], []
+        for key, model_records in records.items():
+            versions = [r for r in model_records if not r.is_priority]
+            newest = [r.version for r in versions]
+            if incoming.key == key and not incoming.is_priority:
+                newest.append(incoming.version)
+            newest = sorted(set(newest), reverse=True)
+            for record in versions:
+                rank = newest.index(record.version)
+                if max_versions and rank >= max_versions:
+                    over_limit.append(record)
+                elif rank >= protected_count:
+                    candidates.append(record)
+        return over_limit, candidates
+
+    def _fits(self, used_bytes: int, free_bytes: int, incoming_bytes: int) -> bool:
+        needed_bytes = self.reserved_bytes + incoming_bytes
+        if self.policy.max_bytes and used_bytes + needed_bytes > self.policy.max_bytes:
+            return False
+        return free_bytes - needed_bytes >= self.policy.min_free_bytes
+
+    def _empty_trash(self, trash: TrashCollector) -> int:
+        """Collects the trash right away and returns the free bytes left after"""
+        trash.collect()
+        return shutil.disk_usage(self.model_directory).free
+
+    def _evict(self, records):
+        for record in records:
+            log.warning(f"evicting record={record} by local retention policy={self.policy}")
+            evicted_bytes = self._version_bytes(record)
+            remove_record(record)
+            self._usage.pop(record.full_model_path, None)
+            if self.statsd_client:
+                self.statsd_client.incr("local.retention.evicted")
+                self.statsd_client.incr("local.retention.evicted_bytes", evicted_bytes)
+
+    def _version_bytes(self, record: LocalRecord) -> int:
+        usage = self._usage.get(record.full_model_path)
+        return usage.bytes if usage else 0
+
+    def _version_mtime(self, record: LocalRecord) -> float:
+        usage = self._usage.get(record.full_model_path)
+        return usage.mtime if usage else 0
+
+
+def _directory_usage(path: pathlib.Path) -> int:
+    total_bytes = 0
+    for directory, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                stat = os.lstat(os.path.join(directory, file_name))
+            except FileNotFoundError:
+                continue
+            if stat.st_nlink > 1:
+                # one of the links is the content store's own
+                total_bytes += stat.st_size // (stat.st_nlink - 1)
+            else:
+                total_bytes += stat.st_size
+    return total_bytes
+
+
+def prewarm_model_directory(
+    local_model_path: str, max_bytes: int, use_fadvise: bool = True, statsd_client=None
+) -> int:
+    """Pulls a published version into the page cache ahead of tensorflow serving
+    loading it, so the first load doesn't read variables/ cold from disk.
+
+    The variable shards go first, then the rest of the SavedModel, until
+    max_bytes. With use_fadvise the kernel is asked to read the files ahead with
+    POSIX_FADV_WILLNEED and this returns without waiting on the reads, otherwise
+    (or without posix_fadvise) the files are read through and discarded.
+
+    :param local_model_path: the published version directory
+    :param max_bytes: most bytes to pull into the page cache
+    :param use_fadvise: advise the kernel instead of reading the files
+    :param statsd_client: optional statsd client to report prewarmed bytes to
+    :return: bytes prewarmed
+    """
+    start_time = time.time()
+    model_path = pathlib.Path(local_model_path)
+    files = [
+        pathlib.Path(directory).joinpath(file_name)
+        for directory, _, file_names in os.walk(model_path)
+        for file_name in file_names
+    ]
+    files.sort(key=lambda f: (f.parent.name != "variables", ".data-" not in f.name, str(f)))
+
+    use_fadvise = use_fadvise and hasattr(os, "posix_fadvise")
+    prewarmed_bytes = 0
+    for file_path in files:
+        remaining_bytes = max_bytes - prewarmed_bytes
+        if remaining_bytes <= 0:
+            break
+        try:
+            prewarmed_bytes += _prewarm_file(file_path, remaining_bytes, use_fadvise)
+        except OSError as err:
+            log.warning(f"failed to prewarm {file_path} err={err}")
+
+    took = time.time() - start_time
+    log.info(f"prewarmed {prewarmed_bytes} bytes of {model_path} in {took:.3f}s")
+    if statsd_client:
+        statsd_client.timing("local.prewarm", took * 1000)
+        statsd_client.incr("local.prewarm_bytes", prewarmed_bytes)
+    return prewarmed_bytes
+
+
+def _prewarm_file(file_path: pathlib.Path, max_bytes: int, use_fadvise: bool) -> int:
+    fd = os.open(str(file_path), os.O_RDONLY)
+    try:
+        length = min(os.fstat(fd).st_size, max_bytes)
+        if use_fadvise:
+            os.posix_fadvise(fd, 0, length, os.POSIX_FADV_WILLNEED)
+            return length
+
+        read_bytes = 0
+        while read_bytes < length:
+            block = os.read(fd, min(PREWARM_READ_SIZE, length - read_bytes))
+            if not block:
+                break
+            read_bytes += len(block)
+        return read_bytes
+    finally:
+        os.close(fd)
 
 
 def get_all_local_records_bykey(
@@ -124,3 +893,212 @@ def _path_to_local_record(model_path: pathlib.Path) -> LocalRecord:
         full_model_path=model_path.absolute(),
         local_model_path=model_path.parent.absolute(),
     )
+
+
+class LocalModelIndex:
+    """In memory LocalRecordDict for a single local model directory.
+
+    The index is seeded by one scan and then kept current from inotify events on
+    the <framework>/<name>/<version> tree. Only the model directories touched by
+    an event are rescanned, and a full rescan happens if the kernel reports a
+    queue overflow. Dot directories are ignored the same as the glob scan.
+
+    generation is bumped every time the known records change, so callers can
+    cheaply skip work when nothing changed since the generation they last saw.
+
+    Without inotify_simple installed the index rescans on every read, but still
+    only bumps generation when the records actually changed.
+    """
+
+    WATCH_FLAGS = (
+        inotify_flags.CREATE
+        | inotify_flags.DELETE
+        | inotify_flags.MOVED_FROM
+        | inotify_flags.MOVED_TO
+        | inotify_flags.DELETE_SELF
+        | inotify_flags.MOVE_SELF
+        | inotify_flags.ONLYDIR
+        if inotify_flags
+        else 0
+    )
+
+    def __init__(self, model_directory: str):
+        self.model_directory = pathlib.Path(model_directory).absolute()
+        self.generation = 0
+        self.rescans = 0
+        self._lock = threading.Lock()
+        self._records: Dict[Tuple[str, str], Tuple[LocalRecord, ...]] = {}
+        self._inotify = INotify() if INotify else None
+        self._watch_paths: Dict[int, pathlib.Path] = {}
+        self._rescan()
+
+    def get_known_local_models(
+        self, framework: str = "*", name: str = "*"
+    ) -> LocalRecordDict:
+        self.refresh()
+        return {
+            records[0].key: records
+            for (record_framework, record_name), records in self._records.items()
+            if fnmatchcase(record_framework, framework)
+            and fnmatchcase(record_name, name)
+        }
+
+    def refresh(self) -> int:
+        """Applies any pending filesystem events and returns the current generation."""
+        with self._lock:
+            if not self._inotify:
+                self._rescan()
+                return self.generation
+
+            events = self._inotify.read(timeout=0)
+            if any(event.mask & inotify_flags.Q_OVERFLOW for event in events):
+                log.warning(f"inotify queue overflowed! rescanning {self.model_directory}")
+                self._rescan()
+                return self.generation
+
+            for model_path in self._changed_model_paths(events):
+                self._rescan_model(model_path)
+            return self.generation
+
+    def _changed_model_paths(self, events) -> set:
+        changed = set()
+        for event in events:
+            watch_path = self._watch_paths.get(event.wd)
+            if watch_path is None:
+                continue
+            if event.mask & inotify_flags.IGNORED:
+                del self._watch_paths[event.wd]
+                continue
+            # events on a watched directory itself are also reported to its parent
+            if not event.name or event.name.startswith("."):
+                continue
+
+            depth = len(watch_path.relative_to(self.model_directory).parts)
+            event_path = watch_path.joinpath(event.name)
+            if depth == 2:
+                # a version was added or removed under <framework>/<name>
+                changed.add(watch_path)
+            elif depth == 1:
+                # a model directory was added or removed under <framework>
+                changed.add(event_path)
+            elif depth == 0 and event_path.is_dir():
+                changed.update(self._watch_framework(event_path))
+            elif depth == 0:
+                changed.update(
+                    pathlib.Path(*([self.model_directory] + list(key)))
+                    for key in self._records
+                    if key[0] == event.name
+                )
+        return changed
+
+    def _rescan(self):
+        records = {}
+        if self._inotify:
+            for wd in list(self._watch_paths):
+                self._remove_watch(wd)
+            self._add_watch(self.model_directory)
+            for framework_path in self._list_directories(self.model_directory):
+                self._watch_framework(framework_path)
+
+        for record_key, model_records in _scan_known_local_models(
+            str(self.model_directory)
+        ).items():
+            records[(record_key.framework, record_key.name)] = model_records
+
+        self.rescans += 1
+        self._set_records(records)
+
+    def _rescan_model(self, model_path: pathlib.Path):
+        framework, name = model_path.parts[-2:]
+        if model_path.is_dir() and self._inotify:
+            self._add_watch(model_path)
+
+        records = dict(self._records)
+        model_records = _scan_known_local_models(
+            str(self.model_directory), framework=framework, name=name
+        ).get(RecordKey(framework=framework, name=name))
+        if model_records:
+            records[(framework, name)] = model_records
+        else:
+            records.pop((framework, name), None)
+        self._set_records(records)
+
+    def _watch_framework(self, framework_path: pathlib.Path):
+        self._add_watch(framework_path)
+        model_paths = self._list_directories(framework_path)
+        for model_path in model_paths:
+            self._add_watch(model_path)
+        return model_paths
+
+    def _set_records(self, records: Dict[Tuple[str, str], Tuple[LocalRecord, ...]]):
+        if records != self._records:
+            self._records = records
+            self.generation += 1
+
+    def _add_watch(self, path: pathlib.Path):
+        try:
+            wd = self._inotify.add_watch(str(path), self.WATCH_FLAGS)
+        except OSError as err:
+            log.warning(f"failed to watch {path} err={err}")
+            return
+        self._watch_paths[wd] = path
+
+    def _remove_watch(self, wd: int):
+        path = self._watch_paths.pop(wd)
+        try:
+            self._inotify.rm_watch(wd)
+        except OSError as err:
+            log.debug(f"watch on {path} already removed err={err}")
+
+    @staticmethod
+    def _list_directories(path: pathlib.Path):
+        try:
+            return [
+                child
+                for child in path.iterdir()
+                if child.is_dir() and not child.name.startswith(".")
+            ]
+        except OSError:
+            return []
+
+
+_watched_model_directories = set()
+_local_model_indexes: Dict[Tuple[int, str], LocalModelIndex] = {}
+# request threads race to build the index, each loser would leak an inotify fd
+_local_model_indexes_lock = threading.Lock()
+
+
+def watch(model_directory: str):
+    """Serves get_known_local_models for model_directory from a LocalModelIndex.
+
+    Each process builds its own index on first use, so this is safe to call
+    before forking workers.
+    """
+    _watched_model_directories.add(str(pathlib.Path(model_directory).absolute()))
+
+
+def get_local_model_index(model_directory: str) -> LocalModelIndex:
+    model_directory = str(pathlib.Path(model_directory).absolute())
+    if model_directory not in _watched_model_directories:
+        return None
+
+    index_key = (os.getpid(), model_directory)
+    with _local_model_indexes_lock:
+        if index_key not in _local_model_indexes:
+            _local_model_indexes[index_key] = LocalModelIndex(model_directory)
+        return _local_model_indexes[index_key]
+
+
+_local_catalogs = {}
+
+
+def use_catalog(catalog):
+    """Serves get_known_local_models for the catalog's model directory from a
+    local_catalog.LocalCatalog whenever it is reconciled, and drops removed
+    versions from it.
+    """
+    _local_catalogs[str(catalog.model_directory)] = catalog
+
+
+def get_local_catalog(model_directory: str):
+    return _local_catalogs.get(str(pathlib.Path(model_directory).absolute()))
@@ -0,0 +1,287 @@
+"""
+This module lets a remote_model_puller fetch a model version from another
+puller that already has it, instead of every puller downloading it from GCS.
+
+A puller serves each published version file by file, next to a manifest of the
+file sizes and sha256 hashes (see delta.build_manifest). A fetching puller
+assembles the version in its staging directory, checks every file against the
+manifest while it streams in, then publishes it with
+local_filesystem.publish_model_directory. When a manifest was published to GCS
+for the record it is passed as expected_manifest and the peer's manifest has
+to match it.
+
+The master decides where each puller fetches from with assign_peer_source, so
+a release fans out as a tree rather than a star: only gcs_seeds pullers
+download from GCS, and every puller holding the version serves at most fanout
+others at a time.
+"""
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+from urllib.parse import quote
+from uuid import uuid4 as uuid
+import logging as log
+import threading
+import hashlib
+import pathlib
+import shutil
+import time
+
+import requests
+
+from model_manager_lib import delta, gcs, local_filesystem
+from model_manager_lib.delta import Manifest
+from model_manager_lib.gcs import RemoteRecord
+
+PEER_SOURCE_PEER = "peer"
+PEER_SOURCE_GCS = "gcs"
+PEER_SOURCE_WAIT = "wait"
+DEFAULT_PEER_FANOUT = 2
+DEFAULT_PEER_GCS_SEEDS = 1
+DEFAULT_PEER_LEASE_SECONDS = 15 * 60
+DEFAULT_PEER_RETRY_AFTER = 5
+DEFAULT_PEER_TIMEOUT = 30
+PEER_READ_SIZE = 1024 * 1024
+PEER_MANIFEST_CACHE_SIZE = 64
+
+_manifest_cache = OrderedDict()
+_manifest_cache_lock = threading.Lock()
+
+
+class PeerFetchException(Exception):
+    def __init__(self, peer, message):
+        self.peer = peer
+        self.message = message
+
+
+def peer_model_path(remote_record: RemoteRecord) -> str:
+    return f"/peer/models/{remote_record.key.framework}/{remote_record.key.name}/{remote_record.version}"
+
+
+def get_peer_manifest(model_directory: str) -> dict:
+    """Returns the manifest a puller serves for one of its published versions.
+
+    Published versions are never modified in place, only replaced by a rename,
+    so the manifest is cached per directory inode and each version is hashed once.
+
+    :param model_directory: the published version directory
+    :return: the manifest as a json-able dict
+    """
+    model_path = pathlib.Path(model_directory)
+    cache_key = (str(model_path), model_path.stat().st_ino)
+    with _manifest_cache_lock:
+        if cache_key in _manifest_cache:
+            _manifest_cache.move_to_end(cache_key)
+            return _manifest_cache[cache_key]
+
+    manifest = delta._manifest_to_dict(delta.build_manifest(model_path))
+    with _manifest_cache_lock:
+        _manifest_cache[cache_key] = manifest
+        while len(_manifest_cache) > PEER_MANIFEST_CACHE_SIZE:
+            _manifest_cache.popitem(last=False)
+    return manifest
+
+
+def resolve_peer_file(model_directory: str, file_path: str) -> Optional[pathlib.Path]:
+    """Resolves a file requested by a peer, None unless it is a regular file
+    inside the version directory.
+    """
+    model_path = pathlib.Path(model_directory).resolve()
+    resolved_path = model_path.joinpath(file_path).resolve()
+    if model_path not in resolved_path.parents or not resolved_path.is_file():
+        return None
+    return resolved_path
+
+
+def iter_peer_file(file_path: pathlib.Path) -> Iterable[bytes]:
+    with open(file_path, "rb") as f:
+        while True:
+            data = f.read(PEER_READ_SIZE)
+            if not data:
+                return
+            yield data
+
+
+def download_remote_record_from_peer(
+    remote_record: RemoteRecord,
+    peer: str,
+    local_directory: str,
+    staging_directory: str,
+    expected_manifest: Manifest = None,
+    timeout: float = DEFAULT_PEER_TIMEOUT,
+    statsd_client=None,
+    content_store_directory: str = None,
+) -> int:
+    """Fetches a version another puller already published, verifying every file
+    against the manifest before publishing it.
+
+    :param remote_record: the record to fetch
+    :param peer: host:port of the puller to fetch from
+    :param local_directory: the version directory to publish as
+    :param staging_directory: where to assemble, on the same filesystem as local_directory
+    :param expected_manifest: optional manifest published to GCS the peer's has to match
+    :param timeout: seconds to wait on the peer for a connection or the next bytes
+    :param statsd_client: optional statsd client to report fetched bytes to
+    :param content_store_directory: when set, the fetched model is deduplicated
+        before it is published, see local_filesystem.deduplicate_model_directory
+    :return: bytes fetched
+    :raises PeerFetchException: if the peer doesn't have the version or sends something else
+    """
+    start_time = time.time()
+    url = f"http://{peer}{peer_model_path(remote_record)}"
+    staging_path = pathlib.Path(staging_directory).joinpath(uuid().hex)
+    assembled_path = staging_path.joinpath("assembled_model")
+    fetched_bytes = 0
+    with requests.Session() as session:
+        manifest = _get_peer_manifest(session, peer, url, timeout)
+        if expected_manifest and _manifest_files(manifest) != _manifest_files(expected_manifest):
+            raise PeerFetchException(
+                peer=peer, message=f"{peer} manifest for {remote_record} doesn't match the remote manifest"
+            )
+        try:
+            assembled_path.mkdir(parents=True)
+            for directory in manifest.directories:
+                _inside(peer, assembled_path, directory).mkdir(parents=True, exist_ok=True)
+            for entry in manifest.files:
+                destination = _inside(peer, assembled_path, entry.path)
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                _fetch_peer_file(
+                    session, peer, f"{url}/files/{quote(entry.path)}", entry, destination, timeout
+                )
+                fetched_bytes += entry.size
+
+            if content_store_directory:
+                local_filesystem.deduplicate_model_directory(
+                    assembled_path, content_store_directory, statsd_client=statsd_client
+                )
+            local_filesystem.publish_model_directory(
+                assembled_path,
+                local_directory,
+                statsd_client=statsd_client,
+                remote_metadata=gcs.remote_record_metadata(remote_record),
+            )
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+
+    took = time.time() - start_time
+    log.info(f"fetched {remote_record} from peer={peer} bytes={fetched_bytes} in {took:.3f}s")
+    if statsd_client:
+        statsd_client.timing("peer.download", took * 1000)
+        statsd_client.incr("peer.bytes_fetched", fetched_bytes)
+    return fetched_bytes
+
+
+def _get_peer_manifest(session: requests.Session, peer: str, url: str, timeout: float) -> Manifest:
+    try:
+        response = session.get(f"{url}/manifest", timeout=timeout)
+        response.raise_for_status()
+        return delta._dict_to_manifest(response.json())
+    except (requests.RequestException, ValueError, KeyError, AssertionError) as err:
+        raise PeerFetchException(peer=peer, message=f"failed to get manifest from {url} err={err!r}")
+
+
+def _inside(peer: str, directory: pathlib.Path, relative_path: str) -> pathlib.Path:
+    path = directory.joinpath(relative_path).resolve()
+    if directory.resolve() not in path.parents:
+        raise PeerFetchException(
+            peer=peer, message=f"{peer} manifest has a path outside the model {relative_path}"
+        )
+    return path
+
+
+def _fetch_peer_file(
+    session: requests.Session,
+    peer: str,
+    url: str,
+    entry: delta.ManifestEntry,
+    destination: pathlib.Path,
+    timeout: float,
+):
+    file_hash = hashlib.sha256()
+    size = 0
+    try:
+        with session.get(url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            with open(destination, "wb") as f:
+                for data in response.iter_content(chunk_size=PEER_READ_SIZE):
+                    file_hash.update(data)
+                    size += len(data)
+                    f.write(data)
+    except requests.RequestException as err:
+        raise PeerFetchException(peer=peer, message=f"failed to fetch {url} err={err!r}")
+
+    if size != entry.size or file_hash.hexdigest() != entry.sha256:
+        raise PeerFetchException(
+            peer=peer,
+            message=f"{url} failed its integrity check size={size} expected_size={entry.size}",
+        )
+
+
+def _manifest_files(manifest: Manifest) -> Dict[str, str]:
+    return {entry.path: entry.sha256 for entry in manifest.files}
+
+
+def assign_peer_source(
+    state: dict,
+    target: str,
+    live_targets: Iterable[str],
+    fanout: int = DEFAULT_PEER_FANOUT,
+    gcs_seeds: int = DEFAULT_PEER_GCS_SEEDS,
+    lease_seconds: float = DEFAULT_PEER_LEASE_SECONDS,
+    now: float = None,
+) -> dict:
+    """Picks where a puller should fetch a version from, recording the fetch in
+    state so the next assignment accounts for it.
+
+    The puller is sent to the live holder serving the fewest fetches, earliest
+    holder first so the tree stays shallow, as long as that holder is below
+    fanout. While no live puller holds the version yet it seeds from GCS if
+    fewer than gcs_seeds pullers are, otherwise it is told to wait and ask again. Fetches that haven't completed
+    within lease_seconds are assumed dead and stop counting.
+
+    :param state: the version's distribution state, updated in place
+    :param target: host:port of the puller asking
+    :param live_targets: pullers currently registered with the master
+    :return: dict with "source" of peer, gcs or wait, and "peer" when it is peer
+    """
+    now = now if now is not None else time.time()
+    holders = state.setdefault("holders", {})
+    fetching = state.setdefault("fetching", {})
+    for fetcher, fetch in list(fetching.items()):
+        if fetcher == target or now - fetch["started_at"] > lease_seconds:
+            del fetching[fetcher]
+
+    load = {}
+    for fetch in fetching.values():
+        load[fetch["source"]] = load.get(fetch["source"], 0) + 1
+
+    live_targets = set(live_targets)
+    live_holders = [
+        holder
+        for holder, _ in sorted(holders.items(), key=lambda item: item[1])
+        if holder != target and holder in live_targets
+    ]
+    candidates = [holder for holder in live_holders if load.get(holder, 0) < fanout]
+    if candidates:
+        peer = min(candidates, key=lambda holder: load.get(holder, 0))
+        fetching[target] = {"source": peer, "started_at": now}
+        return {"source": PEER_SOURCE_PEER, "peer": peer}
+
+    if not live_holders and load.get(PEER_SOURCE_GCS, 0) < gcs_seeds:
+        fetching[target] = {"source": PEER_SOURCE_GCS, "started_at": now}
+        return {"source": PEER_SOURCE_GCS}
+
+    return {"source": PEER_SOURCE_WAIT, "retry_after": DEFAULT_PEER_RETRY_AFTER}
+
+
+def complete_peer_fetch(state: dict, target: str, success: bool, now: float = None) -> dict:
+    """Ends a puller's fetch, making it a holder others can fetch from if it succeeded.
+
+    :param state: the version's distribution state, updated in place
+    :param target: host:port of the puller that finished
+    :param success: whether the version is now published on the puller
+    :return: state
+    """
+    state.setdefault("fetching", {}).pop(target, None)
+    if success:
+        state.setdefault("holders", {})[target] = now if now is not None else time.time()
+    return state
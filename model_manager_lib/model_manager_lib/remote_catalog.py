@@ -0,0 +1,272 @@
+"""
+This module keeps a persisted catalog of the remote model blobs so that every
+pull cycle doesn't have to rebuild the whole remote state from scratch.
+
+The catalog is keyed by blob name and generation. A refresh still lists the
+remote tree, but only asks GCS for the name, generation, size, crc32c and
+updated time of each blob and only rebuilds RemoteRecords for blobs that are
+new or have changed generation.
+The snapshot is written to disk so a restarted puller starts warm.
+
+When use_index is set the catalog first tries the published remote index (see
+gcs.rebuild_remote_index), which is a single object fetch, and only falls back
+to listing when the index is missing or older than index_max_age_seconds.
+
+When use_pointers is set a refresh reads the latest pointer of every model
+instead of listing every version, see gcs.read_latest_pointers. Models whose
+pointer is older than pointer_max_age_seconds are listed instead. Entries are
+then keyed by remote path.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from uuid import uuid4 as uuid
+import logging as log
+import threading
+import pathlib
+import json
+import time
+import os
+
+from model_manager_lib import RecordKey
+from model_manager_lib import gcs
+from model_manager_lib.gcs import RemoteRecord
+
+CATALOG_LISTING_FIELDS = "items(name,generation,size,crc32c,updated),nextPageToken"
+
+
+@dataclass()
+class RemoteCatalogEntry:
+    generation: int
+    record: Optional[RemoteRecord] = None
+
+
+@dataclass()
+class RemoteCatalogStats:
+    hits: int = 0
+    misses: int = 0
+    listings: int = 0
+    listing_duration: float = 0
+    entries: int = 0
+    source: str = None
+
+
+@dataclass()
+class RemoteCatalog:
+    """Represents the known remote blobs for a single gcs model directory.
+
+    Usage is meant to be one catalog per process, created at startup:
+
+    catalog = RemoteCatalog(
+        gcs_model_directory="gs://bucket/env",
+        snapshot_path=pathlib.Path("/data/.remote_catalog.json"),
+        max_age_seconds=60,
+    )
+    remotes = catalog.get_current_remote_records()
+
+    Calls within max_age_seconds of the last refresh are answered from memory
+    without touching GCS. Refreshes are serialized, so request threads and the
+    pull loop sharing a catalog never refresh or save the snapshot at once. After each call stats holds the hits (blobs whose
+    generation was unchanged), misses (new or changed blobs), how long the
+    listing took and whether it came from the index or a full listing.
+    """
+
+    gcs_model_directory: str
+    snapshot_path: pathlib.Path
+    max_age_seconds: float = 0
+    use_index: bool = False
+    index_max_age_seconds: float = 0
+    use_pointers: bool = False
+    pointer_max_age_seconds: float = 0
+    index_generation: Optional[int] = None
+    refreshed_at: float = 0
+    entries: Dict[str, RemoteCatalogEntry] = field(default_factory=dict)
+    stats: RemoteCatalogStats = field(default_factory=RemoteCatalogStats)
+    _lock: threading.RLock = field(
+        default_factory=threading.RLock, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        self.snapshot_path = pathlib.Path(self.snapshot_path)
+        self._load_snapshot()
+
+    def get_current_remote_records(
+            self, framework=None, force_refresh=False
+    ) -> Dict[RecordKey, RemoteRecord]:
+        with self._lock:
+            if force_refresh or time.time() - self.refreshed_at > self.max_age_seconds:
+                self.refresh()
+            entries = list(self.entries.values())
+
+        return gcs.reduce_to_current_records(
+            [
+                entry.record
+                for entry in entries
+                if entry.record
+                and (framework is None or entry.record.key.framework == framework)
+            ]
+        )
+
+    def refresh(self):
+        with self._lock:
+            if self.use_index and self._refresh_from_index():
+                return
+            if self.use_pointers:
+                self._refresh_from_pointers()
+                return
+            self._refresh_from_listing()
+
+    def _refresh_from_index(self) -> bool:
+        listing_start_time = time.time()
+        index = gcs.read_remote_index(
+            self.gcs_model_directory, known_generation=self.index_generation
+        )
+        if index is None:
+            log.warning("remote index is missing! falling back to listing")
+            return False
+
+        index_age = time.time() - index.generated_at
+        if self.index_max_age_seconds > 0 and index_age > self.index_max_age_seconds:
+            log.warning(
+                f"remote index is stale age={round(index_age)}s "
+                f"max_age={self.index_max_age_seconds}s! falling back to listing"
+            )
+            return False
+
+        if index.records is None:
+            log.info(f"remote index generation={index.generation} unchanged")
+            hits, misses = len(self.entries), 0
+        else:
+            hits, misses = 0, 0
+            entries: Dict[str, RemoteCatalogEntry] = dict()
+            for name, (generation, record) in index.records.items():
+                known_entry = self.entries.get(name)
+                if known_entry and known_entry.generation == generation:
+                    hits += 1
+                    entries[name] = known_entry
+                else:
+                    misses += 1
+                    entries[name] = RemoteCatalogEntry(generation=generation, record=record)
+            self.entries = entries
+
+        self.index_generation = index.generation
+        self._refreshed("index", hits, misses, time.time() - listing_start_time)
+        return True
+
+    def _refresh_from_listing(self):
+        listing_start_time = time.time()
+        blobs = gcs.list_model_blobs(
+            self.gcs_model_directory, fields=CATALOG_LISTING_FIELDS
+        )
+        listing_duration = time.time() - listing_start_time
+
+        hits, misses = 0, 0
+        entries: Dict[str, RemoteCatalogEntry] = dict()
+        for blob in blobs:
+            known_entry = self.entries.get(blob.name)
+            if known_entry and known_entry.generation == blob.generation:
+                hits += 1
+                entries[blob.name] = known_entry
+            else:
+                misses += 1
+                entries[blob.name] = RemoteCatalogEntry(
+                    generation=blob.generation,
+                    record=gcs._blob_to_remote_record(blob),
+                )
+
+        self.entries = entries
+        self.index_generation = None
+        self._refreshed("listing", hits, misses, listing_duration)
+
+    def _refresh_from_pointers(self):
+        listing_start_time = time.time()
+        records = gcs.read_latest_pointers(
+            self.gcs_model_directory, max_age_seconds=self.pointer_max_age_seconds
+        )
+        listing_duration = time.time() - listing_start_time
+
+        hits, misses = 0, 0
+        entries: Dict[str, RemoteCatalogEntry] = dict()
+        for record in records.values():
+            known_entry = self.entries.get(record.remote_path)
+            if known_entry and known_entry.generation == record.generation:
+                hits += 1
+                entries[record.remote_path] = known_entry
+            else:
+                misses += 1
+                entries[record.remote_path] = RemoteCatalogEntry(
+                    generation=record.generation, record=record
+                )
+
+        self.entries = entries
+        self.index_generation = None
+        self._refreshed("pointers", hits, misses, listing_duration)
+
+    def _refreshed(self, source: str, hits: int, misses: int, listing_duration: float):
+        self.refreshed_at = time.time()
+        self.stats = RemoteCatalogStats(
+            hits=hits,
+            misses=misses,
+            listings=self.stats.listings + 1,
+            listing_duration=listing_duration,
+            entries=len(self.entries),
+            source=source,
+        )
+        log.info(f"refreshed remote catalog stats={self.stats}")
+        self._save_snapshot()
+
+    def _load_snapshot(self):
+        if not self.snapshot_path.exists():
+            return
+
+        try:
+            with open(self.snapshot_path, "r") as f:
+                data = json.load(f)
+
+            if data.get("gcs_model_directory") != self.gcs_model_directory:
+                log.warning(
+                    f"remote catalog snapshot is for {data.get('gcs_model_directory')} "
+                    f"not {self.gcs_model_directory}! starting cold"
+                )
+                return
+
+            entries = {
+                name: RemoteCatalogEntry(
+                    generation=entry["generation"],
+                    record=gcs._dict_to_remote_record(
+                        # snapshots written before records carried their generation
+                        {"generation": entry["generation"], **entry["record"]}
+                    )
+                    if entry["record"]
+                    else None,
+                )
+                for name, entry in data["entries"].items()
+            }
+        except (OSError, ValueError, KeyError) as err:
+            log.warning(f"failed to load remote catalog snapshot, starting cold err={err}")
+            return
+
+        self.entries = entries
+        self.index_generation = data.get("index_generation")
+        log.info(f"loaded {len(self.entries)} remote catalog entries from {self.snapshot_path}")
+
+    def _save_snapshot(self):
+        data = {
+            "gcs_model_directory": self.gcs_model_directory,
+            "refreshed_at": self.refreshed_at,
+            "index_generation": self.index_generation,
+            "entries": {
+                name: {
+                    "generation": entry.generation,
+                    "record": gcs._remote_record_to_dict(entry.record)
+                    if entry.record
+                    else None,
+                }
+                for name, entry in self.entries.items()
+            },
+        }
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.snapshot_path.with_name(f".{self.snapshot_path.name}.{os.getpid()}.{uuid().hex}")
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.snapshot_path)
+
@@ -0,0 +1,231 @@
+"""
+This module removes old model versions from the remote model directory.
+
+A retention policy keeps the latest keep_versions versions of every model, its
+priority version, and any version a node reports as served. Everything else
+under the version directories of a model is deleted:
+
+    <env>/<framework>/<name>/<version>/model.tar.gz
+    <env>/<framework>/<name>/<version>/manifest.json
+
+The shared delta file objects under <env>/<framework>/<name>/_files are deleted
+once no kept manifest references them, see delta. Files younger than
+files_grace_seconds are never deleted, a manifest being published uploads its
+files before the manifest itself.
+
+Planning only lists and reads manifests, so a plan doubles as the dry run
+report. apply_remote_retention deletes the planned objects in batches of
+delete_batch_size on a thread pool.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Set
+import logging as log
+import json
+import time
+
+from model_manager_lib import RecordKey, PRIORITY_VERSION
+from model_manager_lib import delta, gcs
+
+DEFAULT_KEEP_VERSIONS = 3
+# GCS batch requests are capped at 100 calls
+DEFAULT_DELETE_BATCH_SIZE = 100
+DEFAULT_DELETE_THREADS = 8
+DEFAULT_FILES_GRACE_SECONDS = 24 * 3600
+
+
+@dataclass()
+class RetentionPlan:
+    """The objects a retention policy would delete.
+
+    kept_versions and deleted_versions are keyed by "<framework>/<name>"
+    """
+
+    gcs_model_directory: str
+    keep_versions: int
+    kept_versions: Dict[str, List[int]] = field(default_factory=dict)
+    deleted_versions: Dict[str, List[int]] = field(default_factory=dict)
+    blob_names: List[str] = field(default_factory=list)
+    bytes_reclaimed: int = 0
+
+    @property
+    def objects_reclaimed(self) -> int:
+        return len(self.blob_names)
+
+    def report(self) -> dict:
+        return {
+            "gcs_model_directory": self.gcs_model_directory,
+            "keep_versions": self.keep_versions,
+            "objects_reclaimed": self.objects_reclaimed,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "kept_versions": self.kept_versions,
+            "deleted_versions": self.deleted_versions,
+        }
+
+
+@dataclass()
+class _ModelBlobs:
+    versions: Dict[int, list] = field(default_factory=dict)
+    files: list = field(default_factory=list)
+
+
+def plan_remote_retention(
+        gcs_model_directory: str,
+        keep_versions: int = DEFAULT_KEEP_VERSIONS,
+        protected_versions: Dict[RecordKey, Set[int]] = None,
+        files_grace_seconds: float = DEFAULT_FILES_GRACE_SECONDS,
+        now: float = None,
+) -> RetentionPlan:
+    """Plans which remote objects the retention policy deletes, without deleting any.
+
+    :param gcs_model_directory: str representing the gcs model directory
+    :param keep_versions: number of the latest versions to keep for every model
+    :param protected_versions: versions that are kept regardless, e.g. the ones
+        nodes report as served
+    :param files_grace_seconds: delta file objects younger than this are kept
+    :param now: current time, for tests
+    :return: RetentionPlan
+    """
+    assert keep_versions >= 1, "keep_versions needs to keep at least the latest version"
+    protected_versions = protected_versions or {}
+    now = time.time() if now is None else now
+    bucket, env_path = gcs._get_gcs_bucket_and_remaining_path(gcs_model_directory)
+    env_prefix = f"{env_path}/"
+
+    models: Dict[RecordKey, _ModelBlobs] = dict()
+    for blob in gcs.list_blobs(bucket, prefix=env_prefix):
+        parts = blob.name[len(env_prefix):].split("/")
+        if len(parts) < 4:
+            continue
+        framework, name, directory, *_ = parts
+        model = models.setdefault(RecordKey(framework=framework, name=name), _ModelBlobs())
+        if directory == delta.FILES_DIRECTORY_NAME:
+            model.files.append(blob)
+        elif directory.isdigit():
+            model.versions.setdefault(int(directory), []).append(blob)
+
+    plan = RetentionPlan(gcs_model_directory=gcs_model_directory, keep_versions=keep_versions)
+    for key, model in sorted(models.items(), key=lambda item: (item[0].framework, item[0].name)):
+        versions = sorted(
+            (v for v in model.versions if v != PRIORITY_VERSION), reverse=True
+        )
+        kept = set(versions[:keep_versions]) | set(protected_versions.get(key, set()))
+        if PRIORITY_VERSION in model.versions:
+            kept.add(PRIORITY_VERSION)
+        deleted = sorted(v for v in model.versions if v not in kept)
+        model_name = f"{key.framework}/{key.name}"
+        plan.kept_versions[model_name] = sorted(v for v in model.versions if v in kept)
+        if deleted:
+            plan.deleted_versions[model_name] = deleted
+        for version in deleted:
+            _plan_delete(plan, model.versions[version])
+
+        if model.files:
+            referenced = _referenced_files(bucket, [model.versions[v] for v in kept if v in model.versions])
+            if referenced is None:
+                log.warning(f"failed to read every kept manifest of {model_name}, keeping its files")
+                continue
+            _plan_delete(plan, [
+                blob
+                for blob in model.files
+                if blob.name.rsplit("/", 1)[-1] not in referenced
+                and _age(blob, now) > files_grace_seconds
+            ])
+
+    log.info(
+        f"planned retention of {gcs_model_directory} keep_versions={keep_versions} "
+        f"objects={plan.objects_reclaimed} bytes={plan.bytes_reclaimed}"
+    )
+    return plan
+
+
+def apply_remote_retention(
+        plan: RetentionPlan,
+        delete_batch_size: int = DEFAULT_DELETE_BATCH_SIZE,
+        max_workers: int = DEFAULT_DELETE_THREADS,
+        statsd_client=None,
+) -> int:
+    """Deletes the objects of a plan, delete_batch_size objects per
+    bucket.delete_blobs call with max_workers calls in flight.
+
+    :param plan: the plan from plan_remote_retention
+    :param delete_batch_size: number of objects per delete_blobs call
+    :param max_workers: number of concurrent delete_blobs calls
+    :param statsd_client: optional statsd client to report deletes to
+    :return: number of objects deleted
+    """
+    assert delete_batch_size > 0, "delete_batch_size needs to be positive"
+    bucket, _ = gcs._get_gcs_bucket_and_remaining_path(plan.gcs_model_directory)
+    batches = [
+        plan.blob_names[start: start + delete_batch_size]
+        for start in range(0, len(plan.blob_names), delete_batch_size)
+    ]
+
+    def delete_batch(blob_names: List[str]) -> int:
+        # objects already gone, e.g. removed by another run, are not errors
+        bucket.delete_blobs([bucket.blob(name) for name in blob_names], on_error=lambda _: None)
+        return len(blob_names)
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        deleted = sum(executor.map(delete_batch, batches))
+
+    took = time.time() - start_time
+    log.warning(
+        f"retention deleted {deleted} objects {plan.bytes_reclaimed} bytes from "
+        f"{plan.gcs_model_directory} in {len(batches)} batches took {took:.3f}s"
+    )
+    if statsd_client:
+        statsd_client.incr("retention.objects_deleted", deleted)
+        statsd_client.incr("retention.bytes_deleted", plan.bytes_reclaimed)
+        statsd_client.timing("retention.apply", took * 1000)
+    return deleted
+
+
+def served_versions_from_reports(reports: Iterable[dict]) -> Dict[RecordKey, Set[int]]:
+    """Collects the versions in node reports shaped like records_dict_to_jsonable,
+    {framework: {name: [record, ...]}}, e.g. the config_manager /tensorflow_serving/all
+    """
+    served: Dict[RecordKey, Set[int]] = dict()
+    for report in reports:
+        for framework, names in report.items():
+            for name, records in names.items():
+                served.setdefault(RecordKey(framework=framework, name=name), set()).update(
+                    int(record["version"]) for record in records
+                )
+    return served
+
+
+def _plan_delete(plan: RetentionPlan, blobs: list):
+    for blob in blobs:
+        plan.blob_names.append(blob.name)
+        plan.bytes_reclaimed += blob.size or 0
+
+
+def _referenced_files(bucket, kept_version_blobs: List[list]):
+    """The sha256 of every file the manifests of the kept versions reference,
+    None when one of them can't be read.
+    """
+    referenced = set()
+    for blobs in kept_version_blobs:
+        for blob in blobs:
+            if not blob.name.endswith(f"/{delta.MANIFEST_NAME}"):
+                continue
+            try:
+                # master pins google-cloud-storage 1.29, download_as_bytes is from 1.32
+                manifest = delta._dict_to_manifest(json.loads(blob.download_as_string()))
+            except Exception as err:
+                log.warning(f"failed to read manifest {blob.name} err={err!r}")
+                return None
+            referenced.update(entry.sha256 for entry in manifest.files)
+    return referenced
+
+
+def _age(blob, now: float) -> float:
+    if blob.updated is None:
+        return 0
+    updated = blob.updated
+    if isinstance(updated, datetime):
+        updated = updated.replace(tzinfo=updated.tzinfo or timezone.utc).timestamp()
+    return now - updated
@@ -0,0 +1,480 @@
+"""
+This module puts the remote model directory behind a small storage backend
+interface, so it doesn't have to live on GCS.
+
+StorageBackend covers what the model manager needs from an object store: list,
+stat, ranged read, copy, delete and write. GcsStorageBackend implements it on a
+GCS bucket and FileStorageBackend on a directory tree, such as a local mirror or
+an NFS mount. The scheme of the remote model directory picks the backend, see
+gcs.get_storage_backend:
+
+    gs://bucket/environment             GCS
+    file:///mnt/models/environment      a local or NFS directory
+
+gcs.py keeps talking to GCS through the google storage client itself. Any other
+backend is handed to it as a BackendBucket, which exposes a StorageBackend
+through the part of the storage.Bucket and storage.Blob api gcs.py uses, so
+listing, downloading and publishing is the same code for every backend.
+"""
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import BinaryIO, Dict, Iterable, List, Optional
+from uuid import uuid4 as uuid
+import logging as log
+import tempfile
+import pathlib
+import shutil
+import json
+import io
+import os
+
+from google.cloud import storage
+
+FILE_SCHEME = "file://"
+DEFAULT_RANGE_READ_SIZE = 8 * 1024 * 1024
+FILE_METADATA_SUFFIX = ".metadata.json"
+
+
+class StorageBackendException(Exception):
+    def __init__(self, name, message):
+        self.name = name
+        self.message = message
+        super().__init__(message)
+
+
+@dataclass()
+class StorageObject:
+    name: str
+    size: int
+    generation: int
+    crc32c: str = None
+    updated: datetime = None
+    metadata: Dict[str, str] = None
+
+
+class StorageBackend(ABC):
+    """An object store holding the remote model directory. Object names are
+    "/" separated paths relative to the root of the store.
+    """
+
+    @property
+    @abstractmethod
+    def url(self) -> str:
+        """The prefix that turns an object name into a remote path, url/name"""
+
+    @abstractmethod
+    def list(self, prefix: str) -> List[StorageObject]:
+        """Every object whose name starts with prefix"""
+
+    @abstractmethod
+    def list_prefixes(self, prefix: str) -> List[str]:
+        """The "directories" directly under prefix, each ending in a /"""
+
+    @abstractmethod
+    def stat(self, name: str) -> Optional[StorageObject]:
+        """The object, None if it doesn't exist"""
+
+    @abstractmethod
+    def read_range(self, name: str, start: int, end: int, generation: int = None) -> bytes:
+        """Reads the inclusive byte range start-end of an object.
+
+        :raises StorageBackendException: if generation is set and the object is at another one
+        """
+
+    @abstractmethod
+    def copy(self, source_name: str, destination_name: str) -> StorageObject:
+        """Copies an object within the store"""
+
+    @abstractmethod
+    def delete(self, names: Iterable[str]):
+        """Deletes the objects, ignoring ones that don't exist"""
+
+    @abstractmethod
+    def write(self, name: str, fileobj: BinaryIO, metadata: Dict[str, str] = None) -> StorageObject:
+        """Creates or replaces an object with the contents of fileobj. Readers see
+        either the old or the new object, never a partial one.
+        """
+
+
+class GcsStorageBackend(StorageBackend):
+    def __init__(self, bucket: storage.Bucket):
+        self.bucket = bucket
+
+    @property
+    def url(self) -> str:
+        return f"gs://{self.bucket.name}"
+
+    def list(self, prefix: str) -> List[StorageObject]:
+        return [_gcs_blob_to_object(blob) for blob in self.bucket.list_blobs(prefix=prefix)]
+
+    def list_prefixes(self, prefix: str) -> List[str]:
+        iterator = self.bucket.list_blobs(prefix=prefix, delimiter="/")
+        for _ in iterator:
+            ...
+        return sorted(iterator.prefixes)
+
+    def stat(self, name: str) -> Optional[StorageObject]:
+        blob = self.bucket.get_blob(name)
+        return _gcs_blob_to_object(blob) if blob else None
+
+    def read_range(self, name: str, start: int, end: int, generation: int = None) -> bytes:
+        return self.bucket.blob(name).download_as_bytes(
+            start=start, end=end, if_generation_match=generation, checksum=None
+        )
+
+    def copy(self, source_name: str, destination_name: str) -> StorageObject:
+        return _gcs_blob_to_object(
+            self.bucket.copy_blob(self.bucket.blob(source_name), self.bucket, destination_name)
+        )
+
+    def delete(self, names: Iterable[str]):
+        self.bucket.delete_blobs([self.bucket.blob(name) for name in names], on_error=lambda _: None)
+
+    def write(self, name: str, fileobj: BinaryIO, metadata: Dict[str, str] = None) -> StorageObject:
+        blob = self.bucket.blob(name)
+        blob.metadata = metadata
+        blob.upload_from_file(fileobj)
+        return _gcs_blob_to_object(blob)
+
+
+def _gcs_blob_to_object(blob: storage.Blob) -> StorageObject:
+    return StorageObject(
+        name=blob.name,
+        size=blob.size,
+        generation=blob.generation,
+        crc32c=blob.crc32c,
+        updated=blob.updated,
+        metadata=blob.metadata,
+    )
+
+
+class FileStorageBackend(StorageBackend):
+    """Stores objects as files under root, which can be any local or NFS directory.
+
+    Writes go to a temporary file next to the object and are renamed into place.
+    The generation of an object is the st_mtime_ns of its file. There is no
+    crc32c, so downloads skip the checksum. Metadata is kept in a hidden
+    .<name>.metadata.json file next to the object, and hidden files are never
+    listed.
+    """
+
+    def __init__(self, root: str = "/"):
+        self.root = pathlib.Path(root).absolute()
+
+    @property
+    def url(self) -> str:
+        return f"{FILE_SCHEME}{self.root.as_posix().rstrip('/')}"
+
+    def path(self, name: str) -> pathlib.Path:
+        name_path = pathlib.PurePosixPath(name)
+        if name_path.is_absolute() or ".." in name_path.parts:
+            raise StorageBackendException(name=name, message=f"{name} is not a valid object name")
+        return self.root.joinpath(*name_path.parts)
+
+    def list(self, prefix: str) -> List[StorageObject]:
+        # walk only the deepest directory the prefix names fully
+        prefix_directory = prefix.rsplit("/", 1)[0] if "/" in prefix else ""
+        walk_root = self.path(prefix_directory) if prefix_directory else self.root
+        objects = []
+        for directory, directory_names, file_names in os.walk(walk_root):
+            relative_directory = pathlib.Path(directory).relative_to(self.root).as_posix()
+            relative_directory = "" if relative_directory == "." else f"{relative_directory}/"
+            # only descend into directories that can hold names matching the prefix
+            directory_names[:] = sorted(
+                d for d in directory_names
+                if not d.startswith(".") and _could_match(f"{relative_directory}{d}/", prefix)
+            )
+            for file_name in sorted(file_names):
+                if file_name.startswith("."):
+                    continue
+                name = pathlib.Path(directory, file_name).relative_to(self.root).as_posix()
+                if name.startswith(prefix):
+                    stat_object = self.stat(name)
+                    if stat_object:
+                        objects.append(stat_object)
+        return objects
+
+    def list_prefixes(self, prefix: str) -> List[str]:
+        prefix_directory, _, name_prefix = prefix.rpartition("/")
+        directory = self.path(prefix_directory) if prefix_directory else self.root
+        try:
+            children = sorted(directory.iterdir())
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        return [
+            f"{prefix_directory}/{child.name}/" if prefix_directory else f"{child.name}/"
+            for child in children
+            if child.is_dir() and not child.name.startswith(".") and child.name.startswith(name_prefix)
+        ]
+
+    def stat(self, name: str) -> Optional[StorageObject]:
+        path = self.path(name)
+        try:
+            stat = path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not path.is_file():
+            return None
+        return StorageObject(
+            name=name,
+            size=stat.st_size,
+            generation=stat.st_mtime_ns,
+            updated=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+            metadata=self._read_metadata(path),
+        )
+
+    def read_range(self, name: str, start: int, end: int, generation: int = None) -> bytes:
+        try:
+            with open(self.path(name), "rb") as f:
+                if generation is not None and os.fstat(f.fileno()).st_mtime_ns != generation:
+                    raise StorageBackendException(
+                        name=name, message=f"{name} is no longer at generation {generation}"
+                    )
+                return os.pread(f.fileno(), end - start + 1, start)
+        except FileNotFoundError:
+            raise StorageBackendException(name=name, message=f"{name} does not exist")
+
+    def copy(self, source_name: str, destination_name: str) -> StorageObject:
+        source_path = self.path(source_name)
+        with open(source_path, "rb") as f:
+            return self.write(destination_name, f, metadata=self._read_metadata(source_path))
+
+    def delete(self, names: Iterable[str]):
+        for name in names:
+            path = self.path(name)
+            path.unlink(missing_ok=True)
+            _metadata_path(path).unlink(missing_ok=True)
+            # there are no directories in an object store, drop the ones left empty
+            for parent in path.parents:
+                if parent == self.root or self.root not in parent.parents:
+                    break
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+
+    def write(self, name: str, fileobj: BinaryIO, metadata: Dict[str, str] = None) -> StorageObject:
+        path = self.path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.{uuid().hex}")
+        try:
+            with open(temp_path, "wb") as f:
+                shutil.copyfileobj(fileobj, f, DEFAULT_RANGE_READ_SIZE)
+            if metadata:
+                _metadata_path(path).write_text(json.dumps(metadata))
+            else:
+                _metadata_path(path).unlink(missing_ok=True)
+            os.replace(temp_path, path)
+        finally:
+            temp_path.unlink(missing_ok=True)
+        return self.stat(name)
+
+    def _read_metadata(self, path: pathlib.Path) -> Optional[Dict[str, str]]:
+        try:
+            return json.loads(_metadata_path(path).read_text())
+        except FileNotFoundError:
+            return None
+
+
+def _could_match(directory_name: str, prefix: str) -> bool:
+    return directory_name.startswith(prefix) or prefix.startswith(directory_name)
+
+
+def _metadata_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(f".{path.name}{FILE_METADATA_SUFFIX}")
+
+
+class BackendBucket:
+    """Exposes a StorageBackend as the subset of storage.Bucket that gcs.py uses"""
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+        self.name = backend.url
+
+    def get_blob(self, blob_name: str) -> Optional["BackendBlob"]:
+        stat_object = self.backend.stat(blob_name)
+        return BackendBlob.from_object(self, stat_object) if stat_object else None
+
+    def blob(self, blob_name: str) -> "BackendBlob":
+        return BackendBlob(bucket=self, name=blob_name)
+
+    def list_blobs(self, prefix: str = None, **kwargs) -> List["BackendBlob"]:
+        return [BackendBlob.from_object(self, o) for o in self.backend.list(prefix or "")]
+
+    def copy_blob(self, blob: "BackendBlob", destination_bucket: "BackendBucket", new_name: str):
+        assert destination_bucket is self, "copies across backends aren't supported"
+        return BackendBlob.from_object(self, self.backend.copy(blob.name, new_name))
+
+    def delete_blobs(self, blobs: Iterable["BackendBlob"], **kwargs):
+        self.backend.delete([blob.name for blob in blobs])
+
+
+@dataclass()
+class BackendBlob:
+    """Exposes an object of a StorageBackend as the subset of storage.Blob that gcs.py uses"""
+
+    bucket: BackendBucket
+    name: str
+    size: int = None
+    generation: int = None
+    crc32c: str = None
+    updated: datetime = None
+    metadata: Dict[str, str] = field(default=None)
+
+    @classmethod
+    def from_object(cls, bucket: BackendBucket, stat_object: StorageObject) -> "BackendBlob":
+        blob = cls(bucket=bucket, name=stat_object.name)
+        blob._update(stat_object)
+        return blob
+
+    def _update(self, stat_object: StorageObject):
+        self.size = stat_object.size
+        self.generation = stat_object.generation
+        self.crc32c = stat_object.crc32c
+        self.updated = stat_object.updated
+        self.metadata = stat_object.metadata
+
+    def _load(self):
+        if self.size is None:
+            stat_object = self.bucket.backend.stat(self.name)
+            if stat_object is None:
+                raise StorageBackendException(name=self.name, message=f"{self.name} does not exist")
+            self._update(stat_object)
+
+    def download_as_bytes(
+        self, client=None, start: int = None, end: int = None, if_generation_match: int = None, **kwargs
+    ) -> bytes:
+        return self._download(start, end, if_generation_match)
+
+    def download_as_string(
+        self, client=None, start: int = None, end: int = None, if_generation_match: int = None, **kwargs
+    ) -> bytes:
+        """storage.Blob's name for download_as_bytes before google-cloud-storage 1.32"""
+        return self._download(start, end, if_generation_match)
+
+    def _download(self, start: int = None, end: int = None, if_generation_match: int = None) -> bytes:
+        self._load()
+        if self.size == 0:
+            return b""
+        end = self.size - 1 if end is None else end
+        return self.bucket.backend.read_range(
+            self.name, start or 0, end, generation=if_generation_match
+        )
+
+    def download_to_filename(self, filename: str, client=None, if_generation_match: int = None, **kwargs):
+        with self.open("rb", if_generation_match=if_generation_match) as reader, open(filename, "wb") as f:
+            shutil.copyfileobj(reader, f, DEFAULT_RANGE_READ_SIZE)
+
+    def open(self, mode: str = "rb", chunk_size: int = None, if_generation_match: int = None, **kwargs):
+        assert mode == "rb", "backend blobs can only be opened for binary reads"
+        self._load()
+        return _RangeReader(
+            self.bucket.backend,
+            self.name,
+            self.size,
+            generation=self.generation if if_generation_match is None else if_generation_match,
+            read_size=chunk_size or DEFAULT_RANGE_READ_SIZE,
+        )
+
+    def upload_from_string(self, data, content_type: str = None, **kwargs):
+        data = data.encode("utf-8") if isinstance(data, str) else data
+        self._update(self.bucket.backend.write(self.name, io.BytesIO(data), metadata=self.metadata))
+
+    def upload_from_filename(self, filename: str, content_type: str = None, **kwargs):
+        with open(filename, "rb") as f:
+            self._update(self.bucket.backend.write(self.name, f, metadata=self.metadata))
+
+
+class _RangeReader(io.RawIOBase):
+    """Sequential reader over an object, fetched read_size bytes at a time,
+    every read pinned to the same generation.
+    """
+
+    def __init__(self, backend: StorageBackend, name: str, size: int, generation: int, read_size: int):
+        self.backend = backend
+        self.name = name
+        self.size = size
+        self.generation = generation
+        self.read_size = read_size
+        self.position = 0
+        self.buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self.position + len(self.buffer)
+        while len(self.buffer) < size and self.position < self.size:
+            end = min(self.position + self.read_size, self.size) - 1
+            self.buffer += self.backend.read_range(
+                self.name, self.position, end, generation=self.generation
+            )
+            self.position = end + 1
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+@dataclass()
+class MirrorStats:
+    objects_copied: int = 0
+    bytes_copied: int = 0
+    objects_skipped: int = 0
+
+
+def mirror(
+    source: StorageBackend,
+    source_prefix: str,
+    destination: StorageBackend,
+    destination_prefix: str,
+    read_size: int = DEFAULT_RANGE_READ_SIZE,
+) -> MirrorStats:
+    """Copies every object under source_prefix to the same relative name under
+    destination_prefix, skipping objects the destination already holds at the
+    same source generation.
+
+    :param source: the backend to copy from
+    :param source_prefix: the directory to copy, e.g. "environment"
+    :param destination: the backend to copy to
+    :param destination_prefix: where to copy it to in the destination
+    :param read_size: size in bytes of each ranged read from the source
+    :return: MirrorStats
+    """
+    source_prefix = source_prefix.rstrip("/") + "/"
+    destination_prefix = destination_prefix.rstrip("/") + "/"
+    mirrored = {
+        stat_object.name: (stat_object.metadata or {}).get("source_generation")
+        for stat_object in destination.list(destination_prefix)
+    }
+    stats = MirrorStats()
+    for source_object in source.list(source_prefix):
+        destination_name = destination_prefix + source_object.name[len(source_prefix):]
+        if mirrored.get(destination_name) == str(source_object.generation):
+            stats.objects_skipped += 1
+            continue
+
+        with tempfile.TemporaryFile() as f:
+            for start in range(0, source_object.size, read_size):
+                end = min(start + read_size, source_object.size) - 1
+                f.write(source.read_range(
+                    source_object.name, start, end, generation=source_object.generation
+                ))
+            f.seek(0)
+            destination.write(
+                destination_name,
+                f,
+                metadata={
+                    **(source_object.metadata or {}),
+                    "source_generation": str(source_object.generation),
+                },
+            )
+        log.info(f"mirrored {source.url}/{source_object.name} to {destination.url}/{destination_name}")
+        stats.objects_copied += 1
+        stats.bytes_copied += source_object.size
+    return stats
@@ -5,6 +5,9 @@ from enum import Enum
 import logging as log
 
 import pathlib
+import time
+import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from enum import Enum
 from typing import Tuple, Set, Dict, List
@@ -12,30 +15,17 @@ from zlib import crc32
 
 from dataclasses_json import dataclass_json
 
-import tensorflow as tf
-from dataclasses_json import dataclass_json
-
-tf.config.threading.set_inter_op_parallelism_threads(0)
-tf.config.threading.set_intra_op_parallelism_threads(0)
-
-from tensorflow_serving.apis import model_pb2
-from tensorflow_serving.apis import model_service_pb2_grpc
-from tensorflow_serving.apis import get_model_status_pb2
-from tensorflow_serving.config.model_server_config_pb2 import (
-    ModelServerConfig,
-    ModelConfig,
+from .tfserving_protos import (
+    model_pb2,
+    model_management_pb2,
+    model_service_pb2_grpc,
+    get_model_status_pb2,
+    model_server_config_pb2,
+    file_system_storage_path_source_pb2 as filesystem_pb2,
 )
 
-# this try/catch is really unfortunately but sometimes the file_system_storage_path_source_pb2 is in a different
-# location than you expect. So we try both locations and move on with our life.
-try:
-    from tensorflow_serving.sources.storage_path import (
-        file_system_storage_path_source_pb2 as filesystem_pb2,
-    )
-except ImportError as err:
-    from tensorflow_serving.config import (
-        file_system_storage_path_source_pb2 as filesystem_pb2,
-    )
+ModelServerConfig = model_server_config_pb2.ModelServerConfig
+ModelConfig = model_server_config_pb2.ModelConfig
 
 import google.protobuf.text_format as pbtxt
 import grpc
@@ -101,6 +91,91 @@ class TensorflowServingConfig:
     def _remove(self, model_config: ModelConfig):
         self.proto.model_config_list.config.remove(model_config)
 
+    def batch(self) -> "TensorflowServingConfigBatch":
+        """Starts a batch of model adds and removes against this config. Nothing is
+        written until commit is called on the returned batch.
+        """
+        return TensorflowServingConfigBatch(config=self)
+
+
+@dataclass()
+class TensorflowServingConfigBatch:
+    """Stages many add_model/remove_model calls and commits them as a single
+    config write, instead of one save_config per model.
+
+    batch = config.batch()
+    for record in records:
+        batch.add_model(record, local_path=record.local_model_path)
+    config = batch.commit()
+
+    The commit checks the file crc the same way save_config does and replaces
+    the config file atomically, so tensorflow serving never polls a partially
+    written or half applied config.
+    """
+
+    config: TensorflowServingConfig
+    staged_model_configs: Dict[str, ModelConfig] = None
+    changes: int = 0
+
+    def __post_init__(self):
+        self.staged_model_configs = {}
+        for model_config in self.config._get_model_configs():
+            staged_model_config = ModelConfig()
+            staged_model_config.CopyFrom(model_config)
+            self.staged_model_configs[model_config.name] = staged_model_config
+
+    def add_model(self, record: Record, local_path: str):
+        assert (
+            record.key.framework.lower() == "tensorflow"
+        ), "cannot add model to tfserving if framework is not tensorflow!"
+        model_config = _build_model_config(record, local_path)
+        # match add_model, a replaced model moves to the end of the config
+        self.staged_model_configs.pop(record.key.name, None)
+        self.staged_model_configs[record.key.name] = model_config
+        self.changes += 1
+        log.info(f"staged model configuration: record={record} config={model_config}")
+
+    def remove_model(self, record_key: RecordKey):
+        if record_key.name not in self.staged_model_configs:
+            log.error(f"Cannot remove a model if it doesn't exit! name={record_key.name}")
+            raise ValueError(
+                f"""
+            Attempting to remove an unknown model! Failed to find the name in
+            the staged models!
+
+            name:
+            {record_key.name}
+            """
+            )
+        del self.staged_model_configs[record_key.name]
+        self.changes += 1
+        log.info(f"staged model removal: name={record_key.name}")
+
+    def commit(self) -> TensorflowServingConfig:
+        if self.changes == 0:
+            log.info("no staged changes to the tensorflow serving config")
+            return self.config
+
+        proto = ModelServerConfig()
+        proto.CopyFrom(self.config.proto)
+        del proto.model_config_list.config[:]
+        proto.model_config_list.config.extend(self.staged_model_configs.values())
+
+        config_pbtxt = pbtxt.MessageToString(proto)
+        if len(config_pbtxt) == 0:
+            config_pbtxt = "model_config_list {\n\n}\n"
+        config_path = self.config.original_path
+        log.info(
+            f"Committing {self.changes} staged changes to config path {config_path}"
+        )
+        _replace_config_file(self.config, config_pbtxt)
+
+        return TensorflowServingConfig(
+            original_path=config_path,
+            original_proto_crc_hash=crc32(config_pbtxt.encode("utf-8")),
+            proto=proto,
+        )
+
 
 def load_config(tensorflow_serving_config_file: str) -> TensorflowServingConfig:
     config_path = pathlib.Path(tensorflow_serving_config_file)
@@ -128,29 +203,7 @@ def save_config(config: TensorflowServingConfig) -> TensorflowServingConfig:
 
     with open(config_path, "r+") as f:
         data = f.read()
-        current_proto_crc_hash = crc32(data.encode("utf-8"))
-
-        if config.original_proto_crc_hash != current_proto_crc_hash:
-            log.error(
-                f"attempted to save model config! But it changed underneath us unexpectedly!"
-            )
-            raise ValueError(
-                f"""
-                Attempted to save model config! But it changed underneath us unexpectedly!
-
-                original_crc:
-                {config.original_proto_crc_hash}
-                
-                current_crc:
-                {current_proto_crc_hash}
-                
-                data from file: 
-                {data}
-
-                current_config:
-                {config}
-            """
-            )
+        _check_config_unchanged(config, data)
         f.seek(0)
         f.truncate()
         f.write(config_pbtxt)
@@ -158,6 +211,49 @@ def save_config(config: TensorflowServingConfig) -> TensorflowServingConfig:
     return load_config(str(config_path))
 
 
+def _check_config_unchanged(config: TensorflowServingConfig, data: str):
+    current_proto_crc_hash = crc32(data.encode("utf-8"))
+
+    if config.original_proto_crc_hash != current_proto_crc_hash:
+        log.error(
+            f"attempted to save model config! But it changed underneath us unexpectedly!"
+        )
+        raise ValueError(
+            f"""
+            Attempted to save model config! But it changed underneath us unexpectedly!
+
+            original_crc:
+            {config.original_proto_crc_hash}
+            
+            current_crc:
+            {current_proto_crc_hash}
+            
+            data from file: 
+            {data}
+
+            current_config:
+            {config}
+        """
+        )
+
+
+def _replace_config_file(config: TensorflowServingConfig, config_pbtxt: str):
+    config_path = config.original_path
+    with open(config_path, "r") as f:
+        _check_config_unchanged(config, f.read())
+
+    temp_path = config_path.with_name(f".{config_path.name}.{os.getpid()}")
+    try:
+        with open(temp_path, "w") as f:
+            f.write(config_pbtxt)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, config_path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
 def add_model(
     tensorflow_serving_config: TensorflowServingConfig, record: Record, local_path: str
 ) -> TensorflowServingConfig:
@@ -167,6 +263,15 @@ def add_model(
     if record.key.name in tensorflow_serving_config.known_model_names:
         tensorflow_serving_config._remove_name(record.key.name)
 
+    model_config = _build_model_config(record, local_path)
+    tensorflow_serving_config._add(model_config)
+    log.warning(
+        f"Adding a new model configuration: record={record} config={model_config}"
+    )
+    return save_config(tensorflow_serving_config)
+
+
+def _build_model_config(record: Record, local_path: str) -> ModelConfig:
     if not record.is_priority:
         model_config = ModelConfig(
             name=record.key.name,
@@ -189,11 +294,7 @@ def add_model(
                 )
             ),
         )
-    tensorflow_serving_config._add(model_config)
-    log.warning(
-        f"Adding a new model configuration: record={record} config={model_config}"
-    )
-    return save_config(tensorflow_serving_config)
+    return model_config
 
 
 def remove_model(
@@ -242,24 +343,60 @@ class TensorflowServingModelRecord(Record):
 
 TfServingRecordDict = Dict[RecordKey, Tuple[TensorflowServingModelRecord, ...]]
 
+DEFAULT_STATUS_MAX_IN_FLIGHT = 32
+DEFAULT_RELOAD_CONFIG_TIMEOUT = 10
+DEFAULT_LOAD_POLL_INTERVAL = 1
+
+
+class TensorflowServingReloadException(Exception):
+    def __init__(self, error_code, message):
+        self.error_code = error_code
+        self.message = message
+
 
 def get_known_tensorflow_serving_models(
-    grpc_target: str, tensorflow_serving_config: TensorflowServingConfig
+    grpc_target: str,
+    tensorflow_serving_config: TensorflowServingConfig,
+    max_in_flight: int = DEFAULT_STATUS_MAX_IN_FLIGHT,
 ) -> TfServingRecordDict:
+    """Queries tensorflow serving for the status of every model in the config.
+
+    The status requests are issued concurrently over the shared grpc channel
+    with at most max_in_flight outstanding at once.
+
+    :param grpc_target: str of the tensorflow serving grpc host:port
+    :param tensorflow_serving_config: the config whose models are queried
+    :param max_in_flight: max number of concurrent status requests
+    :return: dict of record key to every known version of that model
+    """
+    assert max_in_flight > 0, "max_in_flight must be positive!"
     known_record_keys = [
         RecordKey(framework=model_config.model_platform.lower(), name=model_config.name)
         for model_config in tensorflow_serving_config._get_model_configs()
         if model_config
     ]
+    if len(known_record_keys) <= 1 or max_in_flight == 1:
+        return {
+            record_key: _record_key_to_tensorflow_records(grpc_target, record_key)
+            for record_key in known_record_keys
+        }
 
-    return {
-        record_key: _record_key_to_tensorflow_records(grpc_target, record_key)
-        for record_key in known_record_keys
-    }
+    TensorflowServingGrpcConnection.setup_connection(grpc_target)
+    with ThreadPoolExecutor(
+        max_workers=min(max_in_flight, len(known_record_keys)),
+        thread_name_prefix="tfserving_status",
+    ) as executor:
+        all_records = executor.map(
+            lambda record_key: _record_key_to_tensorflow_records(grpc_target, record_key),
+            known_record_keys,
+        )
+        return dict(zip(known_record_keys, all_records))
 
 
 def get_current_tensorflow_serving_models(
-    grpc_target: str, tensorflow_serving_config: TensorflowServingConfig
+    grpc_target: str,
+    tensorflow_serving_config: TensorflowServingConfig,
+    max_in_flight: int = DEFAULT_STATUS_MAX_IN_FLIGHT,
 ) -> Dict[RecordKey, TensorflowServingModelRecord]:
     def get_current_highest_available_model(
         models: Tuple[TensorflowServingModelRecord],
@@ -276,7 +413,9 @@ def get_current_tensorflow_serving_models(
         return current_model
 
     all_known_tfserving_records = get_known_tensorflow_serving_models(
-        grpc_target=grpc_target, tensorflow_serving_config=tensorflow_serving_config
+        grpc_target=grpc_target,
+        tensorflow_serving_config=tensorflow_serving_config,
+        max_in_flight=max_in_flight,
     )
 
     results = {
@@ -286,6 +425,69 @@ def get_current_tensorflow_serving_models(
     return results
 
 
+def reload_config(
+    grpc_target: str,
+    tensorflow_serving_config: TensorflowServingConfig,
+    timeout: float = DEFAULT_RELOAD_CONFIG_TIMEOUT,
+):
+    """Pushes the config to tensorflow serving through HandleReloadConfigRequest
+    so the change is applied right away instead of on the next config file poll.
+
+    The config should already be saved, the file stays the durable copy that
+    tensorflow serving falls back to on restart and on its own polling.
+
+    :param grpc_target: str of the tensorflow serving grpc host:port
+    :param tensorflow_serving_config: the saved config to apply
+    :param timeout: seconds to wait for tensorflow serving to accept the config
+    :raises TensorflowServingReloadException: if tensorflow serving rejects the config
+    """
+    TensorflowServingGrpcConnection.setup_connection(grpc_target)
+    TensorflowServingGrpcConnection.reload_config(
+        tensorflow_serving_config.proto, timeout=timeout
+    )
+
+
+def wait_for_versions_available(
+    grpc_target: str,
+    records: List[Record],
+    timeout: float,
+    poll_interval: float = DEFAULT_LOAD_POLL_INTERVAL,
+    start_time: float = None,
+) -> Dict[Tuple[RecordKey, int], float]:
+    """Polls tensorflow serving until every given version is AVAILABLE or the
+    timeout runs out, to time how long versions take to load after a config
+    change. Call it right after the config is saved or pushed.
+
+    :param grpc_target: str of the tensorflow serving grpc host:port
+    :param records: the versions to wait for
+    :param timeout: seconds to wait for all of them
+    :param poll_interval: seconds between status requests
+    :param start_time: when the config changed, defaults to now
+    :return: dict of the (record key, version) of every version that became
+        AVAILABLE to the seconds it took, versions missing from it timed out
+    """
+    start_time = start_time or time.time()
+    waiting = {(record.key, record.version) for record in records}
+    load_times = {}
+    while waiting:
+        for record_key in {record_key for record_key, _ in waiting}:
+            for tfserving_record in _record_key_to_tensorflow_records(grpc_target, record_key):
+                load_key = (record_key, tfserving_record.version)
+                if (
+                    load_key in waiting
+                    and tfserving_record.status == TensorflowServingModelStatus.AVAILABLE
+                ):
+                    load_times[load_key] = time.time() - start_time
+                    waiting.remove(load_key)
+        if not waiting or time.time() - start_time >= timeout:
+            break
+        time.sleep(poll_interval)
+
+    if waiting:
+        log.warning(f"versions not available after timeout={timeout} versions={sorted(waiting, key=str)}")
+    return load_times
+
+
 def _record_key_to_tensorflow_records(
     grpc_target: str, record_key: RecordKey
 ) -> Tuple[TensorflowServingModelRecord, ...]:
@@ -347,3 +549,20 @@ class TensorflowServingGrpcConnection:
             log.exception(err)
             raise err
         return result
+
+    @classmethod
+    def reload_config(cls, config_proto: ModelServerConfig, timeout: float):
+        cls.setup_connection(cls.target)
+        request = model_management_pb2.ReloadConfigRequest(config=config_proto)
+        response = cls.stub.HandleReloadConfigRequest(request, timeout=timeout)
+        if response.status.error_code != 0:
+            log.error(
+                f"tensorflow serving rejected config reload "
+                f"error_code={response.status.error_code} "
+                f"message={response.status.error_message}"
+            )
+            raise TensorflowServingReloadException(
+                error_code=response.status.error_code,
+                message=response.status.error_message,
+            )
+        log.info("tensorflow serving accepted config reload")
@@ -0,0 +1,155 @@
+"""
+The tensorflow serving protobufs and grpc stub this library needs, importable
+without tensorflow.
+
+The tensorflow_serving package's generated modules import
+tensorflow.core.protobuf.error_codes_pb2, and with it all of tensorflow, which
+costs seconds of startup and hundreds of MB of memory for a few message types.
+This module builds the same messages from the serialized file descriptors in
+_tfserving_descriptors, in a descriptor pool of its own so it never clashes with
+tensorflow's when both are imported, and exposes them under the names of the
+generated modules:
+
+    from model_manager_lib.tfserving_protos import get_model_status_pb2
+    request = get_model_status_pb2.GetModelStatusRequest()
+
+The descriptors are generated from tensorflow-serving-api==2.5.1 and the
+tensorflow==2.6.0 error_codes.proto it imports, the versions the services pin
+in their requirements.txt, so messages match the tensorflow serving the
+cluster runs. They are wire and text format compatible with its own messages,
+but are different classes, so they can't be mixed with its generated messages
+in one proto. Regenerate the descriptors whenever those pins change, with
+python -m model_manager_lib.tfserving_protos run against the pinned versions,
+which does import tensorflow.
+"""
+from types import ModuleType
+import base64
+import pathlib
+
+from google.protobuf import any_pb2, wrappers_pb2
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+from google.protobuf.internal import enum_type_wrapper
+import grpc
+
+from model_manager_lib import _tfserving_descriptors
+
+_POOL = descriptor_pool.DescriptorPool()
+_FACTORY = (
+    None if hasattr(message_factory, "GetMessageClass") else message_factory.MessageFactory(_POOL)
+)
+
+
+def _message_class(descriptor):
+    if _FACTORY is None:
+        message_class = message_factory.GetMessageClass(descriptor)
+    else:
+        message_class = _FACTORY.GetPrototype(descriptor)
+    for nested_descriptor in descriptor.nested_types:
+        if not hasattr(message_class, nested_descriptor.name):
+            setattr(message_class, nested_descriptor.name, _message_class(nested_descriptor))
+    return message_class
+
+
+def _build_module(file_name: str) -> ModuleType:
+    file_descriptor = _POOL.FindFileByName(file_name)
+    module_name = file_name.replace("/", ".").replace(".proto", "_pb2")
+    module = ModuleType(module_name)
+    module.DESCRIPTOR = file_descriptor
+    for name, message_descriptor in file_descriptor.message_types_by_name.items():
+        setattr(module, name, _message_class(message_descriptor))
+    for name, enum_descriptor in file_descriptor.enum_types_by_name.items():
+        setattr(module, name, enum_type_wrapper.EnumTypeWrapper(enum_descriptor))
+        for value in enum_descriptor.values:
+            setattr(module, value.name, value.number)
+    return module
+
+
+for _google_module in (any_pb2, wrappers_pb2):
+    _google_file = descriptor_pb2.FileDescriptorProto()
+    _google_module.DESCRIPTOR.CopyToProto(_google_file)
+    _POOL.Add(_google_file)
+
+_descriptor_set = descriptor_pb2.FileDescriptorSet.FromString(
+    base64.b64decode(_tfserving_descriptors.FILE_DESCRIPTOR_SET)
+)
+for _file in _descriptor_set.file:
+    _POOL.Add(_file)
+
+model_pb2 = _build_module("tensorflow_serving/apis/model.proto")
+get_model_status_pb2 = _build_module("tensorflow_serving/apis/get_model_status.proto")
+model_management_pb2 = _build_module("tensorflow_serving/apis/model_management.proto")
+model_server_config_pb2 = _build_module("tensorflow_serving/config/model_server_config.proto")
+file_system_storage_path_source_pb2 = _build_module(
+    "tensorflow_serving/config/file_system_storage_path_source.proto"
+)
+
+
+class ModelServiceStub:
+    """The tensorflow.serving.ModelService client, the same as
+    tensorflow_serving.apis.model_service_pb2_grpc.ModelServiceStub
+    """
+
+    def __init__(self, channel: grpc.Channel):
+        self.GetModelStatus = channel.unary_unary(
+            "/tensorflow.serving.ModelService/GetModelStatus",
+            request_serializer=get_model_status_pb2.GetModelStatusRequest.SerializeToString,
+            response_deserializer=get_model_status_pb2.GetModelStatusResponse.FromString,
+        )
+        self.HandleReloadConfigRequest = channel.unary_unary(
+            "/tensorflow.serving.ModelService/HandleReloadConfigRequest",
+            request_serializer=model_management_pb2.ReloadConfigRequest.SerializeToString,
+            response_deserializer=model_management_pb2.ReloadConfigResponse.FromString,
+        )
+
+
+model_service_pb2_grpc = ModuleType("tensorflow_serving.apis.model_service_pb2_grpc")
+model_service_pb2_grpc.ModelServiceStub = ModelServiceStub
+
+# _write_descriptors collects these files and everything they import
+DESCRIPTOR_ROOTS = (
+    "tensorflow_serving/apis/model_service.proto",
+    "tensorflow_serving/config/model_server_config.proto",
+)
+
+
+def _write_descriptors(path: pathlib.Path):
+    """Regenerates _tfserving_descriptors from the installed tensorflow_serving,
+    which has to be the pinned tensorflow-serving-api
+    """
+    from tensorflow_serving.apis import model_service_pb2
+    from tensorflow_serving.config import model_server_config_pb2 as installed_config_pb2
+
+    installed = {
+        "tensorflow_serving/apis/model_service.proto": model_service_pb2.DESCRIPTOR,
+        "tensorflow_serving/config/model_server_config.proto": installed_config_pb2.DESCRIPTOR,
+    }
+    descriptor_set = descriptor_pb2.FileDescriptorSet()
+    seen = set()
+
+    def add(file_descriptor):
+        if file_descriptor.name in seen:
+            return
+        seen.add(file_descriptor.name)
+        for dependency in file_descriptor.dependencies:
+            add(dependency)
+        if not file_descriptor.name.startswith("google/protobuf/"):
+            file_descriptor.CopyToProto(descriptor_set.file.add())
+
+    for root in DESCRIPTOR_ROOTS:
+        add(installed[root])
+
+    encoded = base64.b64encode(descriptor_set.SerializeToString()).decode("ascii")
+    lines = "\n".join(encoded[start: start + 76] for start in range(0, len(encoded), 76))
+    path.write_text(
+        '"""\n'
+        "Generated by python -m model_manager_lib.tfserving_protos, do not edit.\n\n"
+        "The base64 serialized FileDescriptorSet of the tensorflow serving protobufs\n"
+        "tfserving_protos builds, with their dependencies, dependencies first:\n\n"
+        + "".join(f"    {file.name}\n" for file in descriptor_set.file)
+        + '"""\n'
+        f'FILE_DESCRIPTOR_SET = """\n{lines}\n"""\n'
+    )
+
+
+if __name__ == "__main__":
+    _write_descriptors(pathlib.Path(__file__).with_name("_tfserving_descriptors.py"))
@@ -0,0 +1,207 @@
+from unittest import mock
+import pathlib
+import json
+import os
+
+import pytest
+
+from model_manager_lib import RecordKey
+from model_manager_lib import delta, gcs, local_filesystem
+
+
+class FakeStoredBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def generation(self):
+        return self.bucket.generations[self.name]
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.store(self.name, data.encode("utf-8") if isinstance(data, str) else data)
+
+    def upload_from_filename(self, filename):
+        self.bucket.store(self.name, pathlib.Path(filename).read_bytes())
+
+    def download_as_bytes(self, client=None):
+        self.bucket.downloaded_bytes += len(self.bucket.objects[self.name])
+        return self.bucket.objects[self.name]
+
+    def download_to_filename(self, filename, client=None):
+        pathlib.Path(filename).write_bytes(self.download_as_bytes())
+
+
+class FakeBucket:
+    name = "bucket"
+
+    def __init__(self):
+        self.objects = {}
+        self.generations = {}
+        self.downloaded_bytes = 0
+
+    def store(self, name, data):
+        self.objects[name] = data
+        self.generations[name] = self.generations.get(name, 0) + 1
+
+    def blob(self, name):
+        return FakeStoredBlob(self, name)
+
+    def get_blob(self, name):
+        return FakeStoredBlob(self, name) if name in self.objects else None
+
+    def list_blobs(self, prefix):
+        return [FakeStoredBlob(self, name) for name in self.objects if name.startswith(prefix)]
+
+
+@pytest.fixture()
+def fake_bucket():
+    bucket = FakeBucket()
+    with mock.patch("model_manager_lib.gcs.GcsApi.client") as gcs_client:
+        gcs_client.get_bucket.return_value = bucket
+        gcs_client.list_blobs.side_effect = lambda b, prefix: b.list_blobs(prefix)
+        yield bucket
+
+
+def make_model(path: pathlib.Path, files: dict) -> pathlib.Path:
+    for file_path, data in files.items():
+        path.joinpath(file_path).parent.mkdir(parents=True, exist_ok=True)
+        path.joinpath(file_path).write_bytes(data)
+    return path
+
+
+def make_remote_record(version: int) -> gcs.RemoteRecord:
+    return gcs.RemoteRecord(
+        key=RecordKey(framework="tensorflow", name="model_a"),
+        version=version,
+        remote_path=f"gs://bucket/env/tensorflow/model_a/{version}/model.tar.gz",
+    )
+
+
+def test_delta_download_only_fetches_changed_files(tmp_path, fake_bucket):
+    vocabulary, embeddings = os.urandom(4096), os.urandom(8192)
+    base = make_model(
+        tmp_path.joinpath("local", "tensorflow", "model_a", "1"),
+        {
+            "saved_model.pb": os.urandom(128),
+            "variables/variables.data-00000-of-00001": os.urandom(2048),
+            "assets/vocab.txt": vocabulary,
+            "assets/embeddings.bin": embeddings,
+        },
+    )
+    new_files = {
+        "saved_model.pb": os.urandom(128),
+        "variables/variables.data-00000-of-00001": os.urandom(2048),
+        "assets/vocab.txt": vocabulary,
+        "assets/embeddings.bin": embeddings,
+    }
+    new_model = make_model(tmp_path.joinpath("published"), new_files)
+    remote_record = make_remote_record(version=2)
+    fake_bucket.store("env/tensorflow/model_a/2/model.tar.gz", b"tarball")
+    delta.publish_manifest(remote_record, new_model, tarball_generation=1)
+
+    destination = tmp_path.joinpath("local", "tensorflow", "model_a", "2")
+    stats = delta.download_remote_record_delta(
+        remote_record,
+        base_model_directory=base,
+        local_directory=destination,
+        staging_directory=tmp_path.joinpath("local", ".staging"),
+    )
+
+    assert stats.files_reused == 2
+    assert stats.bytes_reused == len(vocabulary) + len(embeddings)
+    assert stats.files_fetched == 2
+    assert stats.bytes_fetched == 128 + 2048
+    for file_path, data in new_files.items():
+        assert destination.joinpath(file_path).read_bytes() == data
+    assert list(tmp_path.joinpath("local", ".staging").iterdir()) == []
+
+
+def test_delta_download_links_unchanged_files_with_content_store(tmp_path, fake_bucket):
+    embeddings = os.urandom(128 * 1024)
+    new_files = {"saved_model.pb": os.urandom(128 * 1024), "assets/embeddings.bin": embeddings}
+    local = tmp_path.joinpath("local")
+    content_store = local.joinpath(local_filesystem.CONTENT_STORE_DIRECTORY_NAME)
+    base = make_model(
+        local.joinpath("tensorflow", "model_a", "1"),
+        {"saved_model.pb": os.urandom(128 * 1024), "assets/embeddings.bin": embeddings},
+    )
+    local_filesystem.deduplicate_model_directory(base, content_store)
+    new_model = make_model(tmp_path.joinpath("published"), new_files)
+    remote_record = make_remote_record(version=2)
+    fake_bucket.store("env/tensorflow/model_a/2/model.tar.gz", b"tarball")
+    delta.publish_manifest(remote_record, new_model, tarball_generation=1)
+
+    destination = local.joinpath("tensorflow", "model_a", "2")
+    stats = delta.download_remote_record_delta(
+        remote_record,
+        base_model_directory=base,
+        local_directory=destination,
+        staging_directory=local.joinpath(".staging"),
+        content_store_directory=content_store,
+    )
+
+    assert stats.files_reused == 1 and stats.files_fetched == 1
+    reused = destination.joinpath("assets", "embeddings.bin")
+    assert reused.read_bytes() == embeddings
+    assert reused.stat().st_ino == base.joinpath("assets", "embeddings.bin").stat().st_ino
+    # the fetched file is linked into the store for the next version to share
+    assert destination.joinpath("saved_model.pb").stat().st_nlink == 2
+
+
+def test_delta_download_ignores_manifest_of_replaced_tarball(tmp_path, fake_bucket):
+    new_model = make_model(tmp_path.joinpath("published"), {"saved_model.pb": b"pb"})
+    remote_record = make_remote_record(version=2)
+    fake_bucket.store("env/tensorflow/model_a/2/model.tar.gz", b"tarball")
+    delta.publish_manifest(remote_record, new_model, tarball_generation=1)
+    fake_bucket.store("env/tensorflow/model_a/2/model.tar.gz", b"reuploaded tarball")
+
+    assert delta.read_manifest(remote_record) is None
+
+
+def test_delta_download_fails_on_corrupt_file(tmp_path, fake_bucket):
+    base = make_model(tmp_path.joinpath("base"), {"saved_model.pb": b"old"})
+    new_model = make_model(tmp_path.joinpath("published"), {"saved_model.pb": b"new"})
+    remote_record = make_remote_record(version=2)
+    fake_bucket.store("env/tensorflow/model_a/2/model.tar.gz", b"tarball")
+    manifest = delta.publish_manifest(remote_record, new_model, tarball_generation=1)
+    fake_bucket.store(
+        f"env/tensorflow/model_a/_files/{manifest.files[0].sha256}", b"corrupt"
+    )
+
+    destination = tmp_path.joinpath("local", "2")
+    with pytest.raises(gcs.GcsDownloadException):
+        delta.download_remote_record_delta(
+            remote_record,
+            base_model_directory=base,
+            local_directory=destination,
+            staging_directory=tmp_path.joinpath(".staging"),
+        )
+    assert not destination.exists()
+
+
+@pytest.mark.parametrize("escaping_path", ["../escaped.pb", "/tmp/escaped.pb", "assets/../../escaped.pb"])
+def test_delta_download_rejects_manifest_paths_outside_the_model(
+    tmp_path, fake_bucket, escaping_path
+):
+    base = make_model(tmp_path.joinpath("base"), {"saved_model.pb": b"pb"})
+    new_model = make_model(tmp_path.joinpath("published"), {"saved_model.pb": b"pb"})
+    remote_record = make_remote_record(version=2)
+    fake_bucket.store("env/tensorflow/model_a/2/model.tar.gz", b"tarball")
+    manifest = delta.publish_manifest(remote_record, new_model, tarball_generation=1)
+    manifest.files[0].path = escaping_path
+    fake_bucket.store(
+        "env/tensorflow/model_a/2/manifest.json",
+        json.dumps(delta._manifest_to_dict(manifest)).encode("utf-8"),
+    )
+
+    destination = tmp_path.joinpath("local", "2")
+    with pytest.raises(gcs.GcsDownloadException):
+        delta.download_remote_record_delta(
+            remote_record,
+            base_model_directory=base,
+            local_directory=destination,
+            staging_directory=tmp_path.joinpath("local", ".staging"),
+        )
+    assert not destination.exists()
+    assert not tmp_path.joinpath("local", "escaped.pb").exists()
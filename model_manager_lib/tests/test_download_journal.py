@@ -0,0 +1,104 @@
+import time
+import os
+
+import pytest
+
+from model_manager_lib import download_journal, gcs
+from tests.test_gcs import FakeBlob
+
+REMOTE_PATH = "gs://bucket/env/framework/name/1/model.tar.gz"
+
+
+class FlakyBlob(FakeBlob):
+    """Fails every ranged read after the first fail_after reads."""
+
+    def __init__(self, data: bytes, fail_after: int):
+        super().__init__(data)
+        self.fail_after = fail_after
+
+    def download_as_bytes(self, client=None, start=None, end=None, **kwargs):
+        if len(self.requested_ranges) >= self.fail_after:
+            raise ConnectionError("connection reset by peer")
+        return super().download_as_bytes(client=client, start=start, end=end, **kwargs)
+
+
+def test_interrupted_download_resumes_from_journal(tmp_path):
+    data = os.urandom(1_000_003)
+    flaky_blob = FlakyBlob(data, fail_after=4)
+    journal = download_journal.open_journal(
+        tmp_path, REMOTE_PATH, generation=1, size=len(data), chunk_size=100_000
+    )
+    with pytest.raises(ConnectionError):
+        gcs.download_blob_in_chunks(
+            flaky_blob, journal.tarball_path, chunk_size=100_000, max_workers=1, journal=journal
+        )
+    journal.release()
+
+    # a restarted puller reopens the journal from disk
+    resumed_journal = download_journal.open_journal(
+        tmp_path, REMOTE_PATH, generation=1, size=len(data), chunk_size=100_000
+    )
+    assert resumed_journal.completed_chunks == {0, 100_000, 200_000, 300_000}
+    assert resumed_journal.bytes_completed == 400_000
+
+    blob = FakeBlob(data)
+    gcs.download_blob_in_chunks(
+        blob, resumed_journal.tarball_path, chunk_size=100_000, max_workers=4, journal=resumed_journal
+    )
+    assert resumed_journal.tarball_path.read_bytes() == data
+    assert len(blob.requested_ranges) == 7
+    assert min(blob.requested_ranges)[0] == 400_000
+
+
+def test_journal_restarts_when_generation_changes(tmp_path):
+    journal = download_journal.open_journal(
+        tmp_path, REMOTE_PATH, generation=1, size=10, chunk_size=5
+    )
+    journal.tarball_path.write_bytes(b"0" * 10)
+    journal.mark_completed(0)
+    journal.release()
+
+    new_journal = download_journal.open_journal(
+        tmp_path, REMOTE_PATH, generation=2, size=10, chunk_size=5
+    )
+    assert new_journal.completed_chunks == set()
+    assert not new_journal.tarball_path.exists()
+
+
+def test_journal_is_locked_while_open(tmp_path):
+    journal = download_journal.open_journal(
+        tmp_path, REMOTE_PATH, generation=1, size=10, chunk_size=5
+    )
+    with pytest.raises(download_journal.DownloadInProgressException):
+        download_journal.open_journal(tmp_path, REMOTE_PATH, generation=1, size=10, chunk_size=5)
+
+    journal.release()
+    download_journal.open_journal(tmp_path, REMOTE_PATH, generation=1, size=10, chunk_size=5)
+
+
+def test_sweep_keeps_only_fresh_journaled_downloads(tmp_path, monkeypatch):
+    temp_directory = tmp_path.joinpath("tmp_downloads")
+    staging_directory = tmp_path.joinpath(".staging")
+    an_hour_ago = time.time() - 3600
+    with monkeypatch.context() as m:
+        m.setattr(download_journal.time, "time", lambda: an_hour_ago)
+        download_journal.open_journal(
+            temp_directory, REMOTE_PATH.replace("/1/", "/2/"), generation=1, size=10, chunk_size=5
+        ).release()
+    fresh = download_journal.open_journal(
+        temp_directory, REMOTE_PATH, generation=1, size=10, chunk_size=5
+    )
+    temp_directory.joinpath("0123abcd", "tmpxyz").mkdir(parents=True)
+    staging_directory.joinpath("4567efgh", "untared_model").mkdir(parents=True)
+
+    removed = download_journal.sweep_stale_downloads(
+        temp_directory, staging_directory, max_age_seconds=1800
+    )
+
+    # the stale journal, its lock file and the unjournaled download
+    assert removed == 3 + 1
+    assert {p.name for p in temp_directory.iterdir()} == {
+        fresh.directory.name,
+        f"{fresh.directory.name}.lock",
+    }
+    assert list(staging_directory.iterdir()) == []
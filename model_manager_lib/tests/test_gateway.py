@@ -0,0 +1,189 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs, unquote
+from unittest import mock
+import contextlib
+import threading
+import tarfile
+import base64
+import json
+import time
+import io
+import os
+
+import google_crc32c
+import pytest
+
+from model_manager_lib import RecordKey
+from model_manager_lib import gateway, gcs
+
+
+def test_concurrent_misses_share_one_fill(tmp_path):
+    cache = gateway.GatewayObjectCache(tmp_path, max_bytes=1024)
+    fills = []
+
+    def fill(path):
+        fills.append(path)
+        time.sleep(0.2)
+        path.write_bytes(b"model")
+
+    def read():
+        with cache.open("key", 5, fill) as f:
+            return f.read()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: read(), range(8)))
+
+    assert results == [b"model"] * 8
+    assert len(fills) == 1
+    assert cache.stats.misses == 1
+    assert cache.stats.coalesced + cache.stats.hits == 7
+    assert cache.stats.coalesced > 0
+
+
+def test_failed_fill_is_raised_to_every_waiter(tmp_path):
+    cache = gateway.GatewayObjectCache(tmp_path, max_bytes=1024)
+    started = threading.Event()
+
+    def fill(path):
+        started.set()
+        time.sleep(0.1)
+        raise ConnectionError("upstream reset")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(cache.open, "key", 5, fill)
+        started.wait()
+        follower = executor.submit(cache.open, "key", 5, fill)
+        with pytest.raises(ConnectionError):
+            leader.result()
+        with pytest.raises(ConnectionError):
+            follower.result()
+    assert [p.name for p in tmp_path.iterdir()] == []
+
+
+def test_least_recently_used_objects_are_evicted(tmp_path):
+    cache = gateway.GatewayObjectCache(tmp_path, max_bytes=30)
+
+    def filler(data):
+        return lambda path: path.write_bytes(data)
+
+    for key in ("a", "b", "c"):
+        cache.open(key, 10, filler(key.encode() * 10)).close()
+    # touch a so b becomes the least recently used
+    cache.open("a", 10, filler(b"unused")).close()
+    cache.open("d", 10, filler(b"d" * 10)).close()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a", "c", "d"]
+    assert cache.stats.evictions == 1
+    assert cache.stats.bytes == 30
+
+    # a restarted gateway picks the objects back up
+    reloaded = gateway.GatewayObjectCache(tmp_path, max_bytes=30)
+    assert reloaded.stats.entries == 3
+    with reloaded.open("c", 10, filler(b"unused")) as f:
+        assert f.read() == b"c" * 10
+
+
+def test_object_larger_than_cache_is_served_but_not_kept(tmp_path):
+    cache = gateway.GatewayObjectCache(tmp_path, max_bytes=4)
+    with cache.open("big", 10, lambda path: path.write_bytes(b"x" * 10)) as f:
+        assert f.read() == b"x" * 10
+    assert list(tmp_path.iterdir()) == []
+
+
+class FakeGatewayHandler(BaseHTTPRequestHandler):
+    """Serves the gateway api for the in memory objects of the server"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        objects = self.server.objects
+        _, _, bucket_name, _, *name_parts = url.path.split("/")
+        if not name_parts:
+            items = [
+                self.server.metadata(name)
+                for name in sorted(objects)
+                if name.startswith(query.get("prefix", ""))
+            ]
+            return self.send_body(json.dumps({"items": items}).encode("utf-8"))
+
+        name = unquote("/".join(name_parts))
+        if name not in objects:
+            return self.send_error(404)
+        if query.get("alt") != "media":
+            return self.send_body(json.dumps(self.server.metadata(name)).encode("utf-8"))
+        if "ifGenerationMatch" in query and int(query["ifGenerationMatch"]) != 1:
+            return self.send_error(412)
+
+        data = objects[name]
+        self.server.requested_ranges.append(self.headers.get("Range"))
+        if self.headers.get("Range"):
+            start, end = self.headers["Range"].replace("bytes=", "").split("-")
+            data = data[int(start): int(end) + 1 if end else None]
+        self.send_body(data)
+
+    def send_body(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def fake_gateway(objects: dict):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGatewayHandler)
+    server.objects = objects
+    server.requested_ranges = []
+
+    def metadata(name):
+        crc32c = base64.b64encode(google_crc32c.Checksum(objects[name]).digest()).decode("utf-8")
+        return {"name": name, "size": len(objects[name]), "generation": 1, "crc32c": crc32c}
+
+    server.metadata = metadata
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with mock.patch.object(gcs.GcsApi, "client", None):
+            gcs.GcsApi.use_gateway(f"http://127.0.0.1:{server.server_address[1]}")
+            yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def make_tarball(files: dict) -> bytes:
+    tarball = io.BytesIO()
+    with tarfile.open(fileobj=tarball, mode="w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return tarball.getvalue()
+
+
+def test_gcs_reads_through_gateway(tmp_path):
+    tarball = make_tarball({"saved_model.pb": os.urandom(300_000)})
+    objects = {
+        "env/tensorflow/model_a/1/model.tar.gz": b"old",
+        "env/tensorflow/model_a/2/model.tar.gz": tarball,
+    }
+    with fake_gateway(objects) as server:
+        records = gcs.get_current_remote_records("gs://bucket/env")
+        record = records[RecordKey(framework="tensorflow", name="model_a")]
+        assert record.version == 2
+        assert record.remote_path == "gs://bucket/env/tensorflow/model_a/2/model.tar.gz"
+        assert gcs.get_remote_record_size(record) == len(tarball)
+
+        bucket, blob_path = gcs._get_gcs_bucket_and_remaining_path(record.remote_path)
+        blob = bucket.get_blob(str(blob_path))
+        destination = tmp_path.joinpath("model.tar.gz")
+        gcs.download_blob_in_chunks(blob, destination, chunk_size=100_000, max_workers=4)
+        assert destination.read_bytes() == tarball
+        assert len(server.requested_ranges) == 4
+
+        gcs.stream_extract_blob(blob, tmp_path.joinpath("extracted"))
+        assert tmp_path.joinpath("extracted", "saved_model.pb").exists()
+        assert bucket.get_blob("env/tensorflow/model_a/3/model.tar.gz") is None
@@ -1,6 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4 as uuid
 from unittest import mock
+import threading
+import tarfile
 import random
+import time
+import io
+import os
+import pytest
 from google.cloud import storage
 
 import tests
@@ -76,3 +83,207 @@ def test_known_remote_records_with_many_records(gcs_client: mock.Mock):
     versions = {r.version for r in records.values()}
     assert versions == {101}
 
+
+
+class FakeBlob:
+    def __init__(self, data: bytes, name="env/framework/name/1/model.tar.gz"):
+        checksum = gcs.google_crc32c.Checksum(data)
+        self.name = name
+        self.data = data
+        self.size = len(data)
+        self.generation = 1
+        self.crc32c = gcs.base64.b64encode(checksum.digest()).decode("utf-8")
+        self.requested_ranges = []
+
+    def download_as_bytes(self, client=None, start=None, end=None, **kwargs):
+        self.requested_ranges.append((start, end))
+        return self.data[start:end + 1]
+
+    def open(self, mode="rb", **kwargs):
+        return io.BytesIO(self.data)
+
+
+def make_tarball(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def test_download_blob_in_chunks_writes_every_range(tmp_path):
+    data = os.urandom(1_000_003)
+    blob = FakeBlob(data)
+    destination = tmp_path.joinpath("model.tar.gz")
+
+    gcs.download_blob_in_chunks(blob, destination, chunk_size=100_000, max_workers=4)
+
+    assert destination.read_bytes() == data
+    assert len(blob.requested_ranges) == 11
+    assert sorted(blob.requested_ranges)[-1] == (1_000_000, 1_000_002)
+
+
+def test_concurrent_downloads_share_one_chunk_executor(tmp_path):
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+
+    class CountingBlob(FakeBlob):
+        def download_as_bytes(self, *args, **kwargs):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.001)
+            try:
+                return super().download_as_bytes(*args, **kwargs)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+
+    blobs = [CountingBlob(os.urandom(100_000)) for _ in range(4)]
+    with ThreadPoolExecutor(max_workers=3) as chunk_executor, ThreadPoolExecutor(4) as downloads:
+        for future in [
+            downloads.submit(
+                gcs.download_blob_in_chunks,
+                blob,
+                tmp_path.joinpath(f"{index}.tar.gz"),
+                chunk_size=10_000,
+                executor=chunk_executor,
+            )
+            for index, blob in enumerate(blobs)
+        ]:
+            future.result()
+
+    assert peak[0] <= 3
+    for index, blob in enumerate(blobs):
+        assert tmp_path.joinpath(f"{index}.tar.gz").read_bytes() == blob.data
+
+
+def test_download_blob_in_chunks_fails_on_crc_mismatch(tmp_path):
+    blob = FakeBlob(os.urandom(10_000))
+    blob.crc32c = FakeBlob(b"something else entirely").crc32c
+
+    with pytest.raises(gcs.GcsDownloadException):
+        gcs.download_blob_in_chunks(
+            blob, tmp_path.joinpath("model.tar.gz"), chunk_size=1_000, max_workers=4
+        )
+
+
+def test_stream_extract_blob_skips_invalid_members(tmp_path):
+    blob = FakeBlob(make_tarball({
+        "saved_model.pb": b"some model",
+        "variables/variables.index": b"some index",
+        "../escaped.txt": b"should never be written",
+    }))
+
+    gcs.stream_extract_blob(blob, tmp_path.joinpath("model"))
+
+    assert tmp_path.joinpath("model/saved_model.pb").read_bytes() == b"some model"
+    assert tmp_path.joinpath("model/variables/variables.index").read_bytes() == b"some index"
+    assert not tmp_path.joinpath("escaped.txt").exists()
+
+
+def test_stream_extract_blob_fails_on_crc_mismatch(tmp_path):
+    blob = FakeBlob(make_tarball({"saved_model.pb": b"some model"}))
+    blob.crc32c = FakeBlob(b"something else entirely").crc32c
+
+    with pytest.raises(gcs.GcsDownloadException):
+        gcs.stream_extract_blob(blob, tmp_path.joinpath("model"))
+
+
+@mock.patch("model_manager_lib.gcs.GcsApi.client")
+def test_rebuild_remote_index_only_publishes_current_records(gcs_client: mock.Mock):
+    gcs_client.list_blobs.return_value = [
+        make_blob("env/framework/name/1/model.tar.gz"),
+        make_blob("env/framework/name/2/model.tar.gz"),
+        make_blob("env/framework/other_name/0/model.tar.gz"),
+        make_blob("env/framework/other_name/5/model.tar.gz"),
+    ]
+    index_blob = gcs_client.get_bucket.return_value.blob.return_value
+    index_blob.generation = 1234
+
+    index = gcs.rebuild_remote_index("gs://some/env")
+
+    gcs_client.get_bucket.return_value.blob.assert_called_once_with("env/_index.json")
+    index_blob.upload_from_string.assert_called_once()
+    assert index.generation == 1234
+    assert {record.version for _, record in index.records.values()} == {2, 0}
+
+
+def test_remote_record_carries_blob_metadata_and_detects_reuploads():
+    blob = make_blob("env/framework/name/3/model.tar.gz")
+    blob._properties.update(
+        generation="1700000000000001",
+        size="1024",
+        crc32c="AAAAAA==",
+        updated="2026-01-02T03:04:05.000Z",
+    )
+
+    record = gcs._blob_to_remote_record(blob)
+    assert (record.generation, record.size, record.crc32c) == (1700000000000001, 1024, "AAAAAA==")
+    assert record.updated == blob.updated.timestamp()
+    assert gcs.get_remote_record_size(record) == 1024
+    assert gcs._dict_to_remote_record(gcs._remote_record_to_dict(record)) == record
+
+    local_metadata = gcs.remote_record_metadata(record)
+    assert not gcs.remote_record_changed(record, local_metadata)
+    assert not gcs.remote_record_changed(record, None)
+    assert not gcs.remote_record_changed(record, {**local_metadata, "generation": None})
+    assert gcs.remote_record_changed(record, {**local_metadata, "generation": 1})
+
+
+def test_latest_pointers_replace_listing_every_version(tmp_path):
+    for name, versions in {"model_a": [1, 2, 3, 0], "model_b": [5], "model_c": [7, 8]}.items():
+        for version in versions:
+            path = tmp_path.joinpath("env", "tensorflow", name, str(version), "model.tar.gz")
+            path.parent.mkdir(parents=True)
+            path.write_bytes(b"tarball")
+    remote_directory = f"file://{tmp_path}/env"
+
+    pointers = gcs.publish_latest_pointers(remote_directory)
+    assert pointers[gcs.RecordKey("tensorflow", "model_a")]["latest"]["version"] == 3
+    assert pointers[gcs.RecordKey("tensorflow", "model_a")]["priority"]["version"] == 0
+    # model_c was uploaded without a pointer
+    tmp_path.joinpath("env", "tensorflow", "model_c", gcs.LATEST_POINTER_NAME).unlink()
+
+    with mock.patch.object(gcs, "list_blobs", wraps=gcs.list_blobs) as list_blobs:
+        records = gcs.get_current_remote_records(remote_directory, use_pointers=True)
+    assert records == gcs.get_current_remote_records(remote_directory)
+    assert {key.name: record.version for key, record in records.items()} == {
+        "model_a": 0, "model_b": 5, "model_c": 8,
+    }
+    # only the model without a pointer lists its versions
+    assert [c.kwargs["prefix"] for c in list_blobs.call_args_list] == [
+        f"{str(tmp_path).lstrip('/')}/env/tensorflow/model_c/"
+    ]
+
+    gcs.remove_model_gcs_bucket(remote_directory, "tensorflow", "model_b")
+    gcs.remove_priority_bucket(remote_directory, "tensorflow", "model_a")
+    gcs.publish_latest_pointers(remote_directory, framework="tensorflow", name="model_a")
+    records = gcs.get_current_remote_records(remote_directory, use_pointers=True)
+    assert {key.name: record.version for key, record in records.items()} == {"model_a": 3, "model_c": 8}
+
+
+def test_stale_latest_pointer_falls_back_to_listing(tmp_path):
+    for version in [1, 2]:
+        path = tmp_path.joinpath("env", "tensorflow", "model_a", str(version), "model.tar.gz")
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b"tarball")
+    remote_directory = f"file://{tmp_path}/env"
+    gcs.publish_latest_pointers(remote_directory)
+
+    # uploaded without republishing the pointer
+    path = tmp_path.joinpath("env", "tensorflow", "model_a", "3", "model.tar.gz")
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"tarball")
+    key = gcs.RecordKey("tensorflow", "model_a")
+
+    records = gcs.get_current_remote_records(remote_directory, use_pointers=True, pointer_max_age_seconds=60)
+    assert records[key].version == 2
+
+    with mock.patch.object(gcs.time, "time", return_value=time.time() + 61):
+        records = gcs.get_current_remote_records(
+            remote_directory, use_pointers=True, pointer_max_age_seconds=60
+        )
+    assert records[key].version == 3
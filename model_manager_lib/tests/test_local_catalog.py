@@ -0,0 +1,72 @@
+import shutil
+
+from model_manager_lib import RecordKey
+from model_manager_lib import local_catalog, local_filesystem
+
+MODEL_A = RecordKey(framework="tensorflow", name="model_a")
+
+
+def make_version(model_directory, framework, name, version, size=10):
+    path = model_directory.joinpath(framework, name, str(version))
+    path.joinpath("variables").mkdir(parents=True)
+    path.joinpath("saved_model.pb").write_bytes(b"m" * size)
+    path.joinpath("variables", "variables.index").write_bytes(b"i")
+    return path
+
+
+def test_record_version_keeps_metadata_and_answers_known_models(tmp_path):
+    version = make_version(tmp_path, "tensorflow", "model_a", 3)
+    local_filesystem.write_remote_metadata(
+        version, {"remote_path": "gs://bucket/env/tensorflow/model_a/3/model.tar.gz", "generation": 7}
+    )
+    make_version(tmp_path, "tensorflow", "model_a", 0)
+    make_version(tmp_path, "pytorch", "model_b", 1)
+    catalog = local_catalog.LocalCatalog(str(tmp_path))
+
+    metadata = catalog.record_version(version, fetch_seconds=1.5, source="gcs")
+    assert (metadata.size_bytes, metadata.file_count, metadata.remote_generation) == (11, 2, 7)
+    assert catalog.reconcile() == (2, 0)
+    assert catalog.reconcile() == (0, 0)
+
+    assert catalog.get_known_local_models() == local_filesystem._scan_known_local_models(str(tmp_path))
+    assert list(catalog.get_known_local_models(framework="tensorflow")) == [MODEL_A]
+    [recorded] = catalog.get_versions(name="model_a")[1:]
+    assert (recorded.version, recorded.fetch_seconds, recorded.source) == (3, 1.5, "gcs")
+    assert catalog.summary()["versions"] == 3
+
+    # a second catalog on the same file, e.g. config_manager's, sees the same rows
+    assert local_catalog.LocalCatalog(str(tmp_path)).get_versions() == catalog.get_versions()
+
+
+def test_catalog_serves_local_filesystem_and_reconciles_drift(tmp_path):
+    make_version(tmp_path, "tensorflow", "model_a", 1)
+    catalog = local_catalog.LocalCatalog(str(tmp_path))
+    local_filesystem.use_catalog(catalog)
+    try:
+        # the directory is scanned until the catalog is first reconciled
+        assert not catalog.is_reconciled()
+        assert [r.version for r in local_filesystem.get_known_local_models(str(tmp_path))[MODEL_A]] == [1]
+        catalog.reconcile()
+
+        # published without being recorded is invisible until reconciled
+        make_version(tmp_path, "tensorflow", "model_a", 2)
+        assert [r.version for r in local_filesystem.get_known_local_models(str(tmp_path))[MODEL_A]] == [1]
+
+        # removing a version through local_filesystem keeps the catalog current
+        [record] = local_filesystem.get_known_local_models(str(tmp_path))[MODEL_A]
+        local_filesystem.remove_record(record)
+        assert local_filesystem.get_known_local_models(str(tmp_path)) == {}
+
+        # a failed record stops the catalog being trusted until reconciled
+        catalog.invalidate()
+        assert [r.version for r in local_filesystem.get_known_local_models(str(tmp_path))[MODEL_A]] == [2]
+        assert catalog.reconcile() == (1, 0)
+        assert catalog.is_reconciled()
+
+        make_version(tmp_path, "tensorflow", "model_a", 3)
+        catalog.record_version(tmp_path.joinpath("tensorflow", "model_a", "3"), source="gcs")
+        shutil.rmtree(tmp_path.joinpath("tensorflow", "model_a", "3"))
+        assert catalog.reconcile() == (0, 1)
+        assert [r.version for r in local_filesystem.get_known_local_models(str(tmp_path))[MODEL_A]] == [2]
+    finally:
+        local_filesystem._local_catalogs.clear()
@@ -1,7 +1,16 @@
 #! /usr/bin/env python
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4 as uuid
 from unittest import mock
 import random
+import fcntl
+import pathlib
+import shutil
+import time
+import os
+
+import inotify_simple
+import pytest
 
 import tests
 
@@ -117,3 +126,405 @@ def test_get_expected_local_path():
     )
 
     assert expected == actual
+
+
+def make_version_directory(model_directory, framework, name, version):
+    path = model_directory.joinpath(framework, name, str(version))
+    path.mkdir(parents=True)
+    return path
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_local_model_index_tracks_changes(tmp_path, use_inotify):
+    make_version_directory(tmp_path, "tensorflow", "model_a", 1)
+    tmp_path.joinpath(".staging").mkdir()
+
+    with mock.patch.object(
+        local_filesystem, "INotify", local_filesystem.INotify if use_inotify else None
+    ):
+        index = local_filesystem.LocalModelIndex(str(tmp_path))
+    key_a = RecordKey(framework="tensorflow", name="model_a")
+    key_b = RecordKey(framework="pytorch", name="model_b")
+    assert [r.version for r in index.get_known_local_models()[key_a]] == [1]
+
+    generation = index.refresh()
+    assert index.refresh() == generation, "generation moved without any change"
+
+    make_version_directory(tmp_path, "tensorflow", "model_a", 2)
+    make_version_directory(tmp_path, "pytorch", "model_b", 5)
+    make_version_directory(tmp_path, ".staging", "model_c", 1)
+    assert index.refresh() > generation
+    known = index.get_known_local_models()
+    assert set(known) == {key_a, key_b}
+    assert [r.version for r in known[key_a]] == [2, 1]
+    assert set(index.get_known_local_models(framework="tensorflow")) == {key_a}
+    assert known == local_filesystem._scan_known_local_models(str(tmp_path))
+
+    generation = index.refresh()
+    shutil.rmtree(tmp_path.joinpath("tensorflow", "model_a", "2"))
+    shutil.rmtree(tmp_path.joinpath("pytorch"))
+    assert index.refresh() > generation
+    known = index.get_known_local_models()
+    assert set(known) == {key_a}
+    assert [r.version for r in known[key_a]] == [1]
+
+
+def test_local_model_index_rescans_on_overflow(tmp_path):
+    index = local_filesystem.LocalModelIndex(str(tmp_path))
+    rescans = index.rescans
+    overflow = inotify_simple.Event(
+        wd=-1, mask=local_filesystem.inotify_flags.Q_OVERFLOW, cookie=0, name=""
+    )
+    make_version_directory(tmp_path, "tensorflow", "model_a", 1)
+
+    with mock.patch.object(index._inotify, "read", return_value=[overflow]):
+        index.refresh()
+
+    assert index.rescans == rescans + 1
+    assert RecordKey(framework="tensorflow", name="model_a") in index.get_known_local_models()
+
+
+def test_watch_serves_known_local_models_from_index(tmp_path):
+    make_version_directory(tmp_path, "tensorflow", "model_a", 1)
+    local_filesystem.watch(str(tmp_path))
+    try:
+        index = local_filesystem.get_local_model_index(str(tmp_path))
+        assert index is local_filesystem.get_local_model_index(str(tmp_path))
+        with mock.patch.object(
+            local_filesystem, "_scan_known_local_models", wraps=local_filesystem._scan_known_local_models
+        ) as scan_mock:
+            known = local_filesystem.get_known_local_models(str(tmp_path))
+        scan_mock.assert_not_called()
+        assert RecordKey(framework="tensorflow", name="model_a") in known
+    finally:
+        local_filesystem._watched_model_directories.discard(str(tmp_path.absolute()))
+
+
+def test_concurrent_first_requests_build_one_index(tmp_path):
+    local_filesystem.watch(str(tmp_path))
+    real_index = local_filesystem.LocalModelIndex
+
+    def slow_index(*args, **kwargs):
+        time.sleep(0.05)
+        return real_index(*args, **kwargs)
+
+    try:
+        with mock.patch.object(local_filesystem, "LocalModelIndex", side_effect=slow_index) as index_mock:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                indexes = list(executor.map(
+                    lambda _: local_filesystem.get_local_model_index(str(tmp_path)), range(8)
+                ))
+        assert index_mock.call_count == 1
+        assert all(index is indexes[0] for index in indexes)
+    finally:
+        local_filesystem._watched_model_directories.discard(str(tmp_path.absolute()))
+        local_filesystem._local_model_indexes.pop((os.getpid(), str(tmp_path.absolute())), None)
+
+
+def test_publish_model_directory_renames_into_place(tmp_path):
+    staged = tmp_path.joinpath(".staging", "abc", "untared_model")
+    staged.joinpath("variables").mkdir(parents=True)
+    staged.joinpath("saved_model.pb").write_bytes(b"x" * 10)
+    staged.joinpath("variables", "variables.index").write_bytes(b"y" * 5)
+    destination = tmp_path.joinpath("tensorflow", "model_a", "1")
+    statsd_client = mock.Mock()
+
+    with mock.patch.object(local_filesystem.shutil, "copytree") as copytree_mock:
+        published = local_filesystem.publish_model_directory(
+            staged, destination, statsd_client=statsd_client
+        )
+
+    copytree_mock.assert_not_called()
+    assert published == 15
+    assert not staged.exists()
+    assert destination.joinpath("variables", "variables.index").read_bytes() == b"y" * 5
+    statsd_client.incr.assert_called_once_with("local.publish_bytes", 15)
+    statsd_client.timing.assert_called_once()
+
+
+def test_publish_model_directory_ignores_existing_version(tmp_path):
+    staged = tmp_path.joinpath(".staging", "untared_model")
+    staged.mkdir(parents=True)
+    destination = make_version_directory(tmp_path, "tensorflow", "model_a", 1)
+
+    assert local_filesystem.publish_model_directory(staged, destination) == 0
+    assert staged.exists()
+
+
+def test_publish_model_directory_replaces_version_and_keeps_remote_metadata(tmp_path):
+    destination = make_version_directory(tmp_path, "tensorflow", "model_a", 1)
+    destination.joinpath("saved_model.pb").write_bytes(b"old")
+    local_filesystem.write_remote_metadata(destination, {"generation": 1})
+    staged = tmp_path.joinpath(".staging", "untared_model")
+    staged.mkdir(parents=True)
+    staged.joinpath("saved_model.pb").write_bytes(b"new")
+
+    local_filesystem.publish_model_directory(
+        staged, destination, remote_metadata={"generation": 2}, replace=True
+    )
+
+    assert destination.joinpath("saved_model.pb").read_bytes() == b"new"
+    assert local_filesystem.read_remote_metadata(destination) == {"generation": 2}
+    # the metadata and the replaced version stay out of the model listing
+    assert sorted(p.name for p in destination.parent.iterdir()) == [".1.remote.json", "1"]
+    records = local_filesystem._scan_known_local_models(tmp_path)
+    assert [r.version for r in records[RecordKey(framework="tensorflow", name="model_a")]] == [1]
+
+    local_filesystem.remove_record(records[RecordKey(framework="tensorflow", name="model_a")][0])
+    assert list(destination.parent.iterdir()) == []
+    assert local_filesystem.read_remote_metadata(destination) is None
+
+
+def test_publish_model_directory_fails_across_filesystems(tmp_path):
+    staged = tmp_path.joinpath(".staging", "untared_model")
+    staged.mkdir(parents=True)
+    destination = tmp_path.joinpath("tensorflow", "model_a", "1")
+    real_stat = pathlib.Path.stat
+
+    def stat_on_other_device(path, *args, **kwargs):
+        result = real_stat(path, *args, **kwargs)
+        if path == staged:
+            return os.stat_result((result.st_mode, result.st_ino, result.st_dev + 1) + tuple(result)[3:])
+        return result
+
+    with mock.patch.object(pathlib.Path, "stat", stat_on_other_device):
+        with pytest.raises(local_filesystem.LocalPublishException):
+            local_filesystem.publish_model_directory(staged, destination)
+
+    assert staged.exists()
+    assert not destination.exists()
+
+
+def test_content_store_shares_identical_files_between_versions(tmp_path):
+    store = tmp_path.joinpath(local_filesystem.CONTENT_STORE_DIRECTORY_NAME)
+    vocabulary = os.urandom(1024)
+    records = []
+    for version in (1, 2):
+        staged = tmp_path.joinpath(".staging", str(version))
+        staged.joinpath("assets").mkdir(parents=True)
+        staged.joinpath("assets", "vocab.txt").write_bytes(vocabulary)
+        staged.joinpath("saved_model.pb").write_bytes(os.urandom(1024))
+        staged.joinpath("tiny.txt").write_bytes(b"small")
+
+        local_filesystem.deduplicate_model_directory(staged, store, min_file_size=100)
+        destination = tmp_path.joinpath("tensorflow", "model_a", str(version))
+        local_filesystem.publish_model_directory(staged, destination)
+        records.append(local_filesystem._path_to_local_record(destination))
+
+    vocab_1, vocab_2 = [
+        r.full_model_path.joinpath("assets", "vocab.txt") for r in records
+    ]
+    assert vocab_1.stat().st_ino == vocab_2.stat().st_ino
+    assert vocab_1.stat().st_nlink == 3
+    assert records[0].full_model_path.joinpath("tiny.txt").stat().st_nlink == 1
+    assert len(list(store.glob("*/*"))) == 3
+
+    local_filesystem.remove_record(records[0])
+    assert vocab_2.read_bytes() == vocabulary
+    assert len(list(store.glob("*/*"))) == 2, "only version 1's model.pb is garbage"
+
+    local_filesystem.remove_record(records[1])
+    assert list(store.glob("*/*")) == []
+
+
+def make_sized_version(model_directory, name, version, size, age=0):
+    path = make_version_directory(model_directory, "tensorflow", name, version)
+    path.joinpath("saved_model.pb").write_bytes(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_local_retention_enforces_max_versions_and_keeps_rollback(tmp_path):
+    for version in (1, 2, 3, 4):
+        make_sized_version(tmp_path, "model_a", version, 10)
+    make_sized_version(tmp_path, "model_a", 0, 10)
+    retention = local_filesystem.LocalRetention(
+        str(tmp_path), local_filesystem.LocalRetentionPolicy(max_versions=1)
+    )
+    incoming = Record(key=RecordKey(framework="tensorflow", name="model_a"), version=5)
+
+    assert retention.reserve(incoming, incoming_bytes=10)
+
+    # max_versions never goes below the incoming version and its rollback
+    assert sorted(p.name for p in tmp_path.joinpath("tensorflow", "model_a").iterdir()) == ["0", "4"]
+    assert retention.reserved_bytes == 10
+    retention.release(10)
+    assert retention.report()["used_bytes"] == 20
+
+
+def test_local_retention_evicts_oldest_versions_to_fit_quota(tmp_path):
+    make_sized_version(tmp_path, "model_a", 1, 100, age=300)
+    make_sized_version(tmp_path, "model_a", 2, 100, age=200)
+    make_sized_version(tmp_path, "model_a", 3, 100, age=100)
+    make_sized_version(tmp_path, "model_b", 1, 100, age=400)
+    make_sized_version(tmp_path, "model_b", 2, 100, age=50)
+    make_sized_version(tmp_path, "model_b", 3, 100)
+    statsd_client = mock.Mock()
+    retention = local_filesystem.LocalRetention(
+        str(tmp_path), local_filesystem.LocalRetentionPolicy(max_bytes=550), statsd_client
+    )
+    incoming = Record(key=RecordKey(framework="pytorch", name="model_c"), version=1)
+
+    assert retention.reserve(incoming, incoming_bytes=150)
+
+    # the oldest evictable versions go first, newest and rollback stay
+    assert not tmp_path.joinpath("tensorflow", "model_b", "1").exists()
+    assert not tmp_path.joinpath("tensorflow", "model_a", "1").exists()
+    assert tmp_path.joinpath("tensorflow", "model_b", "2").exists()
+    statsd_client.incr.assert_any_call("local.retention.evicted_bytes", 100)
+
+    # nothing evictable is left, so a second download is refused without evicting
+    assert not retention.reserve(incoming, incoming_bytes=150)
+    assert retention.report()["versions"] == 4
+    statsd_client.incr.assert_called_with("local.retention.refused")
+
+
+def test_local_retention_refuses_download_without_free_disk(tmp_path):
+    make_sized_version(tmp_path, "model_a", 1, 10)
+    policy = local_filesystem.LocalRetentionPolicy(min_free_bytes=1024 ** 5)
+    retention = local_filesystem.LocalRetention(str(tmp_path), policy)
+    incoming = Record(key=RecordKey(framework="tensorflow", name="model_a"), version=2)
+
+    assert not retention.reserve(incoming, incoming_bytes=10)
+    assert tmp_path.joinpath("tensorflow", "model_a", "1").exists()
+    assert retention.reserved_bytes == 0
+
+
+def fake_disk_usage(model_directory, capacity):
+    """disk_usage of a filesystem of capacity bytes holding only model_directory"""
+
+    def disk_usage(path):
+        used = sum(f.stat().st_size for f in model_directory.rglob("*") if f.is_file())
+        return mock.Mock(free=capacity - used)
+
+    return mock.patch.object(local_filesystem.shutil, "disk_usage", side_effect=disk_usage)
+
+
+def test_local_retention_counts_trashed_versions_once_collected(tmp_path):
+    make_sized_version(tmp_path, "model_a", 1, 200, age=300)
+    make_sized_version(tmp_path, "model_a", 2, 100, age=200)
+    make_sized_version(tmp_path, "model_a", 3, 100, age=100)
+    policy = local_filesystem.LocalRetentionPolicy(min_free_bytes=500)
+    incoming = Record(key=RecordKey(framework="tensorflow", name="model_b"), version=1)
+    with mock.patch.object(local_filesystem.TrashCollector, "start"), fake_disk_usage(tmp_path, 1000):
+        local_filesystem.use_trash(str(tmp_path))
+        try:
+            trash = local_filesystem.get_trash_collector(str(tmp_path))
+            retention = local_filesystem.LocalRetention(str(tmp_path), policy)
+
+            with open(tmp_path.joinpath(local_filesystem.TRASH_LOCK_FILE_NAME), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # version 1 is trashed, but another process holds the trash
+                assert not retention.reserve(incoming, incoming_bytes=200)
+            assert retention.reserved_bytes == 0
+            assert len(list(trash.trash_directory.iterdir())) == 1
+
+            # the trashed bytes are collected before anything more is evicted
+            assert retention.reserve(incoming, incoming_bytes=200)
+        finally:
+            local_filesystem._trash_settings.clear()
+            local_filesystem._trash_collectors.clear()
+
+    assert list(trash.trash_directory.iterdir()) == []
+    assert sorted(p.name for p in tmp_path.joinpath("tensorflow", "model_a").iterdir()) == ["2", "3"]
+    assert retention.reserved_bytes == 200
+
+
+def test_remove_record_moves_version_to_trash(tmp_path):
+    version = make_sized_version(tmp_path, "model_a", 1, 100)
+    make_sized_version(tmp_path, "model_a", 2, 50)
+    local_filesystem.write_remote_metadata(version, {"generation": 1})
+    statsd_client = mock.Mock()
+    with mock.patch.object(local_filesystem.TrashCollector, "start"):
+        local_filesystem.use_trash(str(tmp_path), statsd_client=statsd_client)
+        try:
+            record = local_filesystem._path_to_local_record(version)
+            with mock.patch.object(local_filesystem.shutil, "rmtree") as rmtree_mock:
+                local_filesystem.remove_record(record)
+            trash = local_filesystem.get_trash_collector(str(tmp_path))
+        finally:
+            local_filesystem._trash_settings.clear()
+            local_filesystem._trash_collectors.clear()
+
+    rmtree_mock.assert_not_called()
+    assert sorted(p.name for p in version.parent.iterdir()) == ["2"]
+    assert [r.version for r in local_filesystem._scan_known_local_models(tmp_path)[record.key]] == [2]
+    assert len(list(trash.trash_directory.iterdir())) == 1
+
+    assert trash.collect() == 100
+    assert list(trash.trash_directory.iterdir()) == []
+    assert trash.pending_bytes == 0
+    statsd_client.gauge.assert_any_call("local.trash.pending_bytes", 100)
+    statsd_client.gauge.assert_called_with("local.trash.pending_bytes", 0)
+
+
+def test_trash_is_emptied_by_one_collector_at_a_time(tmp_path):
+    version = make_sized_version(tmp_path, "model_a", 1, 100)
+    local_filesystem.use_trash(str(tmp_path))
+    try:
+        trash = local_filesystem.get_trash_collector(str(tmp_path))
+        assert trash._thread is None
+        trash.put(version)
+    finally:
+        local_filesystem._trash_settings.clear()
+        local_filesystem._trash_collectors.clear()
+
+    with open(tmp_path.joinpath(local_filesystem.TRASH_LOCK_FILE_NAME), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        assert trash.collect() == 0
+        assert len(list(trash.trash_directory.iterdir())) == 1
+    assert trash.collect() == 100
+
+
+def test_trash_collector_throttles_and_collects_content_store(tmp_path):
+    store = tmp_path.joinpath(local_filesystem.CONTENT_STORE_DIRECTORY_NAME)
+    staged = tmp_path.joinpath(".staging", "1")
+    staged.mkdir(parents=True)
+    staged.joinpath("vocab.txt").write_bytes(b"v" * 1000)
+    staged.joinpath("saved_model.pb").write_bytes(b"m" * 1000)
+    local_filesystem.deduplicate_model_directory(staged, store, min_file_size=1)
+    version = tmp_path.joinpath("tensorflow", "model_a", "1")
+    local_filesystem.publish_model_directory(staged, version)
+    trash = local_filesystem.TrashCollector(str(tmp_path), max_bytes_per_second=1000)
+    trash.put(version)
+
+    with mock.patch.object(local_filesystem.time, "sleep") as sleep_mock:
+        assert trash.collect() == 2000
+
+    sleep_mock.assert_not_called()
+    assert list(store.glob("*/*")) == []
+    assert not tmp_path.joinpath("tensorflow", "model_a", "1").exists()
+
+    # a plain file is throttled at max_bytes_per_second
+    version = make_sized_version(tmp_path, "model_a", 2, 3000)
+    trash.put(version)
+    with mock.patch.object(local_filesystem.time, "sleep") as sleep_mock:
+        assert trash.collect() == 3000
+    assert 2.5 < sleep_mock.call_args.args[0] <= 3
+
+
+@pytest.mark.parametrize("use_fadvise", [True, False])
+def test_prewarm_model_directory_reads_variables_first_within_budget(tmp_path, use_fadvise):
+    version = make_version_directory(tmp_path, "tensorflow", "model_a", 1)
+    version.joinpath("variables").mkdir()
+    version.joinpath("saved_model.pb").write_bytes(b"m" * 100)
+    version.joinpath("variables", "variables.index").write_bytes(b"i" * 10)
+    version.joinpath("variables", "variables.data-00000-of-00002").write_bytes(b"d" * 300)
+    version.joinpath("variables", "variables.data-00001-of-00002").write_bytes(b"d" * 300)
+    prewarmed = []
+    real_prewarm_file = local_filesystem._prewarm_file
+
+    def record_prewarm_file(file_path, max_bytes, use_fadvise):
+        prewarmed.append((file_path.name, max_bytes))
+        return real_prewarm_file(file_path, max_bytes, use_fadvise)
+
+    with mock.patch.object(local_filesystem, "_prewarm_file", record_prewarm_file):
+        assert local_filesystem.prewarm_model_directory(version, 650, use_fadvise=use_fadvise) == 650
+
+    assert prewarmed == [
+        ("variables.data-00000-of-00002", 650),
+        ("variables.data-00001-of-00002", 350),
+        ("variables.index", 50),
+        ("saved_model.pb", 40),
+    ]
@@ -0,0 +1,184 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+import multiprocessing as mp
+import contextlib
+import json
+import os
+
+import pytest
+
+from model_manager_lib import RecordKey
+from model_manager_lib import delta, gcs, peer
+
+REMOTE_RECORD = gcs.RemoteRecord(
+    key=RecordKey(framework="tensorflow", name="model_a"),
+    version=3,
+    remote_path="gs://bucket/env/tensorflow/model_a/3/model.tar.gz",
+)
+
+
+def make_peer_handler(model_directory, corrupt=False):
+    """Serves the puller's /peer endpoints for a single version directory."""
+    prefix = peer.peer_model_path(REMOTE_RECORD)
+
+    class PeerHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == f"{prefix}/manifest":
+                body = json.dumps(peer.get_peer_manifest(model_directory)).encode("utf-8")
+            elif self.path.startswith(f"{prefix}/files/"):
+                file_path = peer.resolve_peer_file(
+                    model_directory, unquote(self.path[len(f"{prefix}/files/"):])
+                )
+                if file_path is None:
+                    self.send_error(404)
+                    return
+                body = b"".join(peer.iter_peer_file(file_path))
+                if corrupt:
+                    body = body[::-1]
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return PeerHandler
+
+
+@contextlib.contextmanager
+def puller_process(model_directory, corrupt=False):
+    """Runs a peer server for model_directory in its own process, yielding its host:port."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_peer_handler(model_directory, corrupt))
+    process = mp.get_context("fork").Process(target=server.serve_forever, daemon=True)
+    process.start()
+    server.server_close()
+    try:
+        yield f"127.0.0.1:{server.server_address[1]}"
+    finally:
+        process.terminate()
+        process.join()
+
+
+def make_model(path, files):
+    for file_path, data in files.items():
+        path.joinpath(file_path).parent.mkdir(parents=True, exist_ok=True)
+        path.joinpath(file_path).write_bytes(data)
+    return path
+
+
+MODEL_FILES = {
+    "saved_model.pb": os.urandom(4096),
+    "variables/variables.index": os.urandom(512),
+    "variables/variables.data-00000-of-00001": os.urandom(3 * 1024 * 1024 + 7),
+    "assets/vocab with spaces.txt": b"a\nb\nc\n",
+}
+
+
+def test_version_fans_out_across_puller_processes(tmp_path):
+    seed = make_model(tmp_path.joinpath("seed", "tensorflow", "model_a", "3"), MODEL_FILES)
+    second = tmp_path.joinpath("second", "tensorflow", "model_a", "3")
+    third = tmp_path.joinpath("third", "tensorflow", "model_a", "3")
+
+    with puller_process(seed) as seed_target:
+        fetched = peer.download_remote_record_from_peer(
+            REMOTE_RECORD,
+            seed_target,
+            local_directory=second,
+            staging_directory=tmp_path.joinpath("second", ".staging"),
+            expected_manifest=delta.build_manifest(seed),
+        )
+    assert fetched == sum(len(data) for data in MODEL_FILES.values())
+
+    # the seed is gone, the third puller fetches from the second one
+    with puller_process(second) as second_target:
+        peer.download_remote_record_from_peer(
+            REMOTE_RECORD,
+            second_target,
+            local_directory=third,
+            staging_directory=tmp_path.joinpath("third", ".staging"),
+        )
+
+    for file_path, data in MODEL_FILES.items():
+        assert third.joinpath(file_path).read_bytes() == data
+    assert list(tmp_path.joinpath("third", ".staging").iterdir()) == []
+
+
+def test_corrupt_peer_file_is_not_published(tmp_path):
+    seed = make_model(tmp_path.joinpath("seed", "3"), MODEL_FILES)
+    destination = tmp_path.joinpath("local", "tensorflow", "model_a", "3")
+
+    with puller_process(seed, corrupt=True) as seed_target:
+        with pytest.raises(peer.PeerFetchException):
+            peer.download_remote_record_from_peer(
+                REMOTE_RECORD,
+                seed_target,
+                local_directory=destination,
+                staging_directory=tmp_path.joinpath("local", ".staging"),
+            )
+    assert not destination.exists()
+    assert list(tmp_path.joinpath("local", ".staging").iterdir()) == []
+
+
+def test_peer_manifest_must_match_remote_manifest(tmp_path):
+    seed = make_model(tmp_path.joinpath("seed", "3"), MODEL_FILES)
+    remote_manifest = delta.build_manifest(make_model(tmp_path.joinpath("other"), {"saved_model.pb": b"pb"}))
+
+    with puller_process(seed) as seed_target:
+        with pytest.raises(peer.PeerFetchException):
+            peer.download_remote_record_from_peer(
+                REMOTE_RECORD,
+                seed_target,
+                local_directory=tmp_path.joinpath("local", "3"),
+                staging_directory=tmp_path.joinpath(".staging"),
+                expected_manifest=remote_manifest,
+            )
+
+
+def test_assign_peer_source_forms_a_tree():
+    pullers = [f"puller-{i}:8080" for i in range(15)]
+    state = {}
+    sources = {}
+    rounds = 0
+    while len(state.get("holders", {})) < len(pullers):
+        rounds += 1
+        assigned = {}
+        for target in pullers:
+            if target in state.get("holders", {}):
+                continue
+            assignment = peer.assign_peer_source(
+                state, target, pullers, fanout=2, gcs_seeds=1, now=rounds
+            )
+            if assignment["source"] != peer.PEER_SOURCE_WAIT:
+                assigned[target] = assignment.get("peer", peer.PEER_SOURCE_GCS)
+        round_sources = list(assigned.values())
+        assert all(round_sources.count(source) <= 2 for source in round_sources)
+        for target in assigned:
+            peer.complete_peer_fetch(state, target, success=True, now=rounds)
+        sources.update(assigned)
+
+    assert list(sources.values()).count(peer.PEER_SOURCE_GCS) == 1
+    # 1 seed, then every holder serves 2 per round: 1 -> 3 -> 9 -> 15
+    assert rounds == 4
+
+
+def test_assign_peer_source_skips_dead_holders_and_expired_fetches():
+    state = {}
+    assert peer.assign_peer_source(state, "a:1", ["a:1", "b:1"], now=0) == {"source": peer.PEER_SOURCE_GCS}
+    assert peer.assign_peer_source(state, "b:1", ["a:1", "b:1"], now=1)["source"] == peer.PEER_SOURCE_WAIT
+
+    # a:1 never reported back, its seed lease expires
+    assert peer.assign_peer_source(state, "b:1", ["a:1", "b:1"], lease_seconds=10, now=11) == {
+        "source": peer.PEER_SOURCE_GCS
+    }
+    peer.complete_peer_fetch(state, "b:1", success=True, now=12)
+    assert peer.assign_peer_source(state, "a:1", ["a:1", "b:1"], now=13) == {
+        "source": peer.PEER_SOURCE_PEER,
+        "peer": "b:1",
+    }
+
+    # b:1 unregistered from the master, nobody is sent to it
+    assert peer.assign_peer_source(state, "c:1", ["a:1", "c:1"], now=14) == {"source": peer.PEER_SOURCE_GCS}
@@ -0,0 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4 as uuid
+from unittest import mock
+import time
+from google.cloud import storage
+
+from model_manager_lib import RecordKey
+from model_manager_lib import gcs, remote_catalog
+
+
+def make_blob(name, generation=1):
+    fake_bucket = mock.MagicMock()
+    fake_bucket.name = uuid().hex
+    blob = storage.Blob(name=name, bucket=fake_bucket)
+    blob._properties["generation"] = str(generation)
+    return blob
+
+
+@mock.patch("model_manager_lib.gcs.GcsApi.client")
+def test_catalog_only_rebuilds_changed_blobs(gcs_client: mock.Mock, tmp_path):
+    gcs_client.list_blobs.return_value = [
+        make_blob("env/framework/name/1/model.tar.gz"),
+        make_blob("env/framework/name/2/model.tar.gz"),
+    ]
+    catalog = remote_catalog.RemoteCatalog(
+        gcs_model_directory="gs://some/bucket",
+        snapshot_path=tmp_path.joinpath("catalog.json"),
+    )
+    records = catalog.get_current_remote_records()
+    assert records[RecordKey(framework="framework", name="name")].version == 2
+    assert (catalog.stats.hits, catalog.stats.misses) == (0, 2)
+
+    gcs_client.list_blobs.return_value = [
+        make_blob("env/framework/name/1/model.tar.gz"),
+        make_blob("env/framework/name/2/model.tar.gz", generation=2),
+        make_blob("env/framework/name/3/model.tar.gz"),
+    ]
+    records = catalog.get_current_remote_records()
+    assert records[RecordKey(framework="framework", name="name")].version == 3
+    assert (catalog.stats.hits, catalog.stats.misses) == (1, 2)
+
+
+@mock.patch("model_manager_lib.gcs.GcsApi.client")
+def test_catalog_is_shared_within_max_age(gcs_client: mock.Mock, tmp_path):
+    gcs_client.list_blobs.return_value = [make_blob("env/framework/name/1/model.tar.gz")]
+    catalog = remote_catalog.RemoteCatalog(
+        gcs_model_directory="gs://some/bucket",
+        snapshot_path=tmp_path.joinpath("catalog.json"),
+        max_age_seconds=60,
+    )
+    catalog.get_current_remote_records()
+    catalog.get_current_remote_records()
+    assert gcs_client.list_blobs.call_count == 1
+
+
+@mock.patch("model_manager_lib.gcs.GcsApi.client")
+def test_concurrent_callers_refresh_once(gcs_client: mock.Mock, tmp_path):
+    def slow_listing(*args, **kwargs):
+        time.sleep(0.05)
+        return [make_blob("env/framework/name/1/model.tar.gz")]
+
+    gcs_client.list_blobs.side_effect = slow_listing
+    catalog = remote_catalog.RemoteCatalog(
+        gcs_model_directory="gs://some/bucket",
+        snapshot_path=tmp_path.joinpath("catalog.json"),
+        max_age_seconds=60,
+    )
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: catalog.get_current_remote_records(), range(8)))
+
+    assert gcs_client.list_blobs.call_count == 1
+    assert all(len(records) == 1 for records in results)
+    assert [p.name for p in tmp_path.iterdir()] == ["catalog.json"]
+
+
+@mock.patch("model_manager_lib.gcs.GcsApi.client")
+def test_catalog_starts_warm_from_snapshot(gcs_client: mock.Mock, tmp_path):
+    snapshot_path = tmp_path.joinpath("catalog.json")
+    gcs_client.list_blobs.return_value = [make_blob("env/framework/name/1/model.tar.gz")]
+    remote_catalog.RemoteCatalog(
+        gcs_model_directory="gs://some/bucket", snapshot_path=snapshot_path
+    ).get_current_remote_records()
+
+    catalog = remote_catalog.RemoteCatalog(
+        gcs_model_directory="gs://some/bucket", snapshot_path=snapshot_path
+    )
+    records = catalog.get_current_remote_records()
+    assert len(records) == 1
+    assert (catalog.stats.hits, catalog.stats.misses) == (1, 0)
+
+
+def make_index(generated_at, generation=1, records=None):
+    return gcs.RemoteIndex(
+        generation=generation, generated_at=generated_at, records=records
+    )
+
+
+@mock.patch("model_manager_lib.gcs.read_remote_index")
+@mock.patch("model_manager_lib.gcs.GcsApi.client")
+def test_catalog_reads_fresh_index_instead_of_listing(
+        gcs_client: mock.Mock, read_remote_index: mock.Mock, tmp_path
+):
+    record = gcs._blob_to_remote_record(make_blob("env/framework/name/7/model.tar.gz"))
+    read_remote_index.return_value = make_index(
+        time.time(), records={"env/framework/name/7/model.tar.gz": (1, record)}
+    )
+    catalog = remote_catalog.RemoteCatalog(
+        gcs_model_directory="gs://some/bucket",
+        snapshot_path=tmp_path.joinpath("catalog.json"),
+        use_index=True,
+        index_max_age_seconds=600,
+    )
+    records = catalog.get_current_remote_records()
+
+    assert records[RecordKey(framework="framework", name="name")].version == 7
+    assert catalog.stats.source == "index"
+    gcs_client.list_blobs.assert_not_called()
+
+    read_remote_index.return_value = make_index(time.time())
+    records = catalog.get_current_remote_records()
+    read_remote_index.assert_called_with("gs://some/bucket", known_generation=1)
+    assert records[RecordKey(framework="framework", name="name")].version == 7
+
+
+@mock.patch("model_manager_lib.gcs.read_remote_index")
+@mock.patch("model_manager_lib.gcs.GcsApi.client")
+def test_catalog_falls_back_to_listing_for_stale_or_missing_index(
+        gcs_client: mock.Mock, read_remote_index: mock.Mock, tmp_path
+):
+    gcs_client.list_blobs.return_value = [make_blob("env/framework/name/1/model.tar.gz")]
+    catalog = remote_catalog.RemoteCatalog(
+        gcs_model_directory="gs://some/bucket",
+        snapshot_path=tmp_path.joinpath("catalog.json"),
+        use_index=True,
+        index_max_age_seconds=600,
+    )
+
+    read_remote_index.return_value = make_index(time.time() - 3600, records={})
+    assert len(catalog.get_current_remote_records()) == 1
+    assert catalog.stats.source == "listing"
+
+    read_remote_index.return_value = None
+    assert len(catalog.get_current_remote_records()) == 1
+    assert gcs_client.list_blobs.call_count == 2
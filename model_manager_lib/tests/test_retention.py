@@ -0,0 +1,116 @@
+from unittest import mock
+import json
+import os
+import time
+
+from model_manager_lib import RecordKey
+from model_manager_lib import delta, retention
+from model_manager_lib.storage_backend import BackendBlob, BackendBucket
+
+MODEL_A = RecordKey(framework="tensorflow", name="model_a")
+
+
+def write_object(root, name, data: bytes, age: float = 0):
+    path = root.joinpath(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    if age:
+        os.utime(path, (time.time() - age, time.time() - age))
+
+
+def write_manifest(root, version, sha256s):
+    manifest = delta.Manifest(
+        tarball_generation=1,
+        files=[delta.ManifestEntry(path=sha, size=1, sha256=sha) for sha in sha256s],
+    )
+    write_object(
+        root,
+        f"env/tensorflow/model_a/{version}/manifest.json",
+        json.dumps(delta._manifest_to_dict(manifest)).encode("utf-8"),
+    )
+
+
+def make_remote(root):
+    for version in [0, 1, 2, 3, 4, 5]:
+        write_object(root, f"env/tensorflow/model_a/{version}/model.tar.gz", b"x" * 10)
+    write_object(root, "env/tensorflow/model_b/7/model.tar.gz", b"x" * 10)
+    write_object(root, "env/tensorflow/model_a/_latest.json", b"{}")
+    write_manifest(root, 1, ["old"])
+    write_manifest(root, 5, ["shared"])
+    write_object(root, "env/tensorflow/model_a/_files/old", b"o", age=7 * 24 * 3600)
+    write_object(root, "env/tensorflow/model_a/_files/shared", b"s", age=7 * 24 * 3600)
+    # uploaded for a manifest that isn't published yet
+    write_object(root, "env/tensorflow/model_a/_files/new", b"n")
+
+
+def test_plan_keeps_latest_priority_and_served_versions(tmp_path):
+    make_remote(tmp_path)
+    remote_directory = f"file://{tmp_path}/env"
+
+    plan = retention.plan_remote_retention(
+        remote_directory, keep_versions=2, protected_versions={MODEL_A: {2}}
+    )
+
+    assert plan.kept_versions == {"tensorflow/model_a": [0, 2, 4, 5], "tensorflow/model_b": [7]}
+    assert plan.deleted_versions == {"tensorflow/model_a": [1, 3]}
+    assert sorted(name.split("env/")[1] for name in plan.blob_names) == [
+        "tensorflow/model_a/1/manifest.json",
+        "tensorflow/model_a/1/model.tar.gz",
+        "tensorflow/model_a/3/model.tar.gz",
+        "tensorflow/model_a/_files/old",
+    ]
+    assert plan.bytes_reclaimed == 10 + 10 + 1 + tmp_path.joinpath(
+        "env/tensorflow/model_a/1/manifest.json"
+    ).stat().st_size
+    # the dry run didn't touch anything
+    assert tmp_path.joinpath("env/tensorflow/model_a/1/model.tar.gz").exists()
+
+
+def test_plan_reads_manifests_with_the_master_storage_client(tmp_path):
+    make_remote(tmp_path)
+
+    # master's pinned google-cloud-storage 1.29 blobs only have download_as_string
+    with mock.patch.object(
+        BackendBlob, "download_as_bytes", side_effect=AttributeError("download_as_bytes")
+    ), mock.patch.object(
+        BackendBlob, "download_as_string", autospec=True, side_effect=BackendBlob.download_as_string
+    ) as download_mock:
+        plan = retention.plan_remote_retention(f"file://{tmp_path}/env", keep_versions=2)
+
+    assert download_mock.call_count == 1
+    assert "tensorflow/model_a/_files/old" in [name.split("env/")[1] for name in plan.blob_names]
+    assert "tensorflow/model_a/_files/shared" not in [name.split("env/")[1] for name in plan.blob_names]
+
+
+def test_apply_deletes_in_parallel_batches(tmp_path):
+    make_remote(tmp_path)
+    remote_directory = f"file://{tmp_path}/env"
+    plan = retention.plan_remote_retention(remote_directory, keep_versions=1)
+    assert plan.objects_reclaimed == 6
+
+    with mock.patch.object(
+        BackendBucket, "delete_blobs", autospec=True, side_effect=BackendBucket.delete_blobs
+    ) as delete_blobs:
+        deleted = retention.apply_remote_retention(plan, delete_batch_size=4, max_workers=2)
+
+    assert deleted == 6
+    assert sorted(len(c.args[1]) for c in delete_blobs.call_args_list) == [2, 4]
+    assert sorted(p.name for p in tmp_path.joinpath("env/tensorflow/model_a").iterdir()) == [
+        "0", "5", "_files", "_latest.json",
+    ]
+    assert sorted(p.name for p in tmp_path.joinpath("env/tensorflow/model_a/_files").iterdir()) == [
+        "new", "shared",
+    ]
+    # a second run has nothing left to do
+    assert retention.plan_remote_retention(remote_directory, keep_versions=1).objects_reclaimed == 0
+
+
+def test_served_versions_from_reports():
+    reports = [
+        {"tensorflow": {"model_a": [{"version": 4}, {"version": 0}]}},
+        {"tensorflow": {"model_a": [{"version": 5}], "model_b": [{"version": 7}]}},
+    ]
+    assert retention.served_versions_from_reports(reports) == {
+        MODEL_A: {0, 4, 5},
+        RecordKey(framework="tensorflow", name="model_b"): {7},
+    }
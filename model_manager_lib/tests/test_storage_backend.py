@@ -0,0 +1,140 @@
+from unittest import mock
+import tarfile
+import io
+import os
+
+import pytest
+
+import model_manager_lib
+from model_manager_lib import RecordKey
+from model_manager_lib import delta, gcs, local_filesystem, storage_backend
+from model_manager_lib.storage_backend import FileStorageBackend, StorageBackendException
+
+
+def make_tarball(files: dict) -> bytes:
+    tarball = io.BytesIO()
+    with tarfile.open(fileobj=tarball, mode="w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return tarball.getvalue()
+
+
+def write_object(root, name, data: bytes):
+    root.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+    root.joinpath(name).write_bytes(data)
+
+
+def test_file_backend_objects(tmp_path):
+    backend = FileStorageBackend(tmp_path)
+    backend.write("env/a/model.tar.gz", io.BytesIO(b"0123456789"), metadata={"k": "v"})
+    backend.write("env/b/model.tar.gz", io.BytesIO(b"b"))
+    backend.write("envelope/model.tar.gz", io.BytesIO(b"c"))
+
+    assert [o.name for o in backend.list("env/")] == ["env/a/model.tar.gz", "env/b/model.tar.gz"]
+    assert len(backend.list("env")) == 3
+    assert backend.list("missing/") == []
+
+    stat_object = backend.stat("env/a/model.tar.gz")
+    assert stat_object.size == 10
+    assert stat_object.metadata == {"k": "v"}
+    assert backend.stat("env/a") is None
+    assert backend.stat("env/c/model.tar.gz") is None
+
+    assert backend.read_range("env/a/model.tar.gz", 2, 5, generation=stat_object.generation) == b"2345"
+    with pytest.raises(StorageBackendException):
+        backend.read_range("env/a/model.tar.gz", 0, 1, generation=stat_object.generation + 1)
+    with pytest.raises(StorageBackendException):
+        backend.stat("../outside")
+
+    copied = backend.copy("env/a/model.tar.gz", "env/0/model.tar.gz")
+    assert copied.metadata == {"k": "v"}
+    backend.delete(["env/a/model.tar.gz", "env/0/model.tar.gz", "env/never/model.tar.gz"])
+    assert [o.name for o in backend.list("env/")] == ["env/b/model.tar.gz"]
+    # no temporary or metadata files or emptied directories are left behind
+    assert sorted(p.name for p in tmp_path.joinpath("env").iterdir()) == ["b"]
+
+
+def test_pull_pipeline_against_file_remote(tmp_path):
+    remote = tmp_path.joinpath("remote")
+    files = {"saved_model.pb": os.urandom(300_000), "variables/variables.index": b"index"}
+    write_object(remote, "env/tensorflow/model_a/1/model.tar.gz", make_tarball({"saved_model.pb": b"old"}))
+    write_object(remote, "env/tensorflow/model_a/2/model.tar.gz", make_tarball(files))
+    remote_directory = model_manager_lib.load_remote_model_directory(f"file://{remote}", "env")
+    assert remote_directory == f"file://{remote}/env"
+
+    # nothing may reach for a GCS client
+    with mock.patch.object(gcs.GcsApi, "get_client", side_effect=AssertionError("no GCS")):
+        records = gcs.get_current_remote_records(remote_directory)
+        record = records[RecordKey(framework="tensorflow", name="model_a")]
+        assert record.version == 2
+        assert record.remote_path == f"file://{remote}/env/tensorflow/model_a/2/model.tar.gz"
+
+        for i, kwargs in enumerate([
+            {},
+            {"max_workers": 4, "chunk_size": 64 * 1024},
+            {"streaming": True},
+            {"journaled": True, "chunk_size": 64 * 1024},
+        ]):
+            local = tmp_path.joinpath(f"local-{i}", "tensorflow", "model_a", "2")
+            gcs.download_remote_record_locally(
+                record, str(local), temp_directory=str(tmp_path.joinpath(f"tmp-{i}")), **kwargs
+            )
+            for name, data in files.items():
+                assert local.joinpath(name).read_bytes() == data
+            assert local_filesystem.read_remote_metadata(local)["generation"] == record.generation
+
+        index = gcs.rebuild_remote_index(remote_directory)
+        assert [r.version for _, r in index.records.values()] == [2]
+        assert gcs.read_remote_index(remote_directory, known_generation=index.generation).records is None
+
+        gcs.copy_remote_record_to_priority_bucket(remote_directory, "tensorflow", "model_a", 2)
+        assert gcs.get_current_remote_records(remote_directory)[record.key].is_priority
+        gcs.remove_priority_bucket(remote_directory, "tensorflow", "model_a")
+        assert not remote.joinpath("env", "tensorflow", "model_a", "0", "model.tar.gz").exists()
+
+        delta.publish_manifest_for_remote_record(record, temp_directory=str(tmp_path.joinpath("tmp")))
+        assert delta.read_manifest(record) is not None
+
+        gcs.remove_model_gcs_bucket(remote_directory, "tensorflow", "model_a")
+        assert gcs.get_current_remote_records(remote_directory) == {}
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"streaming": True}, {"max_workers": 4, "chunk_size": 1024}])
+def test_failed_download_leaves_no_staging_behind(tmp_path, kwargs):
+    remote = tmp_path.joinpath("remote")
+    write_object(remote, "env/tensorflow/model_a/1/model.tar.gz", os.urandom(10_000))
+    remote_directory = model_manager_lib.load_remote_model_directory(f"file://{remote}", "env")
+    [record] = gcs.get_current_remote_records(remote_directory).values()
+    local_directory = tmp_path.joinpath("local")
+    staging = local_directory.joinpath(".staging")
+
+    with pytest.raises(Exception):
+        gcs.download_remote_record_locally(
+            record,
+            str(local_directory.joinpath("tensorflow", "model_a", "1")),
+            temp_directory=str(tmp_path.joinpath("tmp")),
+            staging_directory=str(staging),
+            **kwargs,
+        )
+
+    assert list(staging.iterdir()) == []
+    assert list(tmp_path.joinpath("tmp").iterdir()) == []
+    assert not local_directory.joinpath("tensorflow").exists()
+
+
+def test_mirror_only_copies_changed_objects(tmp_path):
+    write_object(tmp_path.joinpath("source"), "env/tensorflow/a/1/model.tar.gz", b"a" * 100)
+    write_object(tmp_path.joinpath("source"), "env/tensorflow/b/1/model.tar.gz", b"b" * 10)
+    source = FileStorageBackend(tmp_path.joinpath("source"))
+    destination = FileStorageBackend(tmp_path.joinpath("mirror"))
+
+    stats = storage_backend.mirror(source, "env", destination, "copy/env", read_size=7)
+    assert (stats.objects_copied, stats.bytes_copied, stats.objects_skipped) == (2, 110, 0)
+    assert tmp_path.joinpath("mirror", "copy", "env", "tensorflow", "a", "1", "model.tar.gz").read_bytes() == b"a" * 100
+
+    source.write("env/tensorflow/b/1/model.tar.gz", io.BytesIO(b"B" * 10))
+    stats = storage_backend.mirror(source, "env", destination, "copy/env")
+    assert (stats.objects_copied, stats.objects_skipped) == (1, 1)
+    assert destination.read_range("copy/env/tensorflow/b/1/model.tar.gz", 0, 9) == b"B" * 10
@@ -1,12 +1,15 @@
 from typing import Tuple
 from unittest import mock
+import threading
 import random
+import time
 import pytest
 import re
 
 import tests
 
 from tensorflow_serving.apis import get_model_status_pb2
+from tensorflow_serving.apis import model_management_pb2
 from google.protobuf import text_format as pbtxt
 import grpc
 
@@ -300,6 +303,62 @@ def test_load_config_with_model_two_models_in_file_remove_model(*args):
         check_config_was_saved(expected, opened_file)
 
 
+def test_batch_commits_adds_and_removes_in_one_write(tmp_path):
+    config_path = tmp_path.joinpath("models.config")
+    config_path.write_text("model_config_list {\n\n}\n")
+    config = tfserving.load_config(str(config_path))
+
+    records = [tests.generate_random_record(framework="tensorflow") for _ in range(3)]
+    batch = config.batch()
+    for record in records:
+        batch.add_model(record, local_path=tests.generate_random_path())
+    batch.remove_model(records[1].key)
+
+    # nothing is written until commit
+    assert config_path.read_text() == "model_config_list {\n\n}\n"
+
+    with mock.patch(
+        "model_manager_lib.tfserving.os.replace", wraps=tfserving.os.replace
+    ) as replace_mock:
+        new_config = batch.commit()
+    replace_mock.assert_called_once()
+
+    expected_names = {records[0].key.name, records[2].key.name}
+    assert new_config.known_model_names == expected_names
+    assert tfserving.load_config(str(config_path)).known_model_names == expected_names
+    assert new_config.original_proto_crc_hash == tfserving.load_config(
+        str(config_path)
+    ).original_proto_crc_hash
+    assert [p.name for p in tmp_path.iterdir()] == ["models.config"]
+
+
+def test_batch_commit_fails_when_crc_is_different(tmp_path):
+    config_path = tmp_path.joinpath("models.config")
+    config_path.write_text("model_config_list {\n\n}\n")
+    config = tfserving.load_config(str(config_path))
+
+    batch = config.batch()
+    batch.add_model(
+        tests.generate_random_record(framework="tensorflow"),
+        local_path=tests.generate_random_path(),
+    )
+    changed_underneath = 'model_config_list {\n  config {\n    name: "other"\n  }\n}\n'
+    config_path.write_text(changed_underneath)
+
+    with pytest.raises(ValueError):
+        batch.commit()
+    assert config_path.read_text() == changed_underneath
+
+
+def test_batch_remove_unknown_model_fails(tmp_path):
+    config_path = tmp_path.joinpath("models.config")
+    config_path.write_text("model_config_list {\n\n}\n")
+    config = tfserving.load_config(str(config_path))
+
+    with pytest.raises(ValueError):
+        config.batch().remove_model(tests.generate_random_record_key())
+
+
 @mock.patch("model_manager_lib.tfserving.pathlib.Path.exists")
 def test_get_known_tensorflow_serving_models_with_empty_file(*args):
     with make_mock_config():
@@ -442,3 +501,115 @@ def test_get_known_tensorflow_serving_models_with_multiple_models_in_file(mock_s
         assert expected_tfserving_versions == actual_tfserving_versions
 
 
+
+
+@mock.patch("model_manager_lib.tfserving.TensorflowServingGrpcConnection.stub")
+def test_get_known_tensorflow_serving_models_bounds_requests_in_flight(mock_stub: mock.Mock):
+    records = [tests.generate_random_record(framework="tensorflow") for _ in range(20)]
+    initial_file = "model_config_list {"
+    for record in records:
+        initial_file += f"""
+            config {{
+                name: "{record.key.name}"
+                base_path: "{tests.generate_random_path()}"
+                model_platform: "tensorflow"
+            }}
+        """
+    initial_file += "}"
+    with make_mock_config(initial_file):
+        config = tfserving.load_config("some/path")
+
+    lock = threading.Lock()
+    in_flight = [0]
+    max_seen_in_flight = [0]
+
+    def slow_grpc_response(request, *args, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            max_seen_in_flight[0] = max(max_seen_in_flight[0], in_flight[0])
+        time.sleep(0.05)
+        with lock:
+            in_flight[0] -= 1
+        return get_model_status_pb2.GetModelStatusResponse(
+            model_version_status=[
+                get_model_status_pb2.ModelVersionStatus(
+                    version=1, state=tfserving.TensorflowServingModelStatus.AVAILABLE.value
+                )
+            ]
+        )
+
+    mock_stub.GetModelStatus = mock.MagicMock(side_effect=slow_grpc_response)
+    known_tfserving_models = tfserving.get_known_tensorflow_serving_models(
+        "localhost:1234", config, max_in_flight=4
+    )
+
+    assert list(known_tfserving_models.keys()) == [record.key for record in records]
+    assert mock_stub.GetModelStatus.call_count == len(records)
+    assert 1 < max_seen_in_flight[0] <= 4
+
+
+@mock.patch("model_manager_lib.tfserving.TensorflowServingGrpcConnection.stub")
+def test_reload_config_sends_config_proto(mock_stub: mock.Mock):
+    record = tests.generate_random_record(framework="tensorflow")
+    with make_mock_config():
+        config = tfserving.load_config("some/path")
+    config._add(tfserving._build_model_config(record, tests.generate_random_path()))
+
+    mock_stub.HandleReloadConfigRequest = mock.MagicMock(
+        return_value=model_management_pb2.ReloadConfigResponse()
+    )
+    tfserving.reload_config("localhost:1234", config)
+
+    request, *_ = mock_stub.HandleReloadConfigRequest.call_args.args
+    assert request.config == config.proto
+
+
+@mock.patch("model_manager_lib.tfserving.TensorflowServingGrpcConnection.stub")
+def test_reload_config_raises_when_rejected(mock_stub: mock.Mock):
+    with make_mock_config():
+        config = tfserving.load_config("some/path")
+
+    response = model_management_pb2.ReloadConfigResponse()
+    response.status.error_code = 3
+    response.status.error_message = "invalid config"
+    mock_stub.HandleReloadConfigRequest = mock.MagicMock(return_value=response)
+
+    with pytest.raises(tfserving.TensorflowServingReloadException) as err:
+        tfserving.reload_config("localhost:1234", config)
+    assert err.value.error_code == 3
+
+
+@mock.patch("model_manager_lib.tfserving.TensorflowServingGrpcConnection.stub")
+def test_wait_for_versions_available_times_each_version(mock_stub: mock.Mock):
+    loaded, still_loading = (
+        tests.generate_random_record(framework="tensorflow"),
+        tests.generate_random_record(framework="tensorflow"),
+    )
+    polls = {loaded.key.name: 0, still_loading.key.name: 0}
+
+    def status_response(request, *args, **kwargs):
+        polls[request.model_spec.name] += 1
+        available = request.model_spec.name == loaded.key.name and polls[loaded.key.name] >= 3
+        state = (
+            tfserving.TensorflowServingModelStatus.AVAILABLE
+            if available
+            else tfserving.TensorflowServingModelStatus.LOADING
+        )
+        return get_model_status_pb2.GetModelStatusResponse(
+            model_version_status=[
+                get_model_status_pb2.ModelVersionStatus(
+                    version=record.version, state=state.value
+                )
+                for record in (loaded, still_loading)
+                if record.key.name == request.model_spec.name
+            ]
+        )
+
+    mock_stub.GetModelStatus = mock.MagicMock(side_effect=status_response)
+    load_times = tfserving.wait_for_versions_available(
+        "localhost:1234", [loaded, still_loading], timeout=0.2, poll_interval=0.01
+    )
+
+    assert list(load_times) == [(loaded.key, loaded.version)]
+    assert 0.02 <= load_times[(loaded.key, loaded.version)] < 0.2
+    assert polls[still_loading.key.name] > polls[loaded.key.name]
@@ -0,0 +1,63 @@
+import subprocess
+import sys
+
+from tensorflow_serving.apis import get_model_status_pb2 as installed_status_pb2
+from tensorflow_serving.config import model_server_config_pb2 as installed_config_pb2
+from google.protobuf import text_format as pbtxt
+import grpc
+
+from model_manager_lib import tfserving_protos
+
+CONFIG = """
+model_config_list {
+  config {
+    name: "tensorflow-model_a"
+    base_path: "/models/tensorflow/model_a"
+    model_platform: "tensorflow"
+    model_version_policy {
+      specific {
+        versions: 3
+      }
+    }
+  }
+}
+"""
+
+
+def test_import_does_not_load_tensorflow():
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "from model_manager_lib import tfserving, tfserving_protos\n"
+            "print('tensorflow' in sys.modules, 'tensorflow_serving' in sys.modules)\n",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    assert output.split() == ["False", "False"]
+
+
+def test_messages_match_tensorflow_serving_on_the_wire_and_in_text():
+    config = pbtxt.Parse(CONFIG, tfserving_protos.model_server_config_pb2.ModelServerConfig())
+    installed_config = pbtxt.Parse(CONFIG, installed_config_pb2.ModelServerConfig())
+    assert config.SerializeToString() == installed_config.SerializeToString()
+    assert pbtxt.MessageToString(config) == pbtxt.MessageToString(installed_config)
+
+    get_model_status_pb2 = tfserving_protos.get_model_status_pb2
+    response = get_model_status_pb2.GetModelStatusResponse(
+        model_version_status=[
+            get_model_status_pb2.ModelVersionStatus(
+                version=3, state=get_model_status_pb2.ModelVersionStatus.State.AVAILABLE
+            )
+        ]
+    )
+    installed = installed_status_pb2.GetModelStatusResponse.FromString(response.SerializeToString())
+    assert installed.model_version_status[0].state == installed_status_pb2.ModelVersionStatus.AVAILABLE
+
+    stub = tfserving_protos.model_service_pb2_grpc.ModelServiceStub(
+        grpc.insecure_channel("localhost:1")
+    )
+    assert callable(stub.GetModelStatus) and callable(stub.HandleReloadConfigRequest)
@@ -1,8 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import is_dataclass, asdict
 from typing import Dict, Tuple
 from uuid import uuid4 as uuid
 from datetime import datetime
 import multiprocessing as mp
+import threading
 import traceback
 
 import statsd
@@ -24,8 +26,12 @@ from fcache.cache import FileCache
 import fastapi
 
 import model_manager_lib
-from model_manager_lib import RecordKey, gcs, local_filesystem, PriorityEndpoint
+from model_manager_lib import (
+    RecordKey, gcs, local_filesystem, local_catalog, delta, download_journal, peer,
+    PriorityEndpoint,
+)
 from model_manager_lib.gcs import GcsDownloadException
+from model_manager_lib.remote_catalog import RemoteCatalog
 
 logging.config.fileConfig("logging.cfg", disable_existing_loggers=False)
 
@@ -43,6 +49,7 @@ HTTP_HOST = "0.0.0.0"
 HTTP_PORT = os.environ["HTTP_PORT"]
 HTTP_WORKERS = os.environ["HTTP_WORKERS"]
 MASTER_URL = os.environ["MASTER_URL"]
+NODE_TARGET = f"{HOSTNAME}:{HTTP_PORT}"
 
 ENVIRONMENT = os.environ["ENVIRONMENT"].lower()
 assert ENVIRONMENT in ["production", "integ", "staging", "test"]
@@ -52,7 +59,60 @@ LOCAL_MODEL_DIRECTORY = pathlib.Path(
 TEMPORARY_MODEL_DIRECTORY = pathlib.Path(
     os.environ["TEMPORARY_MODEL_DOWNLOAD_DIRECTORY"]
 ).absolute()
+# models are extracted here then renamed into place, so it has to be on the same
+# filesystem as LOCAL_MODEL_DIRECTORY
+LOCAL_STAGING_DIRECTORY = pathlib.Path(
+    os.environ.get("LOCAL_STAGING_DIRECTORY", LOCAL_MODEL_DIRECTORY.joinpath(".staging"))
+).absolute()
+CONTENT_STORE_ENABLED = os.environ.get("CONTENT_STORE_ENABLED", "false").lower() == "true"
+CONTENT_STORE_DIRECTORY = LOCAL_MODEL_DIRECTORY.joinpath(
+    local_filesystem.CONTENT_STORE_DIRECTORY_NAME
+)
+DELTA_DOWNLOADS_ENABLED = os.environ.get("DELTA_DOWNLOADS_ENABLED", "false").lower() == "true"
+JOURNALED_DOWNLOADS = os.environ.get("JOURNALED_DOWNLOADS", "false").lower() == "true"
+DOWNLOAD_JOURNAL_MAX_AGE = int(
+    os.environ.get("DOWNLOAD_JOURNAL_MAX_AGE", download_journal.DEFAULT_MAX_JOURNAL_AGE)
+)
+PEER_DOWNLOADS_ENABLED = os.environ.get("PEER_DOWNLOADS_ENABLED", "false").lower() == "true"
+# how long to wait for a peer to finish seeding before downloading from GCS anyway
+PEER_WAIT_TIMEOUT = int(os.environ.get("PEER_WAIT_TIMEOUT", 600))
+PEER_REQUEST_TIMEOUT = int(os.environ.get("PEER_REQUEST_TIMEOUT", peer.DEFAULT_PEER_TIMEOUT))
+# when set, listings and downloads go through the caching gateway instead of GCS
+GCS_GATEWAY_URL = os.environ.get("GCS_GATEWAY_URL", "")
 REMOTE_MODEL_PULL_FREQUENCY = int(os.environ["REMOTE_MODEL_PULL_FREQUENCY"])
+DOWNLOAD_THREADS = int(
+    os.environ.get("DOWNLOAD_THREADS", gcs.DEFAULT_DOWNLOAD_THREADS)
+)
+DOWNLOAD_CHUNK_SIZE = int(
+    os.environ.get("DOWNLOAD_CHUNK_SIZE", gcs.DEFAULT_DOWNLOAD_CHUNK_SIZE)
+)
+STREAMING_DOWNLOADS = os.environ.get("STREAMING_DOWNLOADS", "false").lower() == "true"
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get("MAX_CONCURRENT_DOWNLOADS", 1))
+MAX_DOWNLOAD_BYTES_IN_FLIGHT = int(
+    os.environ.get("MAX_DOWNLOAD_BYTES_IN_FLIGHT", 8 * 1024 ** 3)
+)
+REMOTE_CATALOG_MAX_AGE = int(os.environ.get("REMOTE_CATALOG_MAX_AGE", 60))
+REMOTE_CATALOG_SNAPSHOT_FILE = LOCAL_MODEL_DIRECTORY.joinpath(".remote_catalog.json")
+REMOTE_INDEX_ENABLED = os.environ.get("REMOTE_INDEX_ENABLED", "false").lower() == "true"
+REMOTE_INDEX_MAX_AGE = int(os.environ.get("REMOTE_INDEX_MAX_AGE", 3600))
+REMOTE_LATEST_POINTERS_ENABLED = os.environ.get("REMOTE_LATEST_POINTERS_ENABLED", "false").lower() == "true"
+REMOTE_LATEST_POINTERS_MAX_AGE = int(os.environ.get("REMOTE_LATEST_POINTERS_MAX_AGE", 3600))
+LOCAL_MODEL_INDEX_ENABLED = os.environ.get("LOCAL_MODEL_INDEX_ENABLED", "false").lower() == "true"
+LOCAL_RETENTION_ENABLED = os.environ.get("LOCAL_RETENTION_ENABLED", "false").lower() == "true"
+PREWARM_ENABLED = os.environ.get("PREWARM_ENABLED", "false").lower() == "true"
+PREWARM_MAX_BYTES = int(os.environ.get("PREWARM_MAX_BYTES", 4 * 1024 ** 3))
+# "fadvise" asks the kernel to read ahead, "read" reads the files through
+PREWARM_MODE = os.environ.get("PREWARM_MODE", "fadvise").lower()
+assert PREWARM_MODE in ["fadvise", "read"]
+LOCAL_CATALOG_ENABLED = os.environ.get("LOCAL_CATALOG_ENABLED", "false").lower() == "true"
+LOCAL_TRASH_ENABLED = os.environ.get("LOCAL_TRASH_ENABLED", "false").lower() == "true"
+LOCAL_TRASH_BYTES_PER_SECOND = int(os.environ.get("LOCAL_TRASH_BYTES_PER_SECOND", 256 * 1024 ** 2))
+LOCAL_RETENTION_POLICY = local_filesystem.LocalRetentionPolicy(
+    max_versions=int(os.environ.get("LOCAL_MAX_VERSIONS", 0)),
+    max_bytes=int(os.environ.get("LOCAL_MAX_BYTES", 0)),
+    min_free_bytes=int(os.environ.get("LOCAL_MIN_FREE_BYTES", 0)),
+    keep_rollback=os.environ.get("LOCAL_KEEP_ROLLBACK", "true").lower() == "true",
+)
 LAST_PULL_INFO_FILE = LOCAL_MODEL_DIRECTORY.joinpath("last_pull_info_file.json")
 MAXIMUM_WAIT_TIME = REMOTE_MODEL_PULL_FREQUENCY * 10
 
@@ -69,6 +129,51 @@ start_time = time.time()
 
 statsd_client = statsd.StatsClient(host="localhost", port=8125, prefix=f'modelmanager.puller.{HOSTNAME}')
 
+local_filesystem.check_same_filesystem(LOCAL_STAGING_DIRECTORY, LOCAL_MODEL_DIRECTORY)
+
+if GCS_GATEWAY_URL:
+    gcs.GcsApi.use_gateway(GCS_GATEWAY_URL)
+
+if LOCAL_MODEL_INDEX_ENABLED:
+    local_filesystem.watch(LOCAL_MODEL_DIRECTORY)
+
+local_model_catalog = None
+if LOCAL_CATALOG_ENABLED:
+    local_model_catalog = local_catalog.LocalCatalog(LOCAL_MODEL_DIRECTORY)
+    local_filesystem.use_catalog(local_model_catalog)
+
+if LOCAL_TRASH_ENABLED:
+    local_filesystem.use_trash(
+        LOCAL_MODEL_DIRECTORY,
+        max_bytes_per_second=LOCAL_TRASH_BYTES_PER_SECOND,
+        statsd_client=statsd_client,
+    )
+
+local_retention = (
+    local_filesystem.LocalRetention(
+        LOCAL_MODEL_DIRECTORY, policy=LOCAL_RETENTION_POLICY, statsd_client=statsd_client
+    )
+    if LOCAL_RETENTION_ENABLED
+    else None
+)
+
+# byte ranges of every concurrent download are fetched on this one pool, so the
+# chunks held in memory never exceed DOWNLOAD_THREADS * DOWNLOAD_CHUNK_SIZE
+# however many MAX_CONCURRENT_DOWNLOADS run
+download_chunk_executor = ThreadPoolExecutor(
+    max_workers=DOWNLOAD_THREADS, thread_name_prefix="download_chunk"
+)
+
+remote_catalog = RemoteCatalog(
+    gcs_model_directory=REMOTE_MODEL_DIRECTORY,
+    snapshot_path=REMOTE_CATALOG_SNAPSHOT_FILE,
+    max_age_seconds=REMOTE_CATALOG_MAX_AGE,
+    use_index=REMOTE_INDEX_ENABLED,
+    index_max_age_seconds=REMOTE_INDEX_MAX_AGE,
+    use_pointers=REMOTE_LATEST_POINTERS_ENABLED,
+    pointer_max_age_seconds=REMOTE_LATEST_POINTERS_MAX_AGE,
+)
+
 
 @app.get("/")
 def root():
@@ -79,12 +184,31 @@ def root():
         "local_model_directory": LOCAL_MODEL_DIRECTORY,
         "remote_model_directory": REMOTE_MODEL_DIRECTORY,
         "remote_model_pull_frequency": REMOTE_MODEL_PULL_FREQUENCY,
+        "download_threads": DOWNLOAD_THREADS,
+        "download_chunk_size": DOWNLOAD_CHUNK_SIZE,
+        "streaming_downloads": STREAMING_DOWNLOADS,
+        "local_staging_directory": LOCAL_STAGING_DIRECTORY,
+        "content_store_enabled": CONTENT_STORE_ENABLED,
+        "delta_downloads_enabled": DELTA_DOWNLOADS_ENABLED,
+        "journaled_downloads": JOURNALED_DOWNLOADS,
+        "peer_downloads_enabled": PEER_DOWNLOADS_ENABLED,
+        "gcs_gateway_url": GCS_GATEWAY_URL,
+        "max_concurrent_downloads": MAX_CONCURRENT_DOWNLOADS,
+        "max_download_bytes_in_flight": MAX_DOWNLOAD_BYTES_IN_FLIGHT,
+        "remote_index_enabled": REMOTE_INDEX_ENABLED,
+        "remote_latest_pointers_enabled": REMOTE_LATEST_POINTERS_ENABLED,
+        "local_retention_enabled": LOCAL_RETENTION_ENABLED,
+        "local_retention_policy": LOCAL_RETENTION_POLICY,
+        "local_trash_enabled": LOCAL_TRASH_ENABLED,
+        "local_catalog_enabled": LOCAL_CATALOG_ENABLED,
+        "prewarm_enabled": PREWARM_ENABLED,
+        "prewarm_max_bytes": PREWARM_MAX_BYTES,
         "uptime": f"{round(time.time() - start_time, 2)} seconds",
     }
 
 
 def register():
-    target = f"{HOSTNAME}:{HTTP_PORT}"
+    target = NODE_TARGET
     response = requests.post(
         f"{MASTER_URL}/register",
         timeout=1,
@@ -113,6 +237,7 @@ def health_test():
         run_time = last_pull_data.get("run_time", 0)
         took = last_pull_data.get("took", 0)
         remotes_downloaded = last_pull_data.get("remotes_downloaded", [])
+        download_timings = last_pull_data.get("download_timings", [])
         time_since_last_run = current_time - run_time
         if current_time - run_time > MAXIMUM_WAIT_TIME:
             raise fastapi.HTTPException(
@@ -127,6 +252,7 @@ def health_test():
             "last_run_timestamp": datetime.fromtimestamp(run_time).isoformat(),
             "took": took,
             "models_downloaded": remotes_downloaded,
+            "download_timings": download_timings,
         }
 
     registration_response = register()
@@ -136,6 +262,7 @@ def health_test():
         "data": root_data,
         "registration": registration_response,
         "pull_remotes": pull_data,
+        "local_catalog": local_model_catalog.summary() if local_model_catalog else None,
     }
 
 
@@ -150,8 +277,9 @@ def manual_pull():
         log_handler.setFormatter(logging.Formatter("%(levelname)s:%(message)s"))
         base_logger.addHandler(log_handler)
         base_logger.setLevel(logging.DEBUG)
-        pull_missing_local_models_from_remote()
-        check_priority_bucket_state()
+        remotes = get_current_remote_records(force_refresh=True)
+        pull_missing_local_models_from_remote(remotes)
+        check_priority_bucket_state(remotes)
     except Exception as err:
         log.exception(err)
         status_code = 500
@@ -182,11 +310,23 @@ def current_local_records():
     )
 
 
+@app.get("/local/catalog")
+def local_catalog_versions():
+    if not local_model_catalog:
+        raise fastapi.HTTPException(status_code=404, detail="local catalog is not enabled")
+    return local_catalog.metadata_to_jsonable(local_model_catalog.get_versions())
+
+
+@app.get("/local/usage")
+def local_usage():
+    if not local_retention:
+        raise fastapi.HTTPException(status_code=404, detail="local retention is not enabled")
+    return local_retention.report()
+
+
 @app.get("/remote/current")
 def current_remote_records():
-    current_remote_records_dict = gcs.get_current_remote_records(
-        gcs_model_directory=REMOTE_MODEL_DIRECTORY
-    )
+    current_remote_records_dict = get_current_remote_records()
     return model_manager_lib.records_dict_to_jsonable(
         current_remote_records_dict
     )
@@ -205,7 +345,56 @@ def remove_model_by_name(framework: str, name: str):
     return model_manager_lib.records_dict_to_jsonable(local_records_dict)
 
 
-def pull_missing_local_models_from_remote() -> Tuple[gcs.RemoteRecord]:
+def get_published_model_path(framework: str, name: str, version: int) -> pathlib.Path:
+    if framework.startswith(".") or name.startswith(".") or version <= 0:
+        raise fastapi.HTTPException(status_code=404, detail="not a published model version")
+    model_path = LOCAL_MODEL_DIRECTORY.joinpath(framework, name, str(version))
+    if not model_path.is_dir():
+        raise fastapi.HTTPException(status_code=404, detail=f"{model_path} is not published here")
+    return model_path
+
+
+@app.get("/peer/models/{framework}/{name}/{version}/manifest")
+def peer_model_manifest(framework: str, name: str, version: int):
+    return peer.get_peer_manifest(get_published_model_path(framework, name, version))
+
+
+@app.get("/peer/models/{framework}/{name}/{version}/files/{file_path:path}")
+def peer_model_file(framework: str, name: str, version: int, file_path: str):
+    model_path = get_published_model_path(framework, name, version)
+    resolved_path = peer.resolve_peer_file(model_path, file_path)
+    if resolved_path is None:
+        raise fastapi.HTTPException(status_code=404, detail=f"{file_path} is not in {model_path}")
+    statsd_client.incr("peer.files_served")
+    return fastapi.responses.StreamingResponse(
+        peer.iter_peer_file(resolved_path),
+        media_type="application/octet-stream",
+        headers={"Content-Length": str(resolved_path.stat().st_size)},
+    )
+
+
+def get_current_remote_records(force_refresh=False) -> Dict[RecordKey, gcs.RemoteRecord]:
+    """Retrieves the current remote records through the remote catalog. The catalog
+    answers repeated calls within REMOTE_CATALOG_MAX_AGE from memory, and only
+    rebuilds records for blobs that changed when it does list.
+    """
+    listings = remote_catalog.stats.listings
+    remotes = remote_catalog.get_current_remote_records(force_refresh=force_refresh)
+    if remote_catalog.stats.listings == listings:
+        statsd_client.incr("remote_catalog.cached")
+    else:
+        stats = remote_catalog.stats
+        statsd_client.incr("remote_catalog.hits", stats.hits)
+        statsd_client.incr("remote_catalog.misses", stats.misses)
+        statsd_client.gauge("remote_catalog.entries", stats.entries)
+        statsd_client.incr(f"remote_catalog.source.{stats.source}")
+        statsd_client.timing("remote_catalog.listing", stats.listing_duration * 1000)
+    return remotes
+
+
+def pull_missing_local_models_from_remote(
+    remotes: Dict[RecordKey, gcs.RemoteRecord] = None
+) -> Tuple[gcs.RemoteRecord]:
     local_model_directory = LOCAL_MODEL_DIRECTORY
     remote_model_directory = REMOTE_MODEL_DIRECTORY
     automated_pull_start_time = time.time()
@@ -213,42 +402,44 @@ def pull_missing_local_models_from_remote() -> Tuple[gcs.RemoteRecord]:
         f"preparing to pull local={local_model_directory} remote={remote_model_directory}"
     )
 
+    if remotes is None:
+        remotes = get_current_remote_records()
+
     exceptions = []
-    remotes_missing = get_remotes_missing_from_local(
-        local_model_directory, remote_model_directory
-    )
+    remotes_missing = get_remotes_missing_from_local(local_model_directory, remotes)
     statsd_client.gauge("remotes_missing", len(remotes_missing))
 
     if len(remotes_missing) == 0:
         log.info("No missing remotes to pull!")
 
-    for remote in remotes_missing:
-        log.debug(f"processing remote={remote}")
-        expected_path = local_filesystem.get_expected_local_path(
-            model_directory=local_model_directory, record=remote
-        )
-        try:
-            log.debug(f"downloading remote={remote} to path={expected_path}")
-            with statsd_client.timer('gcs.download_remote'):
-                gcs.download_remote_record_locally(
-                    remote_record=remote,
-                    local_directory=expected_path,
-                    temp_directory=TEMPORARY_MODEL_DIRECTORY,
-                )
-        except GcsDownloadException as err:
-            statsd_client.incr(f'download_errors.{err.remote}')
-            log.exception(f'Failed to download remote={err.remote}',
-                          exc_info=err)
-
-        except Exception as err:
-            log.warning(
-                f"exception thrown during processing remote={remote} delaying exception"
-            )
-            log.exception(
-                "unhandled exception thrown during updating remote state",
-                exc_info=err,
+    download_timings = []
+    budget = DownloadBudget(
+        max_count=MAX_CONCURRENT_DOWNLOADS, max_bytes=MAX_DOWNLOAD_BYTES_IN_FLIGHT
+    )
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS) as executor:
+        futures = {}
+        for remote in remotes_missing:
+            size = get_remote_size(remote)
+            budget.acquire(size)
+            future = executor.submit(
+                fetch_remote, remote, size, automated_pull_start_time
             )
-            exceptions.append(err)
+            future.add_done_callback(lambda _, size=size: budget.release(size))
+            futures[future] = remote
+
+        for future in as_completed(futures):
+            remote = futures[future]
+            try:
+                download_timings.append(future.result())
+            except Exception as err:
+                log.warning(
+                    f"exception thrown during processing remote={remote} delaying exception"
+                )
+                log.exception(
+                    "unhandled exception thrown during updating remote state",
+                    exc_info=err,
+                )
+                exceptions.append(err)
 
     for exception in exceptions:
         log.warning("throwing delayed exceptions!")
@@ -259,15 +450,307 @@ def pull_missing_local_models_from_remote() -> Tuple[gcs.RemoteRecord]:
     last_pull_data["run_time"] = automated_pull_start_time
     last_pull_data["took"] = time.time() - automated_pull_start_time
     last_pull_data["remotes_downloaded"] = [asdict(r) for r in remotes_missing]
+    last_pull_data["download_timings"] = download_timings
     last_pull_data.sync()
 
 
+class DownloadBudget:
+    """Bounds the downloads in flight by both count and total bytes. A single
+    download larger than the whole byte budget is still let through on its own,
+    otherwise it would never run.
+    """
+
+    def __init__(self, max_count: int, max_bytes: int):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.count = 0
+        self.bytes = 0
+        self.condition = threading.Condition()
+
+    def _has_room(self, size: int) -> bool:
+        return self.count == 0 or (
+            self.count < self.max_count and self.bytes + size <= self.max_bytes
+        )
+
+    def acquire(self, size: int):
+        with self.condition:
+            self.condition.wait_for(lambda: self._has_room(size))
+            self.count += 1
+            self.bytes += size
+
+    def release(self, size: int):
+        with self.condition:
+            self.count -= 1
+            self.bytes -= size
+            self.condition.notify_all()
+
+
+def get_remote_size(remote: gcs.RemoteRecord) -> int:
+    try:
+        return gcs.get_remote_record_size(remote)
+    except Exception as err:
+        log.warning(f"failed to look up size of remote={remote} err={err}")
+        return 0
+
+
+def fetch_remote(remote: gcs.RemoteRecord, size: int, pull_start_time: float) -> dict:
+    """download_remote once local retention made room for it, then prewarms the
+    published version. A download that doesn't fit is skipped and retried on the
+    next pull.
+    """
+    if not local_retention:
+        return download_and_prepare_remote(remote, size, pull_start_time)
+
+    reserved_bytes = size * local_filesystem.DOWNLOAD_DISK_OVERHEAD
+    if not local_retention.reserve(remote, reserved_bytes):
+        return {
+            "record": asdict(remote),
+            "bytes": size,
+            "waited": time.time() - pull_start_time,
+            "error": "not enough local disk",
+            "took": 0,
+        }
+    try:
+        return download_and_prepare_remote(remote, size, pull_start_time)
+    finally:
+        local_retention.release(reserved_bytes)
+
+
+def download_and_prepare_remote(
+    remote: gcs.RemoteRecord, size: int, pull_start_time: float
+) -> dict:
+    timing = download_remote(remote, size, pull_start_time)
+    if not timing["error"]:
+        record_remote_in_catalog(remote, timing)
+    return prewarm_remote(remote, timing)
+
+
+def record_remote_in_catalog(remote: gcs.RemoteRecord, timing: dict):
+    if not local_model_catalog:
+        return
+    if timing["delta"]:
+        source = "delta"
+    elif timing["peer"]:
+        source = "peer"
+    else:
+        source = "gcs"
+    expected_path = local_filesystem.get_expected_local_path(
+        model_directory=LOCAL_MODEL_DIRECTORY, record=remote
+    )
+    try:
+        local_model_catalog.record_version(
+            expected_path, fetch_seconds=timing["took"], source=source
+        )
+    except Exception as err:
+        # readers scan the directory until the next reconcile records it, without
+        # the fetch details
+        log.exception(f"failed to record remote={remote} in the local catalog", exc_info=err)
+        local_model_catalog.invalidate()
+
+
+def prewarm_remote(remote: gcs.RemoteRecord, timing: dict) -> dict:
+    timing["prewarm"] = None
+    if not PREWARM_ENABLED or timing["error"]:
+        return timing
+
+    expected_path = local_filesystem.get_expected_local_path(
+        model_directory=LOCAL_MODEL_DIRECTORY, record=remote
+    )
+    try:
+        timing["prewarm"] = local_filesystem.prewarm_model_directory(
+            expected_path,
+            max_bytes=PREWARM_MAX_BYTES,
+            use_fadvise=PREWARM_MODE == "fadvise",
+            statsd_client=statsd_client,
+        )
+    except OSError as err:
+        log.warning(f"failed to prewarm remote={remote} path={expected_path} err={err}")
+    return timing
+
+
+def download_remote(remote: gcs.RemoteRecord, size: int, pull_start_time: float) -> dict:
+    log.debug(f"processing remote={remote}")
+    expected_path = local_filesystem.get_expected_local_path(
+        model_directory=LOCAL_MODEL_DIRECTORY, record=remote
+    )
+    download_start_time = time.time()
+    timing = {
+        "record": asdict(remote),
+        "bytes": size,
+        "waited": download_start_time - pull_start_time,
+        "error": None,
+        "delta": None,
+        "peer": None,
+    }
+    # a re-uploaded version replaces the local copy, which neither the delta
+    # base nor the peers holding the old object can be trusted for
+    replace = os.path.exists(expected_path)
+    use_peers = PEER_DOWNLOADS_ENABLED and not remote.is_priority and not replace
+    try:
+        if DELTA_DOWNLOADS_ENABLED and not replace:
+            delta_stats = download_remote_delta(remote, expected_path)
+            if delta_stats:
+                timing["delta"] = asdict(delta_stats)
+                timing["took"] = time.time() - download_start_time
+                log.info(f"assembled remote={remote} from delta timing={timing}")
+                if use_peers:
+                    report_peer_fetch(remote, success=True)
+                return timing
+
+        if use_peers:
+            timing["peer"] = download_remote_from_peer(remote, expected_path)
+            if timing["peer"]:
+                timing["took"] = time.time() - download_start_time
+                log.info(f"fetched remote={remote} from peer timing={timing}")
+                report_peer_fetch(remote, success=True)
+                return timing
+
+        log.debug(f"downloading remote={remote} to path={expected_path}")
+        with statsd_client.timer('gcs.download_remote'):
+            gcs.download_remote_record_locally(
+                remote_record=remote,
+                local_directory=expected_path,
+                temp_directory=TEMPORARY_MODEL_DIRECTORY,
+                chunk_size=DOWNLOAD_CHUNK_SIZE,
+                max_workers=DOWNLOAD_THREADS,
+                statsd_client=statsd_client,
+                streaming=STREAMING_DOWNLOADS,
+                staging_directory=LOCAL_STAGING_DIRECTORY,
+                content_store_directory=CONTENT_STORE_DIRECTORY if CONTENT_STORE_ENABLED else None,
+                journaled=JOURNALED_DOWNLOADS,
+                replace=replace,
+                executor=download_chunk_executor,
+            )
+    except GcsDownloadException as err:
+        statsd_client.incr(f'download_errors.{err.remote}')
+        log.exception(f'Failed to download remote={err.remote}',
+                      exc_info=err)
+        timing["error"] = err.message
+    except local_filesystem.LocalPublishException as err:
+        statsd_client.incr(f'publish_errors.{remote}')
+        log.exception(f'Failed to publish remote={remote} to path={expected_path}',
+                      exc_info=err)
+        timing["error"] = err.message
+
+    timing["took"] = time.time() - download_start_time
+    log.info(f"downloaded remote={remote} timing={timing}")
+    if use_peers:
+        report_peer_fetch(remote, success=timing["error"] is None)
+    return timing
+
+
+def download_remote_from_peer(remote: gcs.RemoteRecord, expected_path: str):
+    """Fetches the remote from the puller the master assigns. Returns None whenever
+    it should be downloaded from GCS instead.
+    """
+    peer_target = request_peer_source(remote)
+    if peer_target is None:
+        return None
+
+    try:
+        expected_manifest = delta.read_manifest(remote)
+    except Exception as err:
+        log.warning(f"failed to read remote manifest of remote={remote} err={err}")
+        expected_manifest = None
+
+    try:
+        with statsd_client.timer('peer.download_remote'):
+            fetched_bytes = peer.download_remote_record_from_peer(
+                remote_record=remote,
+                peer=peer_target,
+                local_directory=expected_path,
+                staging_directory=LOCAL_STAGING_DIRECTORY,
+                expected_manifest=expected_manifest,
+                timeout=PEER_REQUEST_TIMEOUT,
+                statsd_client=statsd_client,
+                content_store_directory=CONTENT_STORE_DIRECTORY if CONTENT_STORE_ENABLED else None,
+            )
+        return {"peer": peer_target, "bytes": fetched_bytes}
+    except Exception as err:
+        statsd_client.incr('peer.errors')
+        log.exception(f'Failed to fetch remote={remote} from peer={peer_target}, falling back to GCS',
+                      exc_info=err)
+        return None
+
+
+def request_peer_source(remote: gcs.RemoteRecord):
+    """Asks the master which peer to fetch the remote from, waiting up to
+    PEER_WAIT_TIMEOUT while other pullers seed it. Returns None for GCS.
+    """
+    deadline = time.time() + PEER_WAIT_TIMEOUT
+    while True:
+        try:
+            response = requests.post(
+                f"{MASTER_URL}/peers/assign",
+                timeout=1,
+                json={"target": NODE_TARGET, **peer_version(remote)},
+            )
+            response.raise_for_status()
+            assignment = response.json()
+        except Exception as err:
+            log.warning(f"failed to get a peer assignment for remote={remote} err={err}")
+            return None
+
+        if assignment["source"] == peer.PEER_SOURCE_PEER:
+            return assignment["peer"]
+        if assignment["source"] == peer.PEER_SOURCE_GCS or time.time() > deadline:
+            return None
+        log.debug(f"waiting for a peer to finish seeding remote={remote}")
+        time.sleep(assignment.get("retry_after", peer.DEFAULT_PEER_RETRY_AFTER))
+
+
+def report_peer_fetch(remote: gcs.RemoteRecord, success: bool):
+    try:
+        requests.post(
+            f"{MASTER_URL}/peers/complete",
+            timeout=1,
+            json={"target": NODE_TARGET, "success": success, **peer_version(remote)},
+        ).raise_for_status()
+    except Exception as err:
+        log.warning(f"failed to report peer fetch of remote={remote} err={err}")
+
+
+def peer_version(remote: gcs.RemoteRecord) -> dict:
+    return {
+        "framework": remote.key.framework,
+        "name": remote.key.name,
+        "version": remote.version,
+    }
+
+
+def download_remote_delta(remote: gcs.RemoteRecord, expected_path: str):
+    """Assembles the remote from the current local version of the same model plus
+    the files that changed. Returns None whenever the full download should be
+    used instead.
+    """
+    base = local_filesystem.get_current_local_models(
+        LOCAL_MODEL_DIRECTORY, framework=remote.key.framework, name=remote.key.name
+    ).get(remote.key)
+    if base is None or str(base.full_model_path) == str(expected_path):
+        return None
+
+    try:
+        with statsd_client.timer('delta.download_remote'):
+            return delta.download_remote_record_delta(
+                remote_record=remote,
+                base_model_directory=base.full_model_path,
+                local_directory=expected_path,
+                staging_directory=LOCAL_STAGING_DIRECTORY,
+                statsd_client=statsd_client,
+                content_store_directory=CONTENT_STORE_DIRECTORY if CONTENT_STORE_ENABLED else None,
+            )
+    except Exception as err:
+        statsd_client.incr('delta.errors')
+        log.exception(f'Failed delta download of remote={remote}, falling back to full download',
+                      exc_info=err)
+        return None
+
+
 def get_remotes_missing_from_local(
-    local_model_directory: str, remote_model_directory: str
+    local_model_directory: str, remotes: Dict[RecordKey, gcs.RemoteRecord]
 ) -> Tuple[gcs.RemoteRecord]:
     locals = local_filesystem.get_current_local_models(local_model_directory)
     log.debug(f"found locals={locals}")
-    remotes = gcs.get_current_remote_records(remote_model_directory)
     log.debug(f"found remotes={remotes}")
 
     missing_remotes = [
@@ -288,10 +771,50 @@ def get_remotes_missing_from_local(
         if need_pull_remote(record_key, remote_record, locals)
     ]
     log.debug(f"found new_remotes={newer_remotes}")
-    return tuple(missing_remotes + newer_remotes)
+
+    changed_remotes = [
+        remote_record
+        for record_key, remote_record in remotes.items()
+        if record_is_reuploaded(remote_record, locals.get(record_key))
+    ]
+    if changed_remotes:
+        log.warning(f"found re-uploaded remotes={changed_remotes}")
+        statsd_client.incr("remotes_reuploaded", len(changed_remotes))
+    return tuple(
+        sorted(
+            missing_remotes + newer_remotes + changed_remotes,
+            key=lambda remote: download_priority(remote, locals),
+        )
+    )
 
 
-def check_priority_bucket_state() -> Dict[RecordKey, local_filesystem.LocalRecord]:
+def record_is_reuploaded(
+    remote: gcs.RemoteRecord, local: local_filesystem.LocalRecord = None
+) -> bool:
+    """Whether the local copy of the same version was downloaded from a remote
+    object that has since been replaced, judged by the metadata kept beside it.
+    """
+    if local is None or (local.version, local.is_priority) != (remote.version, remote.is_priority):
+        return False
+    return gcs.remote_record_changed(
+        remote, local_filesystem.read_remote_metadata(local.full_model_path)
+    )
+
+
+def download_priority(remote: gcs.RemoteRecord, locals) -> Tuple[int, int]:
+    """Orders downloads so priority bucket records land first, then newer versions
+    of models we already serve (newest first), and brand new models last.
+    """
+    if remote.is_priority:
+        return 0, -remote.version
+    if remote.key in locals:
+        return 1, -remote.version
+    return 2, -remote.version
+
+
+def check_priority_bucket_state(
+    remotes: Dict[RecordKey, gcs.RemoteRecord] = None
+) -> Dict[RecordKey, local_filesystem.LocalRecord]:
     log.debug(
         f"preparing to check priority_bucket local={LOCAL_MODEL_DIRECTORY} remote={REMOTE_MODEL_DIRECTORY}"
     )
@@ -299,9 +822,7 @@ def check_priority_bucket_state() -> Dict[RecordKey, local_filesystem.LocalRecor
         model_directory=LOCAL_MODEL_DIRECTORY
     )
     log.debug(f"found locals={current_local}")
-    current_remote = gcs.get_current_remote_records(
-        gcs_model_directory=REMOTE_MODEL_DIRECTORY
-    )
+    current_remote = remotes if remotes is not None else get_current_remote_records()
     log.debug(f"found remotes={current_remote}")
     records_to_report = {
         record_key: local_record
@@ -326,12 +847,20 @@ def time_fn(fn, *args, **kwargs):
 
 def pull_remote_state_loop():
     log.info(f"starting main background loop")
+    # the only process on the node that empties the trash, the http workers and
+    # config_manager only put into it
+    trash = local_filesystem.get_trash_collector(LOCAL_MODEL_DIRECTORY)
+    if trash:
+        trash.start()
     while True:
         with statsd_client.timer("loop_time"):
             try:
                 log.info("starting pull remote state")
-                time_fn(pull_missing_local_models_from_remote)
-                time_fn(check_priority_bucket_state)
+                if local_model_catalog:
+                    time_fn(local_model_catalog.reconcile)
+                remotes = time_fn(get_current_remote_records, force_refresh=True)
+                time_fn(pull_missing_local_models_from_remote, remotes)
+                time_fn(check_priority_bucket_state, remotes)
                 log.info("finished pull of remote statea")
             except Exception as err:
                 log.exception(
@@ -344,6 +873,16 @@ def pull_remote_state_loop():
 
 if __name__ == "__main__":
     statsd_client.incr("startup")
+    # nothing is downloading yet, anything that can't be resumed is garbage
+    removed_downloads = download_journal.sweep_stale_downloads(
+        TEMPORARY_MODEL_DIRECTORY,
+        staging_directory=LOCAL_STAGING_DIRECTORY,
+        max_age_seconds=DOWNLOAD_JOURNAL_MAX_AGE if JOURNALED_DOWNLOADS else 0,
+    )
+    statsd_client.incr("stale_downloads_removed", removed_downloads)
+    if local_model_catalog:
+        # record what's on disk before anything lists local models from the catalog
+        local_model_catalog.reconcile()
     processes = []
     if REMOTE_MODEL_PULL_FREQUENCY > 0:
         processes.append(
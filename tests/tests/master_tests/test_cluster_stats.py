@@ -32,3 +32,9 @@ def test_single_model_single_version_is_served():
     )
     assert "local_filesystem" in response["config_manager"]["config_manager:8002"]
     assert "serving_all" in response["config_manager"]["config_manager:8002"]
+    # nodes that answered report their data, not a failure message
+    assert isinstance(
+        response["remote_model_puller"]["remote_model_puller:8001"]["local_filesystem"], dict
+    )
+    assert isinstance(response["config_manager"]["config_manager:8002"]["local_filesystem"], dict)
+    assert isinstance(response["config_manager"]["config_manager:8002"]["serving_all"], dict)
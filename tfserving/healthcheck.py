@@ -4,8 +4,7 @@ import pathlib
 import time
 import sys
 import os
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-from model_manager_lib import tfserving, local_filesystem
+from model_manager_lib import tfserving, local_filesystem, local_catalog
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -20,6 +19,7 @@ TENSORFLOW_SERVING_CONFIG_FILE: pathlib.Path = pathlib.Path(os.environ['TENSORFL
 TENSORFLOW_SERVING_GRPC_TARGET: str = f"localhost:{os.environ['TENSORFLOW_SERVING_GRPC_PORT']}"
 MODEL_CONFIG_FILE_POLL_WAIT: int = int(os.environ['MODEL_CONFIG_FILE_POLL_WAIT'])
 FILE_SYSTEM_POLL_WAIT: int = int(os.environ['FILE_SYSTEM_POLL_WAIT'])
+LOCAL_CATALOG_ENABLED: bool = os.environ.get("LOCAL_CATALOG_ENABLED", "false").lower() == "true"
 LAST_HEALTH_CHECK_STATE_FILE: str = "last_health_check_state.json"
 
 MAXIMUM_WAIT_TIME_FOR_UPDATE: int = int(
@@ -37,6 +37,10 @@ if __name__ == "__main__":
 
     log.info("Starting healthcheck script")
 
+    # the puller creates the catalog, never create an empty one here
+    if LOCAL_CATALOG_ENABLED and LOCAL_MODEL_DIRECTORY.joinpath(local_catalog.CATALOG_FILE_NAME).exists():
+        local_filesystem.use_catalog(local_catalog.LocalCatalog(LOCAL_MODEL_DIRECTORY))
+
     current_known_local_models = local_filesystem.get_current_local_models(
         model_directory=LOCAL_MODEL_DIRECTORY,
         framework="tensorflow",